@@ -10,6 +10,8 @@ from yaml.parser import ParserError
 from ._commands.backup import main_backup
 from ._commands.cleanup import main_cleanup
 from ._commands.upload import main_upload
+from ._commands.verify import main_verify
+from ._commands.watch import main_watch
 from .actions.builtin._register import register
 from .actions.container import register_actions_from_module
 from .config import Config, StorageConfig
@@ -71,12 +73,20 @@ def _parse_arguments():
                                        metavar='mode',
                                        dest='mode')
 
-    subparsers.add_parser('complete',
-                          help='Checks config, does a backup, uploads the backup and does cleanup')
-    subparsers.add_parser('backup', help='Does a backup')
+    complete_parser = subparsers.add_parser('complete',
+                                            help='Checks config, does a backup, uploads the backup and does cleanup')
+    backup_parser = subparsers.add_parser('backup', help='Does a backup')
     upload_parser = subparsers.add_parser('upload', help='Upload a pending backups')
     subparsers.add_parser('cleanup', help='Does cleanup of backups')
     subparsers.add_parser('check-config', help='Checks configuration to catch issues')
+    subparsers.add_parser('watch', help='Records the changes of the watchPaths until it is stopped')
+    verify_parser = subparsers.add_parser('verify', help='Checks the files of a backup against their hashes')
+
+    for resumable_parser in (complete_parser, backup_parser):
+        resumable_parser.add_argument('--resume',
+                                      help=('Resumes the last backup if it was interrupted, running only the tasks '
+                                            'that did not finish'),
+                                      action='store_true')
 
     upload_parser.add_argument('--backup',
                                help=('Selects which backup to upload by the name of the folder (which is the date of '
@@ -85,6 +95,13 @@ def _parse_arguments():
                                help='Force upload the backup even if the backup was already uploaded',
                                action='store_true')
 
+    verify_parser.add_argument('--backup',
+                               help=('Selects which backup to verify by the name of the folder (which is the date of '
+                                     'the backup)'))
+    verify_parser.add_argument('--workers',
+                               help='Number of processes that read the files (default: number of CPUs)',
+                               type=int)
+
     return parser.parse_args()
 
 
@@ -128,15 +145,21 @@ def main():
     try:
         _load_secrets(config)
         if args.mode == 'backup':
-            backup = main_backup(config)
+            backup = main_backup(config, resume=args.resume)
             logger.info(f'Backup done: {backup.absolute()}')
         elif args.mode == 'upload':
             backup_path = (config.backups_path / (args.backup if args.backup is not None else 'current')).resolve()
             main_upload(config, backup_path, force=args.force)
         elif args.mode == 'cleanup':
             main_cleanup(config)
+        elif args.mode == 'watch':
+            main_watch(config)
+        elif args.mode == 'verify':
+            backup_path = (config.backups_path / (args.backup if args.backup is not None else 'current')).resolve()
+            if not main_verify(config, backup_path, workers=args.workers):
+                sys.exit(1)
         elif args.mode in ('complete', None):
-            backup = main_backup(config)
+            backup = main_backup(config, resume=getattr(args, 'resume', False))
             main_upload(config, backup)
             main_cleanup(config)
     except Exception as e:
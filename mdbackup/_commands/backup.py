@@ -1,3 +1,5 @@
+import asyncio
+from concurrent.futures import Executor, FIRST_COMPLETED, FIRST_EXCEPTION, Future, ThreadPoolExecutor, wait
 from datetime import datetime
 import logging
 import os
@@ -5,16 +7,31 @@ from pathlib import Path
 import re
 import shutil
 import sys
-from typing import Any, Dict, List, Tuple
+from typing import Any, Callable, Dict, Generator, List, Optional, Tuple
 
+from ..actions.builtin.cloud import check_cloud_provider
 from ..actions.runner import run_task_actions
-from ..config import Config, SecretConfig
+from ..actions.runner_async import run_task_actions_async, submit_to_event_loop
+from ..catalog import Catalog
+from ..chunk_store import RECIPE_SUFFIX
+from ..config import Config, SecretConfig, StorageConfig
 from ..hooks import run_hook
+from ..storage import CLOUD_RECEIPT_SUFFIX
+from ..tasks.journal import Journal
+from ..tasks.task import Task
 from ..tasks.tasks import Tasks
 from ..utils import write_data_file
 
 
+# Suffix that some final actions add to their ``path`` to name what they write
+_RESULT_SUFFIXES = {
+    'to-chunks': RECIPE_SUFFIX,
+    'directory-to-chunks': RECIPE_SUFFIX,
+    'to-cloud': CLOUD_RECEIPT_SUFFIX,
+}
 MANIFEST_VERSION = 1
+JOURNAL_FILE_NAME = '.journal'
+CATALOG_FILE_NAME = '.catalog.sqlite'
 
 
 def _generate_backup_path(backups_folder: Path) -> Path:
@@ -72,12 +89,252 @@ def _inject_resolved_env_into_actions(
     return new_actions
 
 
+def _final_actions(action_def: Dict[str, Any]) -> Generator[Tuple[str, Any], None, None]:
+    """
+    :return: The name and parameters of the action, or, if it is a ``tee``, of the final action of each branch (with
+    the parameters that the branch inherits from the tee)
+    """
+    key, params = next(iter(action_def.items()))
+    if key != 'tee' or not isinstance(params, dict):
+        yield key, params
+        return
+
+    inherited_params = {key: value for key, value in params.items() if key not in ('branches', 'chunkSize')}
+    for branch in params.get('branches') or []:
+        # Malformed branches are left for the tee action to complain about
+        if not isinstance(branch, list) or len(branch) == 0 or not isinstance(branch[-1], dict):
+            continue
+        branch_key, branch_params = next(iter(branch[-1].items()))
+        if isinstance(branch_params, dict):
+            branch_params = {**inherited_params, **branch_params}
+        yield from _final_actions({branch_key: branch_params})
+
+
+def _check_cloud_actions(all_tasks: List[Tasks], cloud_providers: List[StorageConfig]):
+    """
+    Checks the ``to-cloud`` actions of the tasks (see ``check_cloud_provider``) before running any of them, so a
+    provider that cannot be used does not make the backup fail when it is half done.
+    """
+    logger = logging.getLogger(__name__).getChild('check_cloud_actions')
+    for tasks in all_tasks:
+        for task in tasks.tasks:
+            for key, params in _final_actions(task.actions[-1]) if len(task.actions) > 0 else ():
+                if key != 'to-cloud':
+                    continue
+                try:
+                    check_cloud_provider({**params, '_cloud_providers': cloud_providers}
+                                         if isinstance(params, dict) else params)
+                except Exception:
+                    logger.error(f'Action to-cloud of task {task.name} ({tasks.file_name}) cannot be run')
+                    raise
+
+
+def _partial_results(final_action: Dict[str, Any]) -> List[Path]:
+    """
+    :return: The paths inside the backup folder where the final action writes: its ``path`` (or ``to``) with the
+    suffix that the action adds to it (if any), or the ones of the final actions of the branches of a ``tee``
+    """
+    results = []
+    for key, params in _final_actions(final_action):
+        rel_path = params.get('path', params.get('to')) if isinstance(params, dict) else None
+        if not isinstance(rel_path, (str, Path)) or Path(rel_path).is_absolute() or '_backup_path' not in params:
+            continue
+
+        backup_path = Path(params['_backup_path'])
+        result_path = Path(os.path.normpath(backup_path / f'{rel_path}{_RESULT_SUFFIXES.get(key, "")}'))
+        if result_path != backup_path and backup_path in result_path.parents:
+            results.append(result_path)
+    return results
+
+
+def _remove_partial_result(final_action: Dict[str, Any], catalog: Optional[Catalog]):
+    """
+    Removes what a task left in the backup folder when it failed in the interrupted backup that is being resumed, so
+    it does not write over its own leftovers when it runs again (see ``_partial_results``). The entries of the catalog
+    inside them are removed too, they belong to files that do not exist anymore.
+    """
+    logger = logging.getLogger(__name__).getChild('remove_partial_result')
+    for result_path in _partial_results(final_action):
+        if result_path.is_dir() and not result_path.is_symlink():
+            logger.info(f'Removing {result_path}, left by the task in the interrupted backup')
+            shutil.rmtree(str(result_path))
+        elif result_path.exists() or result_path.is_symlink():
+            logger.info(f'Removing {result_path}, left by the task in the interrupted backup')
+            result_path.unlink()
+        if catalog is not None and catalog.root in result_path.parents:
+            catalog.remove(result_path)
+
+
+def _task_hook_params(task: Task, tasks: Tasks, final_backup_path: Path, prev_backup_path: Optional[Path]) -> dict:
+    return {
+        'path': str(final_backup_path),
+        'previousPath': str(prev_backup_path) if prev_backup_path is not None else None,
+        'tasksName': tasks.name,
+        'taskName': task.name,
+    }
+
+
+def _prepare_task_actions(
+    task: Task,
+    final_backup_path: Path,
+    prev_backup_path: Optional[Path],
+    env: dict,
+    secrets: List[SecretConfig],
+    journal: Optional[Journal],
+) -> List[Dict[str, Any]]:
+    """
+    Injects the environment into the actions of the task and, if the journal belongs to an interrupted backup,
+    removes what the task left in it.
+    :return: The actions ready to run
+    """
+    actions = _inject_resolved_env_into_actions(task.actions,
+                                                {
+                                                    **env,
+                                                    **task.env,
+                                                    '_backup_path': final_backup_path,
+                                                    '_prev_backup_path': prev_backup_path,
+                                                },
+                                                secrets)
+
+    if journal is not None and journal.resumed:
+        _remove_partial_result(actions[-1], env.get('_catalog'))
+    return actions
+
+
+def _finish_task(
+    task: Task,
+    tasks: Tasks,
+    backup_path: Path,
+    final_backup_path: Path,
+    prev_backup_path: Optional[Path],
+    result: Path,
+    stats: List[Dict[str, Any]],
+    journal: Optional[Journal],
+) -> Path:
+    """
+    Records the task that finished successfully in the ``journal`` and runs its post hook.
+    :return: The result path relative to the backup path
+    """
+    result = result.relative_to(backup_path)
+    _log_task_stats(task.name, stats)
+    if journal is not None:
+        journal.task_finished(tasks.file_name, task.name, result, stats)
+
+    run_hook('backup:tasks:task:post', {
+        **_task_hook_params(task, tasks, final_backup_path, prev_backup_path),
+        'result': str(result),
+        'stats': stats,
+    })
+    return result
+
+
+def _fail_task(task: Task, tasks: Tasks, final_backup_path: Path, prev_backup_path: Optional[Path], e: Exception):
+    logger = logging.getLogger(__name__).getChild('run_task')
+    logger.error(f'Task {task.name} failed', exc_info=e)
+    run_hook('backup:tasks:task:error', {
+        'message': ', '.join(str(arg) for arg in e.args),
+        **_task_hook_params(task, tasks, final_backup_path, prev_backup_path),
+    })
+
+
+def _run_task(
+    task: Task,
+    tasks: Tasks,
+    backup_path: Path,
+    final_backup_path: Path,
+    prev_backup_path: Optional[Path],
+    env: dict,
+    secrets: List[SecretConfig],
+    stats: Optional[List[Dict[str, Any]]] = None,
+    pipe_size: Optional[int] = None,
+    journal: Optional[Journal] = None,
+) -> Path:
+    """
+    Runs one task of a tasks file, including its hooks, and returns the result path relative to the backup path.
+    If the task fails, the error hook is run and the exception is raised again. The measurements of each action are
+    appended into ``stats``. The pipes between actions are grown to ``pipe_size`` (``pipeSize`` of the task takes
+    precedence), if defined. If the task finishes successfully, it is recorded in the ``journal``. If the journal
+    belongs to an interrupted backup, what the task left in it is removed before running the task again.
+    """
+    run_hook('backup:tasks:task:pre', _task_hook_params(task, tasks, final_backup_path, prev_backup_path))
+    try:
+        actions = _prepare_task_actions(task, final_backup_path, prev_backup_path, env, secrets, journal)
+        stats = stats if stats is not None else []
+        pipe_size = task.pipe_size if task.pipe_size is not None else pipe_size
+        result = run_task_actions(task.name, actions, stats=stats, pipe_size=pipe_size)
+        return _finish_task(task, tasks, backup_path, final_backup_path, prev_backup_path, result, stats, journal)
+    except Exception as e:
+        _fail_task(task, tasks, final_backup_path, prev_backup_path, e)
+        raise e
+
+
+async def _run_task_async(
+    task: Task,
+    tasks: Tasks,
+    backup_path: Path,
+    final_backup_path: Path,
+    prev_backup_path: Optional[Path],
+    env: dict,
+    secrets: List[SecretConfig],
+    stats: Optional[List[Dict[str, Any]]] = None,
+    pipe_size: Optional[int] = None,
+    journal: Optional[Journal] = None,
+    executor: Optional[Executor] = None,
+) -> Path:
+    """
+    Runs one task like ``_run_task``, but as a coroutine of the event loop of the ``asyncio`` engine. What can block
+    (the hooks, the secrets and the actions that are not coroutines) runs in the ``executor`` (by default, the
+    default executor of the loop), one thing at a time.
+    """
+    loop = asyncio.get_running_loop()
+    hook_params = _task_hook_params(task, tasks, final_backup_path, prev_backup_path)
+    await loop.run_in_executor(executor, run_hook, 'backup:tasks:task:pre', hook_params)
+    try:
+        actions = await loop.run_in_executor(executor, _prepare_task_actions, task, final_backup_path,
+                                             prev_backup_path, env, secrets, journal)
+        stats = stats if stats is not None else []
+        pipe_size = task.pipe_size if task.pipe_size is not None else pipe_size
+        result = await run_task_actions_async(task.name, actions, stats=stats, pipe_size=pipe_size, executor=executor)
+        return await loop.run_in_executor(executor, _finish_task, task, tasks, backup_path, final_backup_path,
+                                          prev_backup_path, result, stats, journal)
+    except Exception as e:
+        await loop.run_in_executor(executor, _fail_task, task, tasks, final_backup_path, prev_backup_path, e)
+        raise e
+
+
+def _submit_task(executor: ThreadPoolExecutor, engine: str, *args) -> Future:
+    """
+    Runs ``_run_task`` with the arguments in a thread of the ``executor`` or, with the ``asyncio`` engine,
+    ``_run_task_async`` in the shared event loop, where the executor only runs what blocks, so there is no thread
+    waiting for each task.
+    """
+    if engine == 'asyncio':
+        return submit_to_event_loop(_run_task_async(*args, executor=executor))
+    return executor.submit(_run_task, *args)
+
+
+def _log_task_stats(task_name: str, stats: List[Dict[str, Any]]):
+    logger = logging.getLogger(__name__).getChild('run_task')
+    for stage in stats:
+        wall_time = stage['wallTime']
+        size = stage['bytesOut'] if stage['bytesOut'] is not None else stage['bytesIn']
+        if wall_time is None:
+            continue
+        throughput = f' ({size / wall_time / 1024 / 1024:.2f} MiB/s)' if size is not None and wall_time > 0 else ''
+        logger.debug(f'Task {task_name}: {stage["action"]} took {wall_time:.3f}s{throughput}')
+
+
 def _run_tasks(
     tasks: Tasks,
     backup_path: Path,
     prev_backup_path: Path,
     env: dict,
     secrets: List[SecretConfig],
+    max_parallel_tasks: int = 1,
+    tasks_stats: Optional[Dict[str, List[Dict[str, Any]]]] = None,
+    pipe_size: Optional[int] = None,
+    engine: str = 'threads',
+    journal: Optional[Journal] = None,
 ) -> Dict[str, Path]:
     """
     Given a tasks file (already parsed), runs each of the tasks.
@@ -87,6 +344,18 @@ def _run_tasks(
     inject them as parameters into each action. Then will run each task and store the result path into a dictionary
     that will be returned at the end. If a task fails and ``stopOnFail`` is set to true, then it will raise an
     exception and stop running the tasks file.
+
+    Tasks run in a pool of ``max_parallel_tasks`` workers (``maxParallelTasks`` of the tasks file takes precedence).
+    A task only starts when all the tasks in its ``dependsOn`` list have finished successfully; if one of them
+    failed, the task is considered failed as well without running it. When a task with ``stopOnFail`` fails, no more
+    tasks are started, the running ones are waited and then the exception is raised.
+
+    If ``tasks_stats`` is defined, the measurements of the actions of each task are stored in it by task name.
+    The actions of the tasks run using the ``engine`` (``engine`` of the tasks file takes precedence), see
+    ``_submit_task``.
+
+    Tasks that already finished according to the ``journal`` (when resuming a backup) are not run again, and their
+    previous results are used instead. The rest of tasks are recorded in it when they finish.
     """
     logger = logging.getLogger(__name__).getChild('run_tasks')
     final_backup_path = backup_path
@@ -96,50 +365,108 @@ def _run_tasks(
         if not str(final_backup_path).startswith(str(backup_path)):
             raise ValueError('inside is not valid: cannot go outside the backup path, use relative paths')
         prev_backup_path = prev_backup_path / tasks.inside_folder if prev_backup_path is not None else None
+        if '_cloud_path' in env:
+            env = {**env, '_cloud_path': str(Path(env['_cloud_path'], tasks.inside_folder))}
         final_backup_path.mkdir(exist_ok=True, parents=True)
         final_backup_path.chmod(0o755)
 
-    tasks_results: Dict[str, Path] = {}
+    tasks_stats = tasks_stats if tasks_stats is not None else {}
     for task in tasks.tasks:
-        run_hook('backup:tasks:task:pre', {
+        tasks_stats[task.name] = []
+
+    finished_tasks: Dict[str, Path] = {}
+    if journal is not None:
+        for task_name, (result, stats) in journal.finished_tasks(tasks.file_name).items():
+            logger.info(f'Task {task_name} already finished in a previous run, will not run again')
+            finished_tasks[task_name] = result
+            tasks_stats[task_name] = stats
+
+    if tasks.max_parallel_tasks is not None:
+        max_parallel_tasks = tasks.max_parallel_tasks
+    if max_parallel_tasks > 1:
+        logger.info(f'Tasks {tasks.name} will run up to {max_parallel_tasks} tasks at the same time')
+    if tasks.engine is not None:
+        engine = tasks.engine
+
+    def skip_task(task: Task, failed_dependencies: List[str]) -> Exception:
+        message = f'Task {task.name} will not run because its dependencies failed: {", ".join(failed_dependencies)}'
+        logger.error(message)
+        run_hook('backup:tasks:task:error', {
+            'message': message,
             'path': str(final_backup_path),
             'previousPath': str(prev_backup_path) if prev_backup_path is not None else None,
             'tasksName': tasks.name,
             'taskName': task.name,
         })
+        return Exception(message, task.name)
 
-        try:
-            actions = _inject_resolved_env_into_actions(task.actions,
-                                                        {
-                                                            **env,
-                                                            **task.env,
-                                                            '_backup_path': final_backup_path,
-                                                            '_prev_backup_path': prev_backup_path,
-                                                        },
-                                                        secrets)
-
-            tasks_results[task.name] = run_task_actions(task.name, actions).relative_to(backup_path)
-
-            run_hook('backup:tasks:task:post', {
-                'path': str(final_backup_path),
-                'previousPath': str(prev_backup_path) if prev_backup_path is not None else None,
-                'tasksName': tasks.name,
-                'taskName': task.name,
-                'result': str(tasks_results[task.name]),
-            })
-        except Exception as e:
-            logger.exception(f'Task {task.name} failed')
-            run_hook('backup:tasks:task:error', {
-                'message': ', '.join(e.args),
-                'path': str(final_backup_path),
-                'previousPath': str(prev_backup_path) if prev_backup_path is not None else None,
-                'tasksName': tasks.name,
-                'taskName': task.name,
-            })
-            if task.stop_on_fail:
-                raise e
+    with ThreadPoolExecutor(max_workers=max_parallel_tasks, thread_name_prefix='mdbackup-task') as executor:
+        return _schedule_tasks(
+            tasks.tasks,
+            lambda task: _submit_task(executor, engine, task, tasks, backup_path, final_backup_path, prev_backup_path,
+                                      env, secrets, tasks_stats[task.name], pipe_size, journal),
+            skip_task,
+            max_parallel_tasks,
+            finished_tasks,
+        )
+
+
+def _next_ready_task(pending: List[Task], succeeded: Dict[str, bool]) -> Optional[Task]:
+    """
+    Gets the first pending task (in order of definition) whose dependencies have already finished, if any.
+    """
+    for task in pending:
+        if all(dependency in succeeded for dependency in task.depends_on):
+            return task
+
+
+def _schedule_tasks(
+    pending: List[Task],
+    submit: Callable[[Task], Future],
+    skip: Callable[[Task, List[str]], Exception],
+    max_parallel_tasks: int,
+    finished: Optional[Dict[str, Path]] = None,
+) -> Dict[str, Path]:
+    """
+    Runs the tasks using ``submit`` respecting their dependencies and keeping at most ``max_parallel_tasks`` of them
+    running. Tasks with failed dependencies are not run, ``skip`` is called instead. If a task with ``stopOnFail``
+    fails, no more tasks are started and, once the running ones end, the error is raised. Tasks in ``finished`` are
+    not run, they are treated as succeeded with the given result.
+    """
+    finished = finished if finished is not None else {}
+    tasks_results: Dict[str, Path] = {task.name: finished[task.name] for task in pending if task.name in finished}
+    succeeded: Dict[str, bool] = {task_name: True for task_name in tasks_results}
+    pending = [task for task in pending if task.name not in finished]
+    running: Dict[Future, Task] = {}
+    error: Optional[Exception] = None
+    while len(pending) > 0 or len(running) > 0:
+        task = _next_ready_task(pending, succeeded) if error is None and len(running) < max_parallel_tasks else None
+        if task is not None:
+            pending.remove(task)
+            failed_dependencies = [dep for dep in task.depends_on if not succeeded[dep]]
+            if len(failed_dependencies) == 0:
+                running[submit(task)] = task
             else:
+                succeeded[task.name] = False
                 tasks_results[task.name] = None
+                task_error = skip(task, failed_dependencies)
+                error = task_error if task.stop_on_fail else error
+            continue
+
+        if len(running) == 0:
+            break
+
+        done, _ = wait(running.keys(), return_when=FIRST_COMPLETED)
+        for future in done:
+            task = running.pop(future)
+            task_error = future.exception()
+            succeeded[task.name] = task_error is None
+            tasks_results[task.name] = future.result() if task_error is None else None
+            if task_error is not None and task.stop_on_fail and error is None:
+                error = task_error
+
+    if error is not None:
+        raise error
 
     return tasks_results
 
@@ -165,39 +492,42 @@ def _resolve_secret(key_parts: List[str], secret: SecretConfig):
     return secret.backend.get_secret(value)
 
 
+def _resolve_secret_value(key: str, value, secrets: List[SecretConfig]):
+    """
+    Resolves the secret alias of a value of the environment. Containers (dicts, lists and tuples) are resolved
+    recursively, as they can contain actions definitions (like the branches of ``tee``).
+    """
+    logger = logging.getLogger(__name__).getChild('resolve_secrets')
+    if isinstance(value, str):
+        if not value.startswith('#'):
+            return value
+
+        logger.debug(f'Trying to resolve env {key} with secret alias {value}')
+        for secret in secrets:
+            new_value = _resolve_secret(value[1:].split('.'), secret)
+            if new_value is not None:
+                logger.debug(f'Env {key} resolved using {secret.type}')
+                return new_value
+
+        logger.warning(f'Env {key} with secret alias {value} cannot be resolved')
+        return value
+    elif isinstance(value, dict):
+        return _resolve_secrets(value, secrets)
+    elif isinstance(value, (list, tuple)):
+        return type(value)(_resolve_secret_value(key, item, secrets) for item in value)
+    else:
+        return value
+
+
 def _resolve_secrets(env: dict, secrets: List[SecretConfig]) -> dict:
     """
     Given a environment dict, tries to resolve all secrets found and returns a
     copy of the dict with secrets resolved.
     """
-    logger = logging.getLogger(__name__).getChild('resolve_secrets')
     if not isinstance(env, dict):
         return env
 
-    new_env = {}
-    for key, value in env.items():
-        if isinstance(value, str):
-            if value.startswith('#'):
-                logger.debug(f'Trying to resolve env {key} with secret alias {value}')
-                new_value = None
-                for secret in secrets:
-                    new_value = _resolve_secret(value[1:].split('.'), secret)
-                    if new_value is not None:
-                        logger.debug(f'Env {key} resolved using {secret.type}')
-                        new_env[key] = new_value
-                        break
-
-                if new_value is None:
-                    logger.warning(f'Env {key} with secret alias {value} cannot be resolved')
-                    new_env[key] = value
-            else:
-                new_env[key] = value
-        elif isinstance(value, dict):
-            new_env[key] = _resolve_secrets(value, secrets)
-        else:
-            new_env[key] = value
-
-    return new_env
+    return {key: _resolve_secret_value(key, value, secrets) for key, value in env.items()}
 
 
 def _resolve_env_vars(value, task_env: dict) -> dict:
@@ -238,9 +568,12 @@ def _resolve_env_vars(value, task_env: dict) -> dict:
         return value
 
 
-def _create_backup_manifest(backup_path: Path, results: Dict[str, Tuple[Tasks, Dict[str, Path]]]):
+def _create_backup_manifest(backup_path: Path,
+                            results: Dict[str, Tuple[Tasks, Dict[str, Path]]],
+                            stats: Dict[str, Dict[str, List[Dict[str, Any]]]] = {}):
     """
-    Given the backup path and all tasks with their results, writes the manifest into the backup folder.
+    Given the backup path and all tasks with their results, writes the manifest into the backup folder. If the
+    measurements of the actions of the tasks are available in ``stats``, they are stored next to the results.
     """
     logger = logging.getLogger(__name__).getChild('create_backup_manifest')
     manifest_dict = {
@@ -260,6 +593,7 @@ def _create_backup_manifest(backup_path: Path, results: Dict[str, Tuple[Tasks, D
                 'actions': task.actions,
                 'cloud': task.cloud,
                 'result': tasks_results[task.name],
+                'stats': stats.get(tasks_def_name, {}).get(task.name),
             } for task in tasks.tasks],
         }
 
@@ -268,10 +602,114 @@ def _create_backup_manifest(backup_path: Path, results: Dict[str, Tuple[Tasks, D
     write_data_file(manifest_path, manifest_dict)
 
 
+def _run_tasks_definitions(
+    all_tasks: List[Tasks],
+    run: Callable[[Tasks], Dict[str, Path]],
+    max_parallel_tasks_definitions: int,
+) -> Dict[str, Tuple[Tasks, Dict[str, Path]]]:
+    """
+    Runs the tasks definition files using ``run`` in a pool of ``max_parallel_tasks_definitions`` workers. As soon as
+    one of them fails, the files that did not start yet are cancelled, the running ones are waited and the error is
+    raised. The results are returned in the order of the definitions, regardless of the order they finished.
+    """
+    with ThreadPoolExecutor(max_workers=max_parallel_tasks_definitions,
+                            thread_name_prefix='mdbackup-tasks') as executor:
+        futures = [(tasks, executor.submit(run, tasks)) for tasks in all_tasks]
+        _, not_done = wait([future for _, future in futures], return_when=FIRST_EXCEPTION)
+        for future in not_done:
+            future.cancel()
+        failed = [future for _, future in futures if future.done() and not future.cancelled() and
+                  future.exception() is not None]
+        if len(failed) > 0:
+            # The running ones are waited when leaving the executor
+            raise failed[0].exception()
+
+    return {tasks.file_name: (tasks, future.result()) for tasks, future in futures}
+
+
+def _run_tasks_definition(
+    tasks: Tasks,
+    backup_path: Path,
+    prev_backup_path: Optional[Path],
+    env: dict,
+    secrets: List[SecretConfig],
+    max_parallel_tasks: int,
+    tasks_stats: Optional[Dict[str, List[Dict[str, Any]]]] = None,
+    pipe_size: Optional[int] = None,
+    engine: str = 'threads',
+    journal: Optional[Journal] = None,
+) -> Dict[str, Path]:
+    """
+    Runs all tasks of a tasks definition file, including the hooks for the tasks file, and returns the results.
+    If one of the tasks fails and the tasks file must stop, an exception is raised.
+    """
+    logger = logging.getLogger(__name__).getChild('run_tasks_definition')
+    logger.info(f'Preparing to run tasks of {tasks.name}')
+    run_hook('backup:tasks:pre', {'path': str(backup_path), 'tasksName': tasks.name})
+    try:
+        resolved_tasks_env = _resolve_secrets({**env, **tasks.env}, secrets)
+        result = _run_tasks(tasks, backup_path, prev_backup_path, resolved_tasks_env, secrets, max_parallel_tasks,
+                            tasks_stats, pipe_size, engine, journal)
+    except Exception as e:
+        logger.error(f'One of the tasks of {tasks.name} failed')
+        run_hook('backup:tasks:error', {
+            'path': str(backup_path),
+            'message': ', '.join(str(arg) for arg in e.args),
+            'tasksName': tasks.name,
+        })
+        raise Exception(f'One of the tasks of {tasks.name} failed, backup will stop', tasks.name)
+
+    run_hook('backup:tasks:post', {
+        'path': str(backup_path),
+        'tasksName': tasks.name,
+        'created': [str(p) for p in result.values()],
+    })
+    return result
+
+
+def _get_backup_path(backups_folder: Path, journal: Journal, resume: bool) -> Tuple[Path, bool]:
+    """
+    Gets the path where the backup will be stored at the end. If ``resume`` is set and the journal of an interrupted
+    backup exists, its path is used. Returns the path and if the backup is being resumed.
+    """
+    logger = logging.getLogger(__name__).getChild('get_backup_path')
+    if resume and journal.load():
+        # Keeps the name of the interrupted backup, the cloud uploads were already done into its folder
+        logger.info(f'Resuming backup {journal.backup_name} from {journal.path.parent}')
+        return backups_folder / journal.backup_name, True
+
+    if resume:
+        logger.warning(f'There is no backup to resume in {journal.path.parent}, starting a new one')
+    # The name is decided now because some actions upload data to the cloud into the folder of the backup
+    return _generate_backup_path(backups_folder), False
+
+
+def _prepare_temporary_folder(tmp_backup: Path, backup: Path, journal: Journal, resumed: bool):
+    """
+    Creates the folder where the backup is stored while it is being done. If the backup is not being resumed, any
+    content left by an interrupted backup is removed and a new journal is started.
+    """
+    logger = logging.getLogger(__name__).getChild('prepare_temporary_folder')
+    if not resumed and tmp_backup.exists():
+        logger.info(f'Removing contents of a previous interrupted backup in {tmp_backup}')
+        shutil.rmtree(str(tmp_backup))
+    tmp_backup.mkdir(exist_ok=True, parents=True)
+    tmp_backup.chmod(0o755)
+    if not resumed:
+        journal.start(backup.name)
+
+
 def _do_backup(backups_folder: Path,
                config_path: Path,
                env: dict = {},
-               secrets: List[SecretConfig] = []) -> Path:
+               secrets: List[SecretConfig] = [],
+               max_parallel_tasks: int = 1,
+               max_parallel_tasks_definitions: int = 1,
+               cloud_providers: List[StorageConfig] = [],
+               pipe_size: Optional[int] = None,
+               engine: str = 'threads',
+               resume: bool = False,
+               hash_algorithm: Optional[str] = None) -> Path:
     """
     Looks for the tasks defs, prepares the directory where the backups will
     be stored, run the tasks and saves the directory with the right name.
@@ -279,55 +717,73 @@ def _do_backup(backups_folder: Path,
     store the backups in ``backups_folder``. The ``env`` are environment
     variables that will be defined in the tasks execution. Finally, the
     ``secrets`` parameter declares a list of secret backends from where
-    secrets will be extracted when requested from ``env`` sections.
+    secrets will be extracted when requested from ``env`` sections. The
+    ``max_parallel_tasks`` limits how many tasks of a tasks file can run at
+    the same time, and ``max_parallel_tasks_definitions`` how many tasks
+    files can run at the same time. The ``cloud_providers`` are available
+    to the actions that upload data while the backup is running. If
+    ``pipe_size`` is defined, the pipes between actions will have that size.
+    The ``engine`` defines how the actions of the tasks run: ``threads`` or
+    ``asyncio``. If ``resume`` is set and there is an interrupted backup,
+    the tasks that finished in it are not run again. If ``hash_algorithm``
+    is defined, the files are hashed while they are written and the hashes
+    are stored in the catalog.
     """
     logger = logging.getLogger(__name__).getChild('do_backup')
     tmp_backup = Path(backups_folder, '.partial')
     prev_backup = backups_folder / 'current'
     prev_backup = prev_backup.resolve() if prev_backup.exists() else None
-    resolved_env = _resolve_secrets(env, secrets)
-
-    run_hook('backup:pre', {'path': str(tmp_backup)})
+    journal = Journal(tmp_backup / JOURNAL_FILE_NAME)
+    backup, resumed = _get_backup_path(backups_folder, journal, resume)
+    resolved_env = {
+        **_resolve_secrets(env, secrets),
+        '_cloud_providers': cloud_providers,
+        '_cloud_path': backup.name,
+        '_backups_path': backups_folder,
+        '_hash_algorithm': hash_algorithm,
+    }
 
-    logger.info(f'Temporary backup folder is {tmp_backup}')
-    tmp_backup.mkdir(exist_ok=True, parents=True)
-    tmp_backup.chmod(0o755)
-    tasks_definitions_results: Dict[str, Tuple[Tasks, Dict[str, Path]]] = {}
+    all_tasks: List[Tasks] = []
     for tasks_definition in _get_tasks_definitions(config_path):
         try:
             logger.debug(f'Loading tasks definition file {tasks_definition}')
-            tasks = Tasks(tasks_definition)
+            all_tasks.append(Tasks(tasks_definition))
         except KeyError:
             logger.error(f'Could not parse {tasks_definition}')
             raise
 
-        logger.info(f'Preparing to run tasks of {tasks.name}')
-        run_hook('backup:tasks:pre', {'path': str(tmp_backup), 'tasksName': tasks.name})
-        try:
-            resolved_tasks_env = _resolve_secrets({**resolved_env, **tasks.env}, secrets)
-            result = _run_tasks(tasks, tmp_backup, prev_backup, resolved_tasks_env, secrets)
-            tasks_definitions_results[tasks.file_name] = (tasks, result)
-        except Exception as e:
-            logger.error(f'One of the tasks of {tasks.name} failed')
-            run_hook('backup:tasks:error', {
-                'path': str(tmp_backup),
-                'message': ', '.join(e.args),
-                'tasksName': tasks.name,
-            })
-            raise Exception(f'One of the tasks of {tasks.name} failed, backup will stop', tasks.name)
-
-        run_hook('backup:tasks:post', {
-            'path': str(tmp_backup),
-            'tasksName': tasks.name,
-            'created': [str(p) for p in tasks_definitions_results[tasks.file_name][1].values()],
-        })
+    _check_cloud_actions(all_tasks, cloud_providers)
+    run_hook('backup:pre', {'path': str(tmp_backup)})
+
+    logger.info(f'Temporary backup folder is {tmp_backup}')
+    _prepare_temporary_folder(tmp_backup, backup, journal, resumed)
+    if max_parallel_tasks_definitions > 1:
+        logger.info(f'Running up to {max_parallel_tasks_definitions} tasks definition files at the same time')
+
+    catalog = Catalog(tmp_backup / CATALOG_FILE_NAME, tmp_backup)
+    prev_catalog = Catalog.open_previous(prev_backup / CATALOG_FILE_NAME, prev_backup) if prev_backup else None
+    resolved_env = {**resolved_env, '_catalog': catalog, '_prev_catalog': prev_catalog}
 
-    backup = _generate_backup_path(backups_folder)
+    tasks_definitions_stats: Dict[str, Dict[str, List[Dict[str, Any]]]] = {tasks.file_name: {} for tasks in all_tasks}
+    try:
+        tasks_definitions_results = _run_tasks_definitions(
+            all_tasks,
+            lambda tasks: _run_tasks_definition(tasks, tmp_backup, prev_backup, resolved_env, secrets,
+                                                max_parallel_tasks, tasks_definitions_stats[tasks.file_name],
+                                                pipe_size, engine, journal),
+            max_parallel_tasks_definitions,
+        )
+    finally:
+        # Kept even if the backup fails, the files recorded in it can be used when the backup is resumed
+        catalog.close()
+        prev_catalog.close() if prev_catalog is not None else None
+
+    journal.path.unlink()
     logger.info(f'Moving {tmp_backup} to {backup}')
     tmp_backup.rename(backup)
 
     logger.info(f'Creating manifest of backup {backup}')
-    _create_backup_manifest(backup, tasks_definitions_results)
+    _create_backup_manifest(backup, tasks_definitions_results, tasks_definitions_stats)
 
     current_backup = Path(backups_folder, 'current')
     if current_backup.is_symlink():
@@ -343,7 +799,7 @@ def _do_backup(backups_folder: Path,
     return backup
 
 
-def main_backup(config: Config) -> Path:
+def main_backup(config: Config, resume: bool = False) -> Path:
     logger = logging.getLogger(__name__).getChild('backup')
     # Do backups
     try:
@@ -352,13 +808,26 @@ def main_backup(config: Config) -> Path:
                           env={
                              **config.env,
                           },
-                          secrets=config.secrets)
+                          secrets=config.secrets,
+                          max_parallel_tasks=config.max_parallel_tasks,
+                          max_parallel_tasks_definitions=config.max_parallel_tasks_definitions,
+                          cloud_providers=config.cloud.providers,
+                          pipe_size=config.pipe_size,
+                          engine=config.engine,
+                          resume=resume,
+                          hash_algorithm=config.hash_algorithm)
     except Exception as e:
         logger.error(e)
+        tmp_backup = config.backups_path / '.partial'
         run_hook('backup:error', {
-            'path': str(config.backups_path / '.partial'),
+            'path': str(tmp_backup),
             'message': str(e),
             'stepName': e.args[1] if len(e.args) > 2 else None,
         })
-        shutil.rmtree(str(config.backups_path / '.partial'))
+        journal = Journal(tmp_backup / JOURNAL_FILE_NAME)
+        if journal.load() and journal.has_finished_tasks():
+            # Keep what has been done, it can be resumed in the next run
+            logger.error(f'Backup failed, run the backup again with --resume to continue it from {tmp_backup}')
+        elif tmp_backup.exists():
+            shutil.rmtree(str(tmp_backup))
         sys.exit(1)
@@ -4,11 +4,16 @@ import re
 import shutil
 from typing import List
 
+from ..chunk_store import CHUNKS_FOLDER_NAME, ChunkStore, referenced_chunks
 from ..config import Config
 from ..hooks import run_hook
 from ..storage import create_storage_instance
 
 
+# Chunks written or reused in this time (in seconds) are not removed, they can belong to a backup that is running
+_CHUNKS_GRACE_PERIOD = 60 * 60 * 24
+
+
 def _get_backup_folders_sorted(backups_folder: Path) -> List[Path]:
     """
     Gets the backups folders sorted.
@@ -45,6 +50,26 @@ def _local_cleanup(config: Config):
                 'message': str(e),
             })
 
+    _collect_unused_chunks(config.backups_path)
+
+
+def _collect_unused_chunks(backups_folder: Path):
+    """
+    Removes the chunks of the chunk store that are not used by any of the backups that are kept, including a
+    ``.partial`` backup that could be resumed. The chunks of the last day are kept too, the backup that uses them
+    could be still running and its recipes are not written yet.
+    """
+    logger = logging.getLogger(__name__).getChild('collect_unused_chunks')
+    store = ChunkStore(backups_folder / CHUNKS_FOLDER_NAME)
+    if not store.path.exists():
+        return
+
+    backups = _get_backup_folders_sorted(backups_folder)
+    partial = backups_folder / '.partial'
+    referenced = referenced_chunks(backups + ([partial] if partial.exists() else []))
+    removed = store.collect_garbage(referenced, _CHUNKS_GRACE_PERIOD)
+    logger.info(f'Removed {removed} chunks not used by any backup')
+
 
 def _cloud_cleanup(config: Config):
     logger = logging.getLogger(__name__).getChild('cloud')
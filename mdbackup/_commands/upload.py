@@ -4,9 +4,10 @@ from pathlib import Path
 from typing import Iterable, List, Tuple
 
 from ..archive import archive_file, archive_folder
+from ..chunk_store import RECIPE_SUFFIX
 from ..config import Config
 from ..hooks import run_hook
-from ..storage import create_storage_instance
+from ..storage import CLOUD_RECEIPT_SUFFIX, create_storage_instance
 from ..utils import read_data_file, write_data_file
 
 
@@ -126,12 +127,21 @@ def _get_generated_files_from_manifest(manifest: dict, backup: Path) -> Iterable
     """
     From a parsed backup manifest, gets all results from tasks.
     """
+    logger = logging.getLogger(__name__).getChild('get_generated_files_from_manifest')
     tasks = reduce(lambda x, y: [*x, *y],
                    (tasks['tasks'] for tasks in manifest['tasksDefinitions'].values()),
                    [])
     # only get results if can be uploaded and are not None (aka failed)
-    items = ((backup / task['result'], task) for task in tasks
-             if not task['cloud'].ignore and task.get('result') is not None)
+    # the receipts of to-cloud are not uploaded, the data they point to is already in the cloud
+    tasks = [task for task in tasks
+             if not task['cloud'].ignore and task.get('result') is not None
+             and not str(task['result']).endswith(CLOUD_RECEIPT_SUFFIX)]
+    # the recipes of to-chunks are useless without the chunk store, which is not uploaded
+    for task in tasks:
+        if str(task['result']).endswith(RECIPE_SUFFIX):
+            logger.warning(f'{task["result"]} is a chunk recipe, it will not be uploaded because the chunk store is '
+                           'not uploaded and it could not be restored from the cloud')
+    items = ((backup / task['result'], task) for task in tasks if not str(task['result']).endswith(RECIPE_SUFFIX))
     items = map(lambda p: (p[0].resolve(), p[1]), items)
     return items
 
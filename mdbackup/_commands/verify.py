@@ -0,0 +1,253 @@
+from collections import Counter
+from concurrent.futures import as_completed, Future, ProcessPoolExecutor
+import logging
+import mmap
+import os
+from pathlib import Path
+import posixpath
+import stat
+import time
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+from .backup import CATALOG_FILE_NAME
+from ..catalog import Catalog
+from ..config import Config
+from ..hashing import format_hash, hash_algorithm_of, new_hasher
+from ..utils import read_data_file
+
+
+_READ_SIZE = 1024 * 1024
+_MMAP_MIN_SIZE = 1024 * 1024 * 64
+_MMAP_WINDOW_SIZE = 1024 * 1024 * 16
+_BATCH_SIZE = 1024 * 1024 * 256
+_BATCH_FILES = 1000
+
+# Not all platforms have these, these will be None if not available
+_fadvise = getattr(os, 'posix_fadvise', None)
+_MADV_SEQUENTIAL = getattr(mmap, 'MADV_SEQUENTIAL', None)
+_MADV_DONTNEED = getattr(mmap, 'MADV_DONTNEED', None)
+
+
+class Mismatch(NamedTuple):
+    path: str
+    reason: str
+
+
+class TaskVerification(NamedTuple):
+    task: str
+    files: int
+    size: int
+    wall_time: float
+    mismatches: List[Mismatch]
+
+
+def _drop_cache(fd: int, offset: int, size: int):
+    """
+    Tells the kernel that the data read will not be needed again, so the cache used by other programs is not evicted
+    to keep the contents of the backup in memory.
+    """
+    _fadvise(fd, offset, size, os.POSIX_FADV_DONTNEED) if _fadvise is not None else None
+
+
+def _hash_with_read(fd: int, hasher):
+    offset = 0
+    data = os.read(fd, _READ_SIZE)
+    while len(data) > 0:
+        hasher.update(data)
+        _drop_cache(fd, offset, len(data))
+        offset += len(data)
+        data = os.read(fd, _READ_SIZE)
+
+
+def _hash_with_mmap(fd: int, size: int, hasher):
+    with mmap.mmap(fd, size, access=mmap.ACCESS_READ) as data:
+        data.madvise(_MADV_SEQUENTIAL) if _MADV_SEQUENTIAL is not None else None
+        with memoryview(data) as view:
+            for offset in range(0, size, _MMAP_WINDOW_SIZE):
+                length = min(_MMAP_WINDOW_SIZE, size - offset)
+                hasher.update(view[offset:offset + length])
+                # Pages that are still mapped cannot be removed from the cache, so they are unmapped first
+                data.madvise(_MADV_DONTNEED, offset, length) if _MADV_DONTNEED is not None else None
+                _drop_cache(fd, offset, length)
+
+
+def _verify_file(path: str, size: int, expected_hash: str) -> Optional[str]:
+    """
+    Hashes the file and compares it with the hash stored in the catalog.
+    :return: Why the file does not match, or ``None`` if it matches
+    """
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except FileNotFoundError:
+        return 'file does not exist'
+
+    try:
+        actual_size = os.fstat(fd).st_size
+        if actual_size != size:
+            return f'size is {actual_size} but it should be {size}'
+
+        _fadvise(fd, 0, 0, os.POSIX_FADV_SEQUENTIAL) if _fadvise is not None else None
+        algorithm = hash_algorithm_of(expected_hash)
+        hasher = new_hasher(algorithm)
+        if size >= _MMAP_MIN_SIZE:
+            _hash_with_mmap(fd, size, hasher)
+        else:
+            _hash_with_read(fd, hasher)
+    finally:
+        os.close(fd)
+    return None if format_hash(algorithm, hasher) == expected_hash else 'hash does not match'
+
+
+def _verify_batch(files: List[Tuple[str, int, str]]) -> List[Tuple[str, Optional[str]]]:
+    """
+    Verifies a batch of files in a process of the pool.
+    :return: The path of each file with the reason why it does not match (if it does not)
+    """
+    return [(path, _verify_file(path, size, expected_hash)) for path, size, expected_hash in files]
+
+
+def _split_in_batches(files: List[Tuple[str, int, str]]) -> List[List[Tuple[str, int, str]]]:
+    """
+    Groups the files in batches of a similar size, so each process receives a few big files or a lot of small ones.
+    """
+    batches = [[]]
+    batch_size = 0
+    for file in files:
+        if len(batches[-1]) > 0 and (batch_size + file[1] > _BATCH_SIZE or len(batches[-1]) >= _BATCH_FILES):
+            batches.append([])
+            batch_size = 0
+        batches[-1].append(file)
+        batch_size += file[1]
+    return batches if len(batches[0]) > 0 else []
+
+
+def _get_tasks_results(manifest: dict) -> Dict[str, str]:
+    """
+    :return: The name of the task (prefixed with its tasks definition) for each result of the backup
+    """
+    return {
+        posixpath.normpath(task['result']): f'{definition_name}/{task["name"]}'
+        for definition_name, definition in manifest['tasksDefinitions'].items()
+        for task in definition['tasks']
+        if task.get('result') is not None
+    }
+
+
+def _get_files_by_task(catalog: Catalog, results: Dict[str, str]) -> Tuple[Dict[str, List[Tuple[str, int, str]]], int]:
+    """
+    Looks for the files with hash in the catalog, grouped by the task whose result contains them.
+    :return: The files (path, size and hash) of each task, and the number of files without hash
+    """
+    files_by_task: Dict[str, List[Tuple[str, int, str]]] = {}
+    without_hash = 0
+    for entry in catalog.entries():
+        if not stat.S_ISREG(entry.mode):
+            continue
+        if entry.hash is None:
+            without_hash += 1
+            continue
+
+        rel_path = entry.path
+        while rel_path not in results and rel_path != '':
+            rel_path = posixpath.dirname(rel_path)
+        # A task could have the whole backup folder as result
+        task = results.get(rel_path if rel_path != '' else '.', 'no task')
+        files_by_task.setdefault(task, []).append((str(catalog.root / entry.path), entry.size, entry.hash))
+    return files_by_task, without_hash
+
+
+def _log_verification(verification: TaskVerification):
+    logger = logging.getLogger(__name__).getChild('verify_tasks')
+    throughput = verification.size / verification.wall_time / 1024 / 1024 if verification.wall_time > 0 else 0
+    logger.info(f'Task {verification.task}: verified {verification.files} files ({verification.size} bytes) in '
+                f'{verification.wall_time:.3f}s ({throughput:.2f} MiB/s), '
+                f'{len(verification.mismatches)} do not match')
+
+
+def _verify_tasks(executor: ProcessPoolExecutor,
+                  files_by_task: Dict[str, List[Tuple[str, int, str]]]) -> List[TaskVerification]:
+    """
+    Verifies the files of all tasks at the same time: the batches of every task are submitted at once, so a task with
+    a big file does not leave the rest of the pool waiting. The wall time of each task goes from the submit of its
+    first batch to the end of its last batch.
+    """
+    logger = logging.getLogger(__name__).getChild('verify_tasks')
+    started: Dict[str, float] = {}
+    futures: Dict[Future, str] = {}
+    for task, files in files_by_task.items():
+        started[task] = time.monotonic()
+        futures.update({executor.submit(_verify_batch, batch): task for batch in _split_in_batches(files)})
+
+    pending = Counter(futures.values())
+    mismatches: Dict[str, List[Mismatch]] = {task: [] for task in files_by_task}
+    verifications: Dict[str, TaskVerification] = {}
+    for future in as_completed(futures):
+        task = futures[future]
+        for path, reason in future.result():
+            if reason is not None:
+                logger.error(f'{path}: {reason}')
+                mismatches[task].append(Mismatch(path, reason))
+        pending[task] -= 1
+        if pending[task] == 0:
+            files = files_by_task[task]
+            verifications[task] = TaskVerification(task, len(files), sum(size for _, size, _ in files),
+                                                   time.monotonic() - started[task], mismatches[task])
+            _log_verification(verifications[task])
+    return [verifications[task] for task in files_by_task]
+
+
+def verify_backup(backup: Path, workers: Optional[int] = None) -> List[TaskVerification]:
+    """
+    Hashes again the files of the backup that have a hash in its catalog (see ``hashAlgorithm``) and compares them.
+    The files are read in a pool of ``workers`` processes (by default, one for each CPU), with memory mapped reads for
+    the big files, and they are removed from the page cache once they are read.
+    :return: The result of the verification of each task
+    """
+    logger = logging.getLogger(__name__).getChild('verify_backup')
+    manifest_path = backup / '.manifest.yaml'
+    if not manifest_path.exists():
+        raise FileNotFoundError(f'Backup manifest does not exist in the folder {backup}')
+    catalog = Catalog.open_previous(backup / CATALOG_FILE_NAME, backup)
+    if catalog is None:
+        raise FileNotFoundError(f'Backup catalog does not exist in the folder {backup}')
+
+    try:
+        files_by_task, without_hash = _get_files_by_task(catalog, _get_tasks_results(read_data_file(manifest_path)))
+    finally:
+        catalog.close()
+    if without_hash > 0:
+        logger.warning(f'{without_hash} files of the backup have no hash and cannot be verified')
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        return _verify_tasks(executor, files_by_task)
+
+
+def main_verify(config: Config, backup: Path, workers: Optional[int] = None) -> bool:
+    """
+    Verifies the backup (see ``verify_backup``).
+    :return: True if all files match their hashes, False if some do not or there is no file to verify
+    """
+    logger = logging.getLogger('mdbackup').getChild('verify')
+    if not backup.exists():
+        raise FileNotFoundError(backup)
+    if not backup.is_dir():
+        raise NotADirectoryError(backup)
+    if not str(backup).startswith(str(config.backups_path.resolve())):
+        raise ValueError(f'Backup path {backup} is not inside the backups path')
+    if workers is not None and workers < 1:
+        raise ValueError('workers must be, at least, 1')
+
+    logger.info(f'Verifying backup {backup}')
+    verifications = verify_backup(backup, workers)
+    files = sum(verification.files for verification in verifications)
+    if files == 0:
+        logger.error(f'No file of the backup {backup} has a hash, nothing could be verified')
+        return False
+
+    mismatches = sum(len(verification.mismatches) for verification in verifications)
+    if mismatches > 0:
+        logger.error(f'{mismatches} files of the backup {backup} do not match their hashes')
+        return False
+
+    logger.info(f'All {files} files of {backup} match')
+    return True
@@ -0,0 +1,48 @@
+import logging
+import signal
+from threading import Event, Thread
+from typing import Optional
+
+from ..change_journal import ChangeJournal, CHANGES_FOLDER_NAME, ChangeWatcher, journal_path
+from ..config import Config
+
+
+def _run_watcher(watcher: ChangeWatcher, stop: Event):
+    logger = logging.getLogger(__name__).getChild('run_watcher')
+    try:
+        watcher.run(stop)
+    except Exception:
+        logger.exception('Watcher failed, stopping all watchers')
+        stop.set()
+
+
+def main_watch(config: Config, stop: Optional[Event] = None):
+    """
+    Records the changes of the ``watchPaths`` into their journals until ``stop`` is set (or the process receives
+    ``SIGTERM`` or ``SIGINT``). If one of the watchers fails, all of them are stopped.
+    """
+    logger = logging.getLogger(__name__).getChild('watch')
+    if len(config.watch_paths) == 0:
+        raise ValueError('There are no watchPaths in the configuration')
+
+    stop = stop if stop is not None else Event()
+    changes_folder = config.backups_path / CHANGES_FOLDER_NAME
+    threads = []
+    for path in config.watch_paths:
+        root = path.resolve()
+        logger.info(f'Recording changes of {root}')
+        watcher = ChangeWatcher(root, ChangeJournal(journal_path(changes_folder, root), root))
+        thread = Thread(target=_run_watcher, args=(watcher, stop), name='mdbackup-watch', daemon=True)
+        thread.start()
+        threads.append(thread)
+
+    signal.signal(signal.SIGTERM, lambda *_: stop.set())
+    try:
+        while not stop.wait(1):
+            pass
+    except KeyboardInterrupt:
+        stop.set()
+    for thread in threads:
+        thread.join()
+
+    logger.info('Stopped recording changes')
@@ -1,7 +1,9 @@
+import errno
 import logging
 import os
 from pathlib import Path
 from threading import Thread
+from typing import Callable, List, Mapping, Optional, Tuple, Union
 
 try:
     import xattr
@@ -9,6 +11,11 @@ except ImportError:
     xattr = None
 
 
+# Not all platforms can find the holes of a file, these will be None if not available
+_SEEK_DATA = getattr(os, 'SEEK_DATA', None)
+_SEEK_HOLE = getattr(os, 'SEEK_HOLE', None)
+
+
 # Portable way to access to these xattr function across linux, macOS, freebsd...
 _python_has_xattr_lib = hasattr(os, 'listxattr') and hasattr(os, 'getxattr') and hasattr(os, 'setxattr')
 
@@ -34,7 +41,14 @@ def _setxattr(path, attribute, value, flags=0, symlink=True):
         return xattr.setxattr(path, attribute, value, options=flags, symlink=symlink)
 
 
-def _preserve_stats(entry_path: Path, stat: os.stat_result, xattrs: dict, mode):
+def _preserve_stats(entry_path: Path,
+                    stat: os.stat_result,
+                    xattrs: Union[Mapping[str, bytes], Callable[[], Optional[Mapping[str, bytes]]], None],
+                    mode):
+    """
+    Changes the stats of the entry to match the given ones. ``xattrs`` can be a function that returns the extended
+    attributes, so they are only read if they are going to be preserved.
+    """
     logger = logging.getLogger(__name__).getChild('_preserve_stats')
     new_mode = stat.st_mode & (os.st.S_IRWXU | os.st.S_IRWXG | os.st.S_IRWXO)
     new_uid = stat.st_uid
@@ -56,8 +70,9 @@ def _preserve_stats(entry_path: Path, stat: os.stat_result, xattrs: dict, mode):
     if mode is True or 'utime' in mode:
         logger.debug(f'utime {new_utime} {entry_path}')
         os.utime(entry_path, ns=new_utime, follow_symlinks=False)
-    if (mode is True or 'xattr' in mode) and xattrs is not None:
-        for xattr_key, xattr_value in xattrs.items():
+    if mode is True or 'xattr' in mode:
+        xattrs = xattrs() if callable(xattrs) else xattrs
+        for xattr_key, xattr_value in (xattrs.items() if xattrs is not None else ()):
             logger.debug(f'xattr {xattr_key}:{xattr_value} {entry_path}')
             _setxattr(
                 entry_path,
@@ -78,3 +93,35 @@ def _manual_pipe_boilerplate(action, args=(), name='undefined'):
     p = Thread(target=action, args=(write_stream, *args), name=f'mdbackup-{name}', daemon=True)
     p.start()
     return os.fdopen(read_fd, 'rb', buffering=0, closefd=True)
+
+
+def _is_sparse(stats: os.stat_result) -> bool:
+    """
+    :return: True if the file has less space allocated than its size, so it probably has holes that can be found.
+    """
+    return _SEEK_DATA is not None and os.st.S_ISREG(stats.st_mode) and stats.st_blocks * 512 < stats.st_size
+
+
+def _data_segments(fd: int, start: int, end: int) -> List[Tuple[int, int]]:
+    """
+    Finds the parts of the file that have data using ``SEEK_DATA`` and ``SEEK_HOLE``, the rest of the file are holes
+    (that are read as zeros). The position of the file descriptor is changed. Raises ``OSError`` if the file system
+    does not support it.
+    :return: The offset and size of each part with data between ``start`` and ``end``
+    """
+    segments = []
+    pos = start
+    while pos < end:
+        try:
+            data = os.lseek(fd, pos, _SEEK_DATA)
+        except OSError as e:
+            # There is no more data until the end of the file
+            if e.errno == errno.ENXIO:
+                break
+            raise
+        if data >= end:
+            break
+        hole = min(os.lseek(fd, data, _SEEK_HOLE), end)
+        segments.append((data, hole - data))
+        pos = hole
+    return segments
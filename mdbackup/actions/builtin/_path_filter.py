@@ -0,0 +1,87 @@
+import re
+from typing import List, Optional, Pattern, Tuple, Union
+
+
+def _translate_glob(glob: str) -> str:
+    """
+    Converts a glob into a regular expression. ``*`` and ``?`` do not match ``/``, ``**`` matches anything (including
+    ``/``) and ``[...]`` are character classes, as in gitignore.
+    """
+    i = 0
+    regex = ''
+    while i < len(glob):
+        c = glob[i]
+        if glob.startswith('**/', i):
+            regex += '(?:.*/)?'
+            i += 3
+        elif glob.startswith('**', i):
+            regex += '.*'
+            i += 2
+        elif c == '*':
+            regex += '[^/]*'
+            i += 1
+        elif c == '?':
+            regex += '[^/]'
+            i += 1
+        elif c == '[' and ']' in glob[i + 2:]:
+            end = glob.index(']', i + 2)
+            chars = glob[i + 1:end]
+            regex += '[' + ('^' + chars[1:] if chars[0] in '!^' else chars).replace('\\', '\\\\') + ']'
+            i = end + 1
+        elif c == '\\' and i + 1 < len(glob):
+            regex += re.escape(glob[i + 1])
+            i += 2
+        else:
+            regex += re.escape(c)
+            i += 1
+    return regex
+
+
+def _compile_pattern(pattern: str) -> Tuple[str, bool, bool]:
+    negated = pattern.startswith('!')
+    pattern = pattern[1:] if negated else pattern
+    dir_only = pattern.endswith('/')
+    pattern = pattern.rstrip('/')
+    # A pattern with a slash (other than the trailing one) is relative to the root, if not it matches at any depth
+    if '/' in pattern:
+        regex = '^' + _translate_glob(pattern.lstrip('/')) + '$'
+    else:
+        regex = '^(?:.*/)?' + _translate_glob(pattern) + '$'
+    return regex, negated, dir_only
+
+
+class PathFilter:
+    """
+    Matches relative paths against a list of gitignore-style patterns. The patterns are compiled once, when the
+    filter is created. Patterns starting with ``!`` negate a previous match, patterns ending with ``/`` only match
+    directories and patterns with a ``/`` are anchored to the root. As in gitignore, the last pattern matching a path
+    decides.
+    """
+
+    def __init__(self, patterns: Union[str, List[str]]):
+        if isinstance(patterns, str):
+            patterns = [patterns]
+        compiled = [_compile_pattern(pattern) for pattern in patterns if len(pattern.strip()) > 0]
+        self.__patterns: List[Tuple[Pattern, bool, bool]] = [
+            (re.compile(regex), negated, dir_only) for regex, negated, dir_only in compiled
+        ]
+        # Without negations the order does not matter, so all patterns can be checked with one regular expression
+        self.__any: Optional[Pattern] = None
+        self.__any_dir: Optional[Pattern] = None
+        if not any(negated for _, negated, _ in compiled):
+            self.__any = re.compile('|'.join(regex for regex, _, dir_only in compiled if not dir_only) or '(?!)')
+            self.__any_dir = re.compile('|'.join(regex for regex, _, _ in compiled) or '(?!)')
+
+    def matches(self, rel_path: str, is_dir: bool) -> bool:
+        """
+        :param rel_path: The path relative to the root, using ``/`` as separator.
+        :param is_dir: If the path is a directory.
+        :return: True if the path matches the patterns of the filter.
+        """
+        if self.__any is not None:
+            return (self.__any_dir if is_dir else self.__any).match(rel_path) is not None
+
+        for regex, negated, dir_only in reversed(self.__patterns):
+            if (is_dir or not dir_only) and regex.match(rel_path) is not None:
+                return not negated
+        return False
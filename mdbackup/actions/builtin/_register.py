@@ -4,6 +4,8 @@
 
 def register():
     import mdbackup.actions.builtin.archive
+    import mdbackup.actions.builtin.chunks
+    import mdbackup.actions.builtin.cloud
     import mdbackup.actions.builtin.command
     import mdbackup.actions.builtin.compress
     import mdbackup.actions.builtin.database
@@ -11,3 +13,4 @@ def register():
     import mdbackup.actions.builtin.encrypt
     import mdbackup.actions.builtin.file
     import mdbackup.actions.builtin.network
+    import mdbackup.actions.builtin.tee
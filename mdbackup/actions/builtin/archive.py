@@ -1,26 +1,116 @@
+import errno
 import io
+import logging
+import os
+import posixpath
 import tarfile
+from typing import List, Optional, Tuple
 
-from mdbackup.actions.builtin._os_utils import _manual_pipe_boilerplate
+from mdbackup.actions.builtin._os_utils import _data_segments, _is_sparse, _manual_pipe_boilerplate
 from mdbackup.actions.container import action, unaction
-from mdbackup.actions.ds import DirEntry, DirEntryGenerator
+from mdbackup.actions.ds import DirEntry, DirEntryGenerator, read_all_contents
+
+
+class _SparseFileReader(io.RawIOBase):
+    """
+    Reads the contents of a sparse member of a tar: the map of the parts with data, followed by those parts. The holes
+    of the file are never read.
+    """
+
+    def __init__(self, fd: int, sparse_map: bytes, segments: List[Tuple[int, int]]):
+        self.__fd = fd
+        self.__map = memoryview(sparse_map)
+        self.__segments = iter(segments)
+        self.__offset = 0
+        self.__remaining = 0
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer) -> int:
+        if len(self.__map) > 0:
+            size = min(len(buffer), len(self.__map))
+            buffer[:size] = self.__map[:size]
+            self.__map = self.__map[size:]
+            return size
+
+        while self.__remaining == 0:
+            segment = next(self.__segments, None)
+            if segment is None:
+                return 0
+            self.__offset, self.__remaining = segment
+
+        data = os.pread(self.__fd, min(len(buffer), self.__remaining), self.__offset)
+        buffer[:len(data)] = data
+        self.__offset += len(data)
+        self.__remaining -= len(data)
+        return len(data)
+
+
+def _sparse_member(tar_info: tarfile.TarInfo, stream) -> Optional[io.BufferedReader]:
+    """
+    If the file has holes, converts the member into a GNU sparse member (version 1.0, stored in PAX headers), so only
+    the parts of the file with data are read and stored.
+    :return: The stream with the contents of the sparse member, or ``None`` if the file is not sparse
+    """
+    if not isinstance(stream, io.FileIO):
+        return None
+
+    fd = stream.fileno()
+    file_stat = os.fstat(fd)
+    if not _is_sparse(file_stat):
+        return None
+    try:
+        segments = _data_segments(fd, 0, file_stat.st_size)
+    except OSError as e:
+        if e.errno not in (errno.EINVAL, errno.ENOSYS, errno.EOPNOTSUPP):
+            raise
+        return None
+
+    # If the file ends with a hole, the map ends with an empty part at the end, as GNU tar does
+    if len(segments) == 0 or sum(segments[-1]) < file_stat.st_size:
+        segments.append((file_stat.st_size, 0))
+    numbers = [len(segments)] + [number for segment in segments for number in segment]
+    sparse_map = ''.join(f'{number}\n' for number in numbers).encode('ascii')
+    sparse_map += tarfile.NUL * (-len(sparse_map) % tarfile.BLOCKSIZE)
+
+    tar_info.pax_headers = {
+        'GNU.sparse.major': '1',
+        'GNU.sparse.minor': '0',
+        'GNU.sparse.name': tar_info.name,
+        'GNU.sparse.realsize': str(file_stat.st_size),
+    }
+    tar_info.name = posixpath.join(posixpath.dirname(tar_info.name), 'GNUSparseFile.0',
+                                   posixpath.basename(tar_info.name))
+    tar_info.size = len(sparse_map) + sum(size for _, size in segments)
+    return io.BufferedReader(_SparseFileReader(fd, sparse_map, segments))
 
 
 @action('tar', input='directory', output='stream:pipe')
 def action_tar(inp: DirEntryGenerator, params) -> io.FileIO:
+    logger = logging.getLogger(__name__).getChild('action_tar')
+
     def action_tar_impl(out):
-        tar = tarfile.open(mode='w|', fileobj=out)
-        for entry in inp:
+        # The sparse files are stored using PAX headers
+        tar = tarfile.open(mode='w|', fileobj=out, format=tarfile.PAX_FORMAT)
+        for entry in read_all_contents(inp):
             tar_info = tarfile.TarInfo(str(entry.path))
             file_info = entry.stats
             tar_info.mode = file_info.st_mode
             tar_info.uid = file_info.st_uid
             tar_info.gid = file_info.st_gid
             tar_info.mtime = file_info.st_mtime
-            if entry.type == 'file':
+            if entry.type == 'file' and entry.hardlink is not None:
+                tar_info.type = tarfile.LNKTYPE
+                tar_info.linkname = entry.hardlink
+                tar.addfile(tar_info)
+            elif entry.type == 'file':
                 tar_info.type = tarfile.REGTYPE
                 tar_info.size = file_info.st_size
-                tar.addfile(tar_info, entry.stream)
+                sparse_stream = _sparse_member(tar_info, entry.stream)
+                logger.debug(f'Storing {entry.path} as a sparse file') if sparse_stream is not None else None
+                tar.addfile(tar_info, sparse_stream if sparse_stream is not None else entry.stream)
+                entry.close()
             elif entry.type == 'symlink':
                 tar_info.type = tarfile.SYMTYPE
                 tar_info.linkname = entry.link_content
@@ -40,6 +130,7 @@ def action_untar(stream, params) -> DirEntryGenerator:
     for tar_info in tar:
         tar_info: tarfile.TarInfo
         if tar_info.isdir() or tar_info.islnk() or tar_info.issym():
+            # Hardlinks are emitted without contents, they are a link to a previous entry
             yield DirEntry.from_tar_info(tar_info)
         elif tar_info.isreg():
             yield DirEntry.from_tar_info(tar_info, stream=tar.extractfile(tar_info))
@@ -0,0 +1,124 @@
+import logging
+from pathlib import Path
+from typing import Any, Dict, Generator
+
+from mdbackup.actions.builtin._os_utils import _manual_pipe_boilerplate
+from mdbackup.actions.builtin.file import _checks
+from mdbackup.actions.container import action, unaction
+from mdbackup.actions.ds import DirEntry, DirEntryGenerator, InputDataStream, read_all_contents, StatResult
+from mdbackup.chunk_store import CHUNKS_FOLDER_NAME, ChunkStore, read_recipe, RECIPE_SUFFIX, write_recipe
+from mdbackup.utils import raise_if_type_is_incorrect
+
+
+def _get_store(params: dict) -> ChunkStore:
+    return ChunkStore(Path(params['_backups_path']) / CHUNKS_FOLDER_NAME)
+
+
+def _get_average_size(params: dict) -> int:
+    average_size = params.get('averageChunkSize', 1024 * 1024)
+    raise_if_type_is_incorrect(average_size, int, 'averageChunkSize must be an int')
+    return average_size
+
+
+def _recipe_path(params: dict) -> Path:
+    path = params.get('path', params.get('to'))
+    raise_if_type_is_incorrect(path, (str, Path), 'path must be a string', required=True)
+    return _checks({**params, 'path': f'{path}{RECIPE_SUFFIX}'})
+
+
+@action('to-chunks', input='stream')
+def action_write_chunks(inp: InputDataStream, params: dict):
+    logger = logging.getLogger(__name__).getChild('action_write_chunks')
+    raise_if_type_is_incorrect(params, dict, 'parameters must be a dictionary', required=True)
+    recipe_path = _recipe_path(params)
+    store = _get_store(params)
+
+    logger.info(f'Storing stream into chunks at {store.path}')
+    chunks, new_bytes = store.write_stream(inp, _get_average_size(params))
+    size = sum(chunk_size for _, chunk_size in chunks)
+    write_recipe(recipe_path, [{'type': 'stream', 'size': size, 'chunks': chunks}])
+    logger.info(f'Stored {size} bytes in {len(chunks)} chunks, {new_bytes} bytes were new')
+    return recipe_path
+
+
+@unaction('to-chunks')
+def action_read_chunks(_, params: dict):
+    recipe_path = _recipe_path(params)
+    store = _get_store(params)
+    entry = next(read_recipe(recipe_path))
+
+    def write_stream(out):
+        stream = store.read_stream(entry['chunks'])
+        try:
+            for data in iter(lambda: stream.read(1024 * 1024), b''):
+                out.write(data)
+        finally:
+            out.close()
+
+    return _manual_pipe_boilerplate(write_stream, name='chunks')
+
+
+def _write_entries(inp: DirEntryGenerator, store: ChunkStore, average_size: int,
+                   totals: Dict[str, int]) -> Generator[Dict[str, Any], None, None]:
+    for entry in read_all_contents(inp):
+        recipe_entry = {
+            'type': entry.type,
+            'path': entry.path.as_posix(),
+            'mode': entry.stats.st_mode,
+            'uid': entry.stats.st_uid,
+            'gid': entry.stats.st_gid,
+            'atimeNs': entry.stats.st_atime_ns,
+            'mtimeNs': entry.stats.st_mtime_ns,
+        }
+        if entry.type == 'symlink':
+            recipe_entry['link'] = entry.link_content
+        elif entry.type == 'file' and entry.hardlink is not None:
+            recipe_entry['hardlink'] = entry.hardlink
+        elif entry.type == 'file':
+            try:
+                chunks, new_bytes = store.write_stream(entry.stream, average_size)
+            finally:
+                entry.close()
+            recipe_entry['size'] = sum(chunk_size for _, chunk_size in chunks)
+            recipe_entry['chunks'] = chunks
+            totals['size'] += recipe_entry['size']
+            totals['new'] += new_bytes
+        yield recipe_entry
+
+
+@action('directory-to-chunks', input='directory')
+def action_write_directory_chunks(inp: DirEntryGenerator, params: dict):
+    logger = logging.getLogger(__name__).getChild('action_write_directory_chunks')
+    raise_if_type_is_incorrect(params, dict, 'parameters must be a dictionary', required=True)
+    recipe_path = _recipe_path(params)
+    store = _get_store(params)
+
+    logger.info(f'Storing directory into chunks at {store.path}')
+    totals = {'size': 0, 'new': 0}
+    write_recipe(recipe_path, _write_entries(inp, store, _get_average_size(params), totals))
+    logger.info(f'Stored {totals["size"]} bytes of files, {totals["new"]} bytes were new')
+    return recipe_path
+
+
+@unaction('directory-to-chunks')
+def action_read_directory_chunks(_, params: dict) -> DirEntryGenerator:
+    recipe_path = _recipe_path(params)
+    store = _get_store(params)
+    for recipe_entry in read_recipe(recipe_path):
+        stats = StatResult(
+            st_mode=recipe_entry['mode'],
+            st_uid=recipe_entry['uid'],
+            st_gid=recipe_entry['gid'],
+            st_size=recipe_entry.get('size', 0),
+            st_atime_ns=recipe_entry['atimeNs'],
+            st_mtime_ns=recipe_entry['mtimeNs'],
+        )
+        if recipe_entry['type'] == 'file' and 'hardlink' in recipe_entry:
+            yield DirEntry('file', recipe_entry['path'], stats, hardlink=recipe_entry['hardlink'], xattrs=None)
+        elif recipe_entry['type'] == 'file':
+            stream = store.read_stream(recipe_entry['chunks'])
+            yield DirEntry('file', recipe_entry['path'], stats, stream=stream, xattrs=None)
+        elif recipe_entry['type'] == 'symlink':
+            yield DirEntry('symlink', recipe_entry['path'], stats, link_content=recipe_entry['link'], xattrs=None)
+        else:
+            yield DirEntry('dir', recipe_entry['path'], stats, xattrs=None)
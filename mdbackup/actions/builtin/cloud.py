@@ -0,0 +1,101 @@
+import logging
+from pathlib import Path
+from typing import List
+
+from mdbackup.actions.builtin.file import _checks
+from mdbackup.actions.container import action
+from mdbackup.actions.ds import InputDataStream
+from mdbackup.config import StorageConfig
+from mdbackup.storage import CLOUD_RECEIPT_SUFFIX, create_storage_instance, supports_upload_stream
+from mdbackup.utils import raise_if_type_is_incorrect, write_data_file
+
+
+class _CountingStream:
+    """
+    Wraps a stream to know how many bytes have been read from it.
+    """
+
+    def __init__(self, stream: InputDataStream):
+        self.stream = stream
+        self.size = 0
+
+    def read(self, size: int = -1) -> bytes:
+        data = self.stream.read(size)
+        if data is not None:
+            self.size += len(data)
+        return data
+
+    def readable(self) -> bool:
+        return True
+
+
+def _get_provider(params: dict) -> StorageConfig:
+    providers: List[StorageConfig] = params.get('_cloud_providers', [])
+    provider = params.get('provider')
+
+    raise_if_type_is_incorrect(provider, (int, str), 'provider must be the index or the type of a provider')
+    if len(providers) == 0:
+        raise ValueError('There are no cloud storage providers configured')
+
+    if provider is None:
+        if len(providers) > 1:
+            raise ValueError('There are more than one cloud storage provider configured, choose one using provider')
+        return providers[0]
+    elif isinstance(provider, int):
+        if provider < 0 or provider >= len(providers):
+            raise IndexError(f'There is no cloud storage provider #{provider}')
+        return providers[provider]
+    else:
+        for provider_config in providers:
+            if provider_config.type.lower() == provider.lower():
+                return provider_config
+        raise KeyError(f'There is no cloud storage provider of type {provider}')
+
+
+def check_cloud_provider(params: dict) -> StorageConfig:
+    """
+    Checks the parameters of a ``to-cloud`` action and that its provider can upload streams, so the action can be
+    validated before the backup starts.
+    :return: The configuration of the provider
+    """
+    raise_if_type_is_incorrect(params, dict, 'parameters must be a dictionary', required=True)
+    raise_if_type_is_incorrect(params.get('path'), str, 'path must be a string', required=True)
+    if Path(params['path']).is_absolute():
+        raise ValueError('Path cannot be absolute')
+
+    provider_config = _get_provider(params)
+    if not supports_upload_stream(provider_config):
+        raise NotImplementedError(f'Cloud storage provider {provider_config.type} cannot upload streams')
+    return provider_config
+
+
+@action('to-cloud', input='stream')
+def action_write_cloud(inp: InputDataStream, params: dict):
+    logger = logging.getLogger(__name__).getChild('action_write_cloud')
+    provider_config = check_cloud_provider(params)
+    path = Path(params['path'])
+    storage = create_storage_instance(provider_config)
+    if storage is None:
+        raise ValueError(f'Unknown cloud storage provider type {provider_config.type}')
+
+    # Remote path is the backup folder + inside folder (if any) + parent folders of path
+    cloud_path = Path(params['_cloud_path'])
+    parts = (cloud_path / path).parent.parts
+    cloud_folder = storage.create_folder(parts[0])
+    for part in parts[1:]:
+        cloud_folder = storage.create_folder(part, cloud_folder)
+
+    logger.info(f'Uploading stream to {provider_config.type} into {cloud_path / path}')
+    stream = _CountingStream(inp)
+    storage.upload_stream(stream, path.name, cloud_folder)
+    del storage
+
+    # The data is not stored locally, but a receipt is written to let know where it is
+    receipt_path = _checks({**params, 'path': f'{path}{CLOUD_RECEIPT_SUFFIX}'})
+    write_data_file(receipt_path, {
+        'type': provider_config.type,
+        'backupsPath': provider_config.backups_path,
+        'path': str(cloud_path / path),
+        'size': stream.size,
+    })
+    return receipt_path
@@ -1,48 +1,341 @@
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from functools import partial
+from itertools import islice
 import logging
 import os
 from pathlib import Path
-
-from mdbackup.actions.builtin._os_utils import _preserve_stats
+import posixpath
+import shutil
+import stat
+from threading import BoundedSemaphore
+from typing import Callable, Deque, Dict, List, Optional, Set, Tuple
+
+from mdbackup.actions.builtin._os_utils import _preserve_stats, _read_xattrs
+from mdbackup.actions.builtin._path_filter import PathFilter
 from mdbackup.actions.builtin.command import action_command
-from mdbackup.actions.builtin.file import action_copy_file, action_reverse_copy_file
+from mdbackup.actions.builtin.file import _clone_files, action_copy_file, action_reverse_copy_file
 from mdbackup.actions.container import action, unaction
-from mdbackup.actions.ds import DirEntry, DirEntryGenerator
+from mdbackup.actions.ds import DirEntry, DirEntryGenerator, read_all_contents, StatResult
+from mdbackup.catalog import Catalog, CatalogEntry
+from mdbackup.change_journal import ChangeJournal, CHANGES_FOLDER_NAME, journal_path
+from mdbackup.hashing import hash_algorithm_of
 from mdbackup.utils import raise_if_type_is_incorrect
 
 
-def _recurse_dir(path: Path, root_path: Path, resolve_symlinks: bool):
-    if path.is_dir():
-        if path != root_path:
-            yield DirEntry.from_real_path(path, root_path)
-        for item in path.iterdir():
-            yield from _recurse_dir(item, root_path, resolve_symlinks)
-    elif path.is_symlink():
-        if resolve_symlinks:
-            relative_path = path.relative_to(root_path)
-            resolved = path.resolve()
-            yield from map(
-                lambda entry: DirEntry(entry.type,
-                                       relative_path / entry.path,
-                                       entry.stats,
-                                       stream=entry.stream,
-                                       link_content=entry.link_content),
-                _recurse_dir(resolved, resolved, True),
-            )
-        else:
-            yield DirEntry.from_real_path(path, root_path)
-    elif path.is_file():
-        yield DirEntry.from_real_path(path, root_path)
+_SCAN_BATCH_SIZE = 64
+_CLONE_BATCH_SIZE = 256
+_MAX_UNCHANGED_SUBTREE_ENTRIES = 10000
+
+
+class _ScanFilter:
+    """
+    Decides which entries are read while walking a directory. Excluded entries are discarded using only the
+    information of the directory listing, so excluded directories are pruned before their contents are read and no
+    ``stat`` is done for them.
+    """
+
+    def __init__(self,
+                 exclude: Optional[PathFilter] = None,
+                 max_file_size: Optional[int] = None,
+                 device: Optional[int] = None):
+        self.__exclude = exclude
+        self.__max_file_size = max_file_size
+        self.__device = device
+
+    def excludes(self, entry: os.DirEntry, rel_path: str) -> bool:
+        """
+        :return: True if the entry matches the ``exclude`` patterns.
+        """
+        if self.__exclude is None:
+            return False
+        return self.__exclude.matches(rel_path.replace(os.sep, '/'), entry.is_dir(follow_symlinks=False))
+
+    def accepts(self, dir_entry: DirEntry) -> bool:
+        """
+        :return: False if the entry is a file bigger than ``maxFileSize``.
+        """
+        return self.__max_file_size is None or dir_entry.type != 'file' or \
+            dir_entry.stats.st_size <= self.__max_file_size
+
+    def descends(self, dir_entry: DirEntry) -> bool:
+        """
+        :return: False if the directory is in another file system and ``oneFileSystem`` is enabled.
+        """
+        return self.__device is None or dir_entry.stats.st_dev == self.__device
+
+
+def _list_dir(path: str, rel_path: str, scan_filter: _ScanFilter) -> List[Tuple[os.DirEntry, str]]:
+    # The directory is closed before going deeper, so the number of open directories does not depend on the depth
+    with os.scandir(path) as it:
+        entries = [(entry, os.path.join(rel_path, entry.name) if rel_path else entry.name) for entry in it]
+    return [(entry, entry_rel_path) for entry, entry_rel_path in entries
+            if not scan_filter.excludes(entry, entry_rel_path)]
+
+
+def _to_dir_entry(entry: os.DirEntry, rel_path: str, scan_filter: _ScanFilter) -> Optional[DirEntry]:
+    if entry.is_symlink() or entry.is_dir(follow_symlinks=False) or entry.is_file(follow_symlinks=False):
+        dir_entry = DirEntry.from_stat(entry.path, Path(rel_path), entry.stat(follow_symlinks=False))
+        return dir_entry if scan_filter.accepts(dir_entry) else None
     # Ignore the rest of file types
+    return None
+
+
+def _recurse_dir(path: str, rel_path: str, resolve_symlinks: bool, scan_filter: _ScanFilter) -> DirEntryGenerator:
+    """
+    Walks the directory using ``os.scandir()``: the type of each entry comes from the directory listing itself and
+    only one ``lstat()`` is done per entry. The paths are handled as strings while walking, and only the paths of the
+    entries are converted into ``Path``.
+    """
+    for entry, entry_rel_path in _list_dir(path, rel_path, scan_filter):
+        if resolve_symlinks and entry.is_symlink():
+            yield from _resolve_symlink(entry.path, entry_rel_path, scan_filter,
+                                        lambda p, r: _recurse_dir(p, r, True, scan_filter))
+            continue
+
+        dir_entry = _to_dir_entry(entry, entry_rel_path, scan_filter)
+        if dir_entry is not None:
+            yield dir_entry
+            if dir_entry.type == 'dir' and scan_filter.descends(dir_entry):
+                yield from _recurse_dir(entry.path, entry_rel_path, resolve_symlinks, scan_filter)
+
+
+def _resolve_symlink(path: str,
+                     rel_path: str,
+                     scan_filter: _ScanFilter,
+                     recurse: Callable[[str, str], DirEntryGenerator]) -> DirEntryGenerator:
+    resolved = os.path.realpath(path)
+    try:
+        stats = os.lstat(resolved)
+    except FileNotFoundError:
+        # Broken symlink, nothing to resolve
+        yield DirEntry.from_stat(path, Path(rel_path), os.lstat(path))
+        return
+
+    if os.st.S_ISDIR(stats.st_mode):
+        dir_entry = DirEntry.from_stat(resolved, Path(rel_path), stats)
+        yield dir_entry
+        yield from recurse(resolved, rel_path) if scan_filter.descends(dir_entry) else ()
+    elif os.st.S_ISREG(stats.st_mode):
+        dir_entry = DirEntry.from_stat(resolved, Path(rel_path), stats)
+        yield from (dir_entry,) if scan_filter.accepts(dir_entry) else ()
+
+
+def _filter_included(entries: DirEntryGenerator, include: PathFilter) -> DirEntryGenerator:
+    """
+    Keeps only the entries that match the ``include`` patterns, or that are inside a directory that matches them.
+    The rest of directories are emitted only if something inside them is, just before it, so the order of the entries
+    is kept and no empty directories are created.
+    """
+    pending: List[DirEntry] = []
+    included: List[str] = []
+    for entry in entries:
+        rel_path = Path(entry.path).as_posix()
+        while len(pending) > 0 and not rel_path.startswith(Path(pending[-1].path).as_posix() + '/'):
+            pending.pop()
+        while len(included) > 0 and not rel_path.startswith(included[-1] + '/'):
+            included.pop()
+
+        if len(included) > 0 or include.matches(rel_path, entry.type == 'dir'):
+            yield from pending
+            pending.clear()
+            yield entry
+            included.append(rel_path) if entry.type == 'dir' else None
+        elif entry.type == 'dir':
+            pending.append(entry)
+
+
+def _track_hardlinks(entries: DirEntryGenerator, seen: Dict[Tuple[int, int], str]) -> DirEntryGenerator:
+    """
+    Marks the files that are a hardlink of a file already emitted, so they can be stored as a link to it instead of
+    storing the same contents again. Only the files with more than one link are remembered in ``seen``.
+    """
+    for entry in entries:
+        if entry.type == 'file' and entry.stats.st_nlink > 1:
+            key = (entry.stats.st_dev, entry.stats.st_ino)
+            entry.hardlink = seen.get(key)
+            seen.setdefault(key, entry.path.as_posix())
+        yield entry
+
+
+def _recurse_changed_dir(path: str,
+                         rel_path: str,
+                         scan_filter: _ScanFilter,
+                         changed: Set[str],
+                         read_contents: Callable[[str, str], DirEntryGenerator]) -> DirEntryGenerator:
+    """
+    Walks only the directories that have changed or that have changes inside them. The rest of directories are
+    emitted with ``read_contents`` set, and their contents are not read unless the action that receives them asks.
+    """
+    for entry, entry_rel_path in _list_dir(path, rel_path, scan_filter):
+        dir_entry = _to_dir_entry(entry, entry_rel_path, scan_filter)
+        if dir_entry is None:
+            continue
+
+        if dir_entry.type == 'dir' and scan_filter.descends(dir_entry) and entry_rel_path in changed:
+            yield dir_entry
+            yield from _recurse_changed_dir(entry.path, entry_rel_path, scan_filter, changed, read_contents)
+        elif dir_entry.type == 'dir' and scan_filter.descends(dir_entry):
+            dir_entry.read_contents = partial(read_contents, entry.path, entry_rel_path)
+            yield dir_entry
+        else:
+            yield dir_entry
+
+
+def _get_changed_dirs(root_path: Path, params: dict) -> Optional[Set[str]]:
+    """
+    Reads the journal of changes of the directory (see ``ChangeJournal``).
+    :return: The directories that have changed since the previous backup started, including their parents, or
+    ``None`` if they are not known and the whole directory must be read
+    """
+    logger = logging.getLogger(__name__).getChild('_get_changed_dirs')
+    if params.get('include') is not None or params.get('resolveSymlinks', False):
+        raise ValueError('changeJournal cannot be used with include nor resolveSymlinks')
+
+    prev_catalog: Optional[Catalog] = params.get('_prev_catalog')
+    started_ns = prev_catalog.started_ns if prev_catalog is not None else None
+    if params.get('_backups_path') is None or started_ns is None:
+        logger.info(f'There is no previous backup to compare {root_path} with, it will be read completely')
+        return None
+
+    journal = ChangeJournal(journal_path(Path(params['_backups_path']) / CHANGES_FOLDER_NAME, root_path), root_path)
+    changed = journal.changed_dirs(started_ns)
+    if changed is None:
+        logger.info(f'Changes of {root_path} are not known, it will be read completely')
+        return None
+
+    logger.info(f'Reading {len(changed)} directories of {root_path} that changed since the previous backup')
+    with_parents: Set[str] = set()
+    for rel_path in changed:
+        while rel_path != '' and rel_path not in with_parents:
+            with_parents.add(rel_path)
+            rel_path = posixpath.dirname(rel_path)
+    return with_parents
+
+
+class _ParallelScanner:
+    """
+    Walks a directory like ``_recurse_dir`` does, but the listings of the directories and the stats of the entries are
+    read ahead in a pool of threads. This helps when each stat takes a lot of time (i.e. network file systems).
+    The entries are yielded in the same order as ``_recurse_dir`` does. The extended attributes of the entries are
+    read lazily, unless ``prefetch_xattrs`` is set, then they are read ahead in the pool too.
+    """
+
+    def __init__(self, workers: int, resolve_symlinks: bool, scan_filter: _ScanFilter, prefetch_xattrs: bool = False):
+        self.__workers = workers
+        self.__resolve_symlinks = resolve_symlinks
+        self.__scan_filter = scan_filter
+        self.__prefetch_xattrs = prefetch_xattrs
+        self.__executor: Optional[ThreadPoolExecutor] = None
+
+    def walk(self, path: str) -> DirEntryGenerator:
+        self.__executor = ThreadPoolExecutor(max_workers=self.__workers, thread_name_prefix='mdbackup-scan')
+        try:
+            yield from self.__walk(path, '')
+        finally:
+            self.__executor.shutdown(wait=True)
+
+    def __list_dir(self, path: str, rel_path: str) -> Future:
+        return self.__executor.submit(_list_dir, path, rel_path, self.__scan_filter)
+
+    def __walk(self, path: str, rel_path: str, listing: Optional[Future] = None) -> DirEntryGenerator:
+        entries = (listing or self.__list_dir(path, rel_path)).result()
+        batches = iter([entries[i:i + _SCAN_BATCH_SIZE] for i in range(0, len(entries), _SCAN_BATCH_SIZE)])
+        # Only a few batches are read ahead, to keep bounded the entries in memory
+        pending: Deque[Tuple[list, Future]] = deque()
+        for batch in islice(batches, self.__workers * 2):
+            pending.append((batch, self.__executor.submit(self.__read_batch, batch)))
+
+        while len(pending) > 0:
+            _, future = pending.popleft()
+            for batch in islice(batches, 1):
+                pending.append((batch, self.__executor.submit(self.__read_batch, batch)))
+            yield from self.__walk_batch(future.result())
+
+    def __walk_batch(self, dir_entries: List[Tuple[os.DirEntry, str, Optional[DirEntry]]]) -> DirEntryGenerator:
+        # Start listing the subdirectories while the entries before them are being consumed
+        listings = {
+            entry.path: self.__list_dir(entry.path, entry_rel_path)
+            for entry, entry_rel_path, dir_entry in dir_entries
+            if dir_entry is not None and dir_entry.type == 'dir' and self.__scan_filter.descends(dir_entry)
+        }
+        for entry, entry_rel_path, dir_entry in dir_entries:
+            if self.__resolve_symlinks and entry.is_symlink():
+                yield from _resolve_symlink(entry.path, entry_rel_path, self.__scan_filter, self.__walk)
+            elif dir_entry is not None:
+                yield dir_entry
+                if entry.path in listings:
+                    yield from self.__walk(entry.path, entry_rel_path, listings[entry.path])
+
+    def __read_batch(self, batch: List[Tuple[os.DirEntry, str]]) -> List[Tuple[os.DirEntry, str, Optional[DirEntry]]]:
+        return [
+            (entry, entry_rel_path,
+             None if self.__resolve_symlinks and entry.is_symlink()
+             else self.__read_entry(entry, entry_rel_path))
+            for entry, entry_rel_path in batch
+        ]
+
+    def __read_entry(self, entry: os.DirEntry, rel_path: str) -> Optional[DirEntry]:
+        dir_entry = _to_dir_entry(entry, rel_path, self.__scan_filter)
+        # Accessing the property reads and caches them in this thread
+        dir_entry.xattrs if dir_entry is not None and self.__prefetch_xattrs else None
+        return dir_entry
+
+
+def _get_scan_filter(root_path: Path, params: dict) -> Tuple[_ScanFilter, Optional[PathFilter]]:
+    include = params.get('include')
+    exclude = params.get('exclude')
+    max_file_size = params.get('maxFileSize')
+    one_file_system = params.get('oneFileSystem', False)
+
+    raise_if_type_is_incorrect(include, (str, list), 'include must be a string or a list of strings')
+    raise_if_type_is_incorrect(exclude, (str, list), 'exclude must be a string or a list of strings')
+    raise_if_type_is_incorrect(max_file_size, int, 'maxFileSize must be an int')
+    raise_if_type_is_incorrect(one_file_system, bool, 'oneFileSystem must be a boolean')
+
+    scan_filter = _ScanFilter(
+        PathFilter(exclude) if exclude is not None else None,
+        max_file_size,
+        root_path.stat().st_dev if one_file_system else None,
+    )
+    return scan_filter, PathFilter(include) if include is not None else None
 
 
 @action('from-directory', output='directory')
 def action_read_dir(_, params: dict):
-    root_path = Path(params['path'] if isinstance(params, dict) else params).resolve()
+    if isinstance(params, str):
+        params = {'path': params}
+    root_path = Path(params['path']).resolve()
     if not root_path.is_dir():
         raise NotADirectoryError(root_path)
 
-    resolve_symlinks = params.get('resolveSymlinks', False) if isinstance(params, dict) else False
-    return _recurse_dir(root_path, root_path, resolve_symlinks=resolve_symlinks)
+    resolve_symlinks = params.get('resolveSymlinks', False)
+    parallel_scan = params.get('parallelScan', 1)
+    hardlinks = params.get('hardlinks', True)
+    change_journal = params.get('changeJournal', False)
+    prefetch_xattrs = params.get('prefetchXattrs', False)
+    raise_if_type_is_incorrect(parallel_scan, int, 'parallelScan must be an int')
+    raise_if_type_is_incorrect(hardlinks, bool, 'hardlinks must be a boolean')
+    raise_if_type_is_incorrect(change_journal, bool, 'changeJournal must be a boolean')
+    raise_if_type_is_incorrect(prefetch_xattrs, bool, 'prefetchXattrs must be a boolean')
+    if parallel_scan < 1:
+        raise ValueError('parallelScan must be, at least, 1')
+    scan_filter, include = _get_scan_filter(root_path, params)
+    changed = _get_changed_dirs(root_path, params) if change_journal else None
+    seen_hardlinks: Dict[Tuple[int, int], str] = {}
+
+    def read_contents(path: str, rel_path: str) -> DirEntryGenerator:
+        entries = _recurse_dir(path, rel_path, False, scan_filter)
+        return _track_hardlinks(entries, seen_hardlinks) if hardlinks else entries
+
+    if changed is not None:
+        entries = _recurse_changed_dir(str(root_path), '', scan_filter, changed, read_contents)
+    elif parallel_scan > 1:
+        entries = _ParallelScanner(parallel_scan, resolve_symlinks, scan_filter, prefetch_xattrs).walk(str(root_path))
+    else:
+        entries = _recurse_dir(str(root_path), '', resolve_symlinks, scan_filter)
+    entries = _filter_included(entries, include) if include is not None else entries
+    return _track_hardlinks(entries, seen_hardlinks) if hardlinks else entries
 
 
 @unaction('from-directory')
@@ -56,7 +349,7 @@ def action_reverse_read_dir(inp, params: dict):
     raise_if_type_is_incorrect(preserve_stats, (str, bool), 'preserveStats must be a string or a boolean')
     root_path.mkdir(0o755, parents=True, exist_ok=True)
 
-    for entry in inp:
+    for entry in read_all_contents(inp):
         entry_path = root_path / entry.path
         if entry.type == 'dir':
             logger.debug(f'Creating directory {entry_path}')
@@ -64,10 +357,13 @@ def action_reverse_read_dir(inp, params: dict):
         elif entry.type == 'symlink':
             logger.debug(f'Creating symlink {entry_path} pointing to {entry.link_content}')
             os.symlink(entry.link_content, str(entry_path))
+        elif entry.type == 'file' and entry.hardlink is not None:
+            logger.debug(f'Creating hardlink {entry_path} to {entry.hardlink}')
+            os.link(str(root_path / entry.hardlink), str(entry_path))
         elif entry.type == 'file':
             logger.debug(f'Creating file {entry_path}')
             action_reverse_copy_file(None, {
-                '_stream': entry.stream,
+                '_stream': lambda: entry.stream,
                 '_stat': entry.stats,
                 '_backup_path': params['_backup_path'],
                 'from': entry_path,
@@ -75,10 +371,11 @@ def action_reverse_read_dir(inp, params: dict):
                 'forceCopy': params.get('forceCopy', False),
                 'preserveStats': False,
             })
+            entry.close()
 
         if preserve_stats:
             logger.debug(f'Modifying stats of file {entry_path} to match the originals')
-            _preserve_stats(entry_path, entry.stats, entry.xattrs, preserve_stats)
+            _preserve_stats(entry_path, entry.stats, lambda: entry.xattrs, preserve_stats)
 
 
 def _get_physical_path_to_docker_volume(params: dict):
@@ -117,6 +414,374 @@ def action_write_physical_docker_volume(inp, params: dict):
     return action_reverse_read_dir(inp, params)
 
 
+def _write_file_entry(entry: DirEntry, params: dict, preserve_stats):
+    logger = logging.getLogger(__name__).getChild('_write_file_entry')
+    entry_path = Path(params['_backup_path']) / params['path'] / entry.path
+    logger.debug(f'Creating file {entry_path}')
+    try:
+        action_copy_file(None, {
+            '_stream': lambda: entry.stream,
+            '_stat': entry.stats,
+            '_backup_path': params['_backup_path'],
+            '_prev_backup_path': params.get('_prev_backup_path'),
+            '_catalog': params.get('_catalog'),
+            '_prev_catalog': params.get('_prev_catalog'),
+            'to': Path(params['path']) / entry.path,
+            'chunkSize': params.get('chunkSize', 1024 * 8),
+            'reflink': params.get('reflink', False),
+            'forceCopy': params.get('forceCopy', False),
+            'hashAlgorithm': params.get('hashAlgorithm', params.get('_hash_algorithm')),
+            'preserveStats': False,
+        })
+    finally:
+        entry.close()
+
+    if preserve_stats:
+        logger.debug(f'Modifying stats of file {entry_path} to match the originals')
+        _preserve_stats(entry_path, entry.stats, lambda: entry.xattrs, preserve_stats)
+
+
+class _FileWriter:
+    """
+    Writes the files of ``to-directory``. With more than one worker, the files are copied in a pool of threads, but
+    only a few copies can be waiting to be done at the same time, to keep bounded the memory and the open files.
+    """
+
+    def __init__(self, workers: int, params: dict, preserve_stats):
+        self.__params = params
+        self.__preserve_stats = preserve_stats
+        self.__max_pending = workers * 2
+        self.__executor = ThreadPoolExecutor(workers, thread_name_prefix='mdbackup-copy') if workers > 1 else None
+        self.__slots = BoundedSemaphore(self.__max_pending)
+
+    def write(self, entry: DirEntry, futures: List[Future]):
+        """
+        Writes the file. If it is written in the pool, its future is added into ``futures``.
+        """
+        if self.__executor is None:
+            _write_file_entry(entry, self.__params, self.__preserve_stats)
+            return
+
+        self.__slots.acquire()
+        try:
+            future = self.__executor.submit(_write_file_entry, entry, self.__params, self.__preserve_stats)
+        except Exception:
+            self.__slots.release()
+            raise
+        future.add_done_callback(lambda _: self.__slots.release())
+        futures.append(future)
+        if len(futures) > self.__max_pending * 2:
+            # Forget the finished copies, so the list does not grow with the number of files of the directory
+            futures[:] = [future for future in futures if not self.__finished(future)]
+
+    def close(self):
+        self.__executor.shutdown(wait=True) if self.__executor is not None else None
+
+    @staticmethod
+    def wait(futures: List[Future]):
+        """
+        Waits for the copies to finish, raising the error of the first copy that failed (if any).
+        """
+        for future in futures:
+            future.result()
+
+    @staticmethod
+    def __finished(future: Future) -> bool:
+        if future.done():
+            future.result()
+            return True
+        return False
+
+
+def _close_directory(directory: Tuple[str, Path, DirEntry, List[Future]], preserve_stats):
+    logger = logging.getLogger(__name__).getChild('_close_directory')
+    _, entry_path, entry, futures = directory
+    _FileWriter.wait(futures)
+    # Stats are changed after writing the contents of the directory, if not the modified time would be changed
+    if preserve_stats:
+        logger.debug(f'Modifying stats of directory {entry_path} to match the originals')
+        _preserve_stats(entry_path, entry.stats, lambda: entry.xattrs, preserve_stats)
+
+
+def _write_symlink(entry: DirEntry, entry_path: Path, catalog: Optional[Catalog], preserve_stats):
+    logger = logging.getLogger(__name__).getChild('_write_symlink')
+    logger.debug(f'Creating symlink {entry_path} pointing to {entry.link_content}')
+    os.symlink(entry.link_content, str(entry_path))
+    catalog.add(entry_path, entry.stats) if catalog is not None else None
+    if preserve_stats:
+        _preserve_stats(entry_path, entry.stats, lambda: entry.xattrs, preserve_stats)
+
+
+def _write_hardlink(entry: DirEntry,
+                    parent: Path,
+                    open_dirs: List[Tuple[str, Path, Optional[DirEntry], List[Future]]],
+                    catalog: Optional[Catalog]):
+    logger = logging.getLogger(__name__).getChild('_write_hardlink')
+    entry_path = parent / entry.path
+    # The file being linked could still be copying, so wait for the copies of its directory (the rest are finished)
+    target_dir = posixpath.dirname(entry.hardlink)
+    for rel_path, _, _, futures in open_dirs:
+        _FileWriter.wait(futures) if rel_path == target_dir else None
+    logger.debug(f'Creating hardlink {entry_path} to {entry.hardlink}')
+    os.link(str(parent / entry.hardlink), str(entry_path))
+    if catalog is not None:
+        target_entry = catalog.get(parent / entry.hardlink)
+        catalog.add(entry_path, entry.stats, target_entry.hash if target_entry is not None else None)
+
+
+def _clone_file_batches(files: List[Tuple[Path, Path]], params: dict, preserve_stats):
+    """
+    Clones the files in batches. With more than one worker, the batches are cloned in a pool of threads.
+    """
+    reflink = params.get('reflink', False)
+    files_preserve_stats = preserve_stats if reflink else False
+    batches = [files[i:i + _CLONE_BATCH_SIZE] for i in range(0, len(files), _CLONE_BATCH_SIZE)]
+    workers = min(params.get('workers', 1), len(batches))
+    if workers <= 1:
+        for batch in batches:
+            _clone_files(batch, reflink, files_preserve_stats)
+        return
+
+    with ThreadPoolExecutor(workers, thread_name_prefix='mdbackup-clone') as executor:
+        futures = [executor.submit(_clone_files, batch, reflink, files_preserve_stats) for batch in batches]
+        _FileWriter.wait(futures)
+
+
+def _clone_tree(entry: DirEntry, rel_path: Path, params: dict, preserve_stats, prev_entries: List[CatalogEntry]):
+    """
+    Clones the directory from the previous backup, creating the directories and symlinks and cloning the files of
+    ``prev_entries`` (the entries of its catalog inside the directory). The stats are taken from the entries of the
+    previous backup.
+    """
+    catalog: Optional[Catalog] = params.get('_catalog')
+    prev_backup_path = Path(params['_prev_backup_path'])
+    backup_path = Path(params['_backup_path'])
+    dirs: List[Tuple[Path, Path]] = []
+    files: List[Tuple[Path, Path]] = []
+    (backup_path / rel_path).mkdir(0o755, exist_ok=True)
+    for prev_entry in prev_entries:
+        prev_path = prev_backup_path / prev_entry.path
+        entry_path = backup_path / prev_entry.path
+        if stat.S_ISDIR(prev_entry.mode):
+            entry_path.mkdir(0o755, exist_ok=True)
+            dirs.append((entry_path, prev_path))
+        elif stat.S_ISLNK(prev_entry.mode):
+            os.symlink(os.readlink(prev_path), str(entry_path))
+            _preserve_stats(entry_path, prev_path.lstat(), lambda: None, preserve_stats) if preserve_stats else None
+        else:
+            files.append((prev_path, entry_path))
+    _clone_file_batches(files, params, preserve_stats)
+
+    # Stats of the directories are changed after their contents are cloned, in reverse order (children first)
+    for entry_path, prev_path in reversed(dirs) if preserve_stats else ():
+        _preserve_stats(entry_path, prev_path.lstat(), partial(_read_xattrs, prev_path), preserve_stats)
+
+    if catalog is not None:
+        catalog.add(backup_path / rel_path, entry.stats)
+        for prev_entry in prev_entries:
+            stats = StatResult(st_mode=prev_entry.mode, st_ino=prev_entry.inode, st_size=prev_entry.size,
+                               st_mtime_ns=prev_entry.mtime_ns)
+            catalog.add(backup_path / prev_entry.path, stats, prev_entry.hash)
+
+
+def _can_clone(params: dict) -> bool:
+    return params.get('_prev_catalog') is not None and params.get('_prev_backup_path') is not None and \
+        not params.get('forceCopy', False)
+
+
+def _has_hash(prev_entry: CatalogEntry, params: dict) -> bool:
+    """
+    :return: If the file of the previous backup has the hash that this backup needs (if it needs any)
+    """
+    hash_algorithm = params.get('hashAlgorithm', params.get('_hash_algorithm'))
+    return hash_algorithm is None or hash_algorithm_of(prev_entry.hash) == hash_algorithm
+
+
+def _is_unchanged(prev_entry: CatalogEntry, stats, params: dict) -> bool:
+    """
+    Files are unchanged if they have the same size and modified time (like ``copy-file`` checks) and the hash is
+    computed with the same algorithm (if any), directories and symlinks if they have the same inode and modified time.
+    In all cases, the mode must be the same.
+    """
+    if prev_entry.mode != stats.st_mode or prev_entry.mtime_ns != stats.st_mtime_ns:
+        return False
+    if stat.S_ISREG(stats.st_mode):
+        return prev_entry.size == stats.st_size and _has_hash(prev_entry, params)
+    return prev_entry.inode == stats.st_ino
+
+
+def _unchanged_prev_entry(entry: DirEntry, params: dict) -> Optional[CatalogEntry]:
+    """
+    Looks for the entry in the catalog of the previous backup, and checks if it is unchanged (see ``_is_unchanged``).
+    Hardlinks are never unchanged.
+    :return: The entry of the catalog of the previous backup, or ``None`` if the entry changed since then
+    """
+    prev_entry = params['_prev_catalog'].get(Path(params['_prev_backup_path']) / params['path'] / entry.path)
+    if prev_entry is None or entry.hardlink is not None or not _is_unchanged(prev_entry, entry.stats, params):
+        return None
+    return prev_entry
+
+
+def _unchanged_prev_contents(entry: DirEntry, rel_path: Path, params: dict) -> Optional[List[CatalogEntry]]:
+    """
+    Looks for the contents of the directory in the catalog of the previous backup, and checks that each one is
+    unchanged (see ``_is_unchanged``) using the stats of its path inside the directory. The contents are not listed, but
+    an entry that is added or removed changes the modified time of its directory.
+    :return: The entries of the catalog of the previous backup, or ``None`` if any of them changed since then
+    """
+    if entry.real_path is None:
+        return None
+
+    prefix = rel_path.as_posix()
+    prev_entries = list(params['_prev_catalog'].entries(prefix=prefix))
+    for prev_entry in prev_entries:
+        try:
+            stats = os.lstat(entry.real_path / posixpath.relpath(prev_entry.path, prefix))
+        except FileNotFoundError:
+            return None
+        if not _is_unchanged(prev_entry, stats, params):
+            return None
+    return prev_entries
+
+
+def _clone_unchanged_dir(entry: DirEntry,
+                         params: dict,
+                         preserve_stats,
+                         prev_entries: Optional[List[CatalogEntry]] = None) -> bool:
+    """
+    Clones a directory that did not change since the previous backup with all its contents from the previous backup.
+    If ``prev_entries`` is not given (see ``DirEntry.read_contents``), the contents are taken from the catalog of the
+    previous backup, and the directory and each of its contents must be unchanged since then. The journal of changes
+    only tells which directories could have changed, so the files are checked anyway.
+    :return: False if it cannot be cloned, and its contents must be read
+    """
+    logger = logging.getLogger(__name__).getChild('_clone_unchanged_dir')
+    if not _can_clone(params):
+        return False
+
+    rel_path = Path(params['path']) / entry.path
+    if prev_entries is None:
+        if _unchanged_prev_entry(entry, params) is None:
+            return False
+        prev_entries = _unchanged_prev_contents(entry, rel_path, params)
+        if prev_entries is None:
+            logger.debug(f'Contents of {rel_path} changed since the previous backup, it will be read')
+            return False
+
+    logger.debug(f'Cloning unchanged directory {rel_path} from previous backup')
+    try:
+        _clone_tree(entry, rel_path, params, preserve_stats, prev_entries)
+    except FileNotFoundError:
+        logger.warning(f'Previous backup does not have all the contents of {rel_path}, it will be read completely')
+        shutil.rmtree(str(Path(params['_backup_path']) / rel_path), ignore_errors=True)
+        return False
+    _preserve_stats(Path(params['_backup_path']) / rel_path, entry.stats, lambda: entry.xattrs, preserve_stats) \
+        if preserve_stats else None
+    return True
+
+
+def _clone_unchanged_dirs(entries: DirEntryGenerator, clone: Callable[[DirEntry], bool]) -> DirEntryGenerator:
+    """
+    Clones the directories that did not change since the previous backup, and reads the contents of the ones that
+    cannot be cloned.
+    """
+    for entry in entries:
+        if entry.read_contents is not None and clone(entry):
+            continue
+        yield entry
+        if entry.read_contents is not None:
+            yield from _clone_unchanged_dirs(entry.read_contents(), clone)
+
+
+def _read_unchanged_subtree(entry: DirEntry,
+                            next_entry: Callable[[], Optional[DirEntry]],
+                            unchanged_prev_entry: Callable[[DirEntry], Optional[CatalogEntry]],
+                            changed: Set[str]):
+    """
+    Reads the contents of the directory while they are unchanged since the previous backup. When something changed,
+    the directories between it and ``entry`` are added to ``changed``.
+    :return: The entries read, the entry that follows the contents (if they were read completely) and the entries of
+    the previous backup for the contents (``None`` if something changed or there are too many entries)
+    """
+    dir_path = entry.path.as_posix()
+    prefix = dir_path + '/'
+    read: List[DirEntry] = []
+    prev_entries: List[CatalogEntry] = []
+    while True:
+        child = next_entry()
+        if child is None or not child.path.as_posix().startswith(prefix):
+            return read, child, prev_entries
+
+        read.append(child)
+        prev_entry = unchanged_prev_entry(child)
+        if prev_entry is None:
+            parent = posixpath.dirname(child.path.as_posix())
+            while parent != dir_path:
+                changed.add(parent)
+                parent = posixpath.dirname(parent)
+        if prev_entry is None or len(read) > _MAX_UNCHANGED_SUBTREE_ENTRIES:
+            return read, None, None
+        prev_entries.append(prev_entry)
+
+
+def _clone_unchanged_subtrees(entries: DirEntryGenerator,
+                              params: dict,
+                              clone: Callable[[DirEntry, List[CatalogEntry]], bool]) -> DirEntryGenerator:
+    """
+    Clones the directories whose whole contents did not change since the previous backup, at once. The contents of a
+    directory are kept until all have been checked, so only directories with less than
+    ``_MAX_UNCHANGED_SUBTREE_ENTRIES`` entries are cloned at once. The contents of the rest are emitted, and their
+    subdirectories could be cloned at once. The entries are looked up in the catalog of the previous backup once, the
+    results are kept while they are read again for the subdirectories.
+    """
+    entries = iter(entries)
+    pending: Deque[DirEntry] = deque()
+    # Entries of the previous backup for the entries read ahead (None if they changed)
+    looked_up: Dict[str, Optional[CatalogEntry]] = {}
+    # Directories read ahead that have something changed inside
+    changed: Set[str] = set()
+
+    def next_entry() -> Optional[DirEntry]:
+        return pending.popleft() if len(pending) > 0 else next(entries, None)
+
+    def unchanged_prev_entry(entry: DirEntry) -> Optional[CatalogEntry]:
+        path = entry.path.as_posix()
+        if path not in looked_up:
+            looked_up[path] = _unchanged_prev_entry(entry, params) if entry.read_contents is None else None
+        return looked_up[path]
+
+    entry = next_entry()
+    while entry is not None:
+        path = entry.path.as_posix()
+        unchanged = entry.type == 'dir' and path not in changed and unchanged_prev_entry(entry) is not None
+        read, following, prev_entries = \
+            _read_unchanged_subtree(entry, next_entry, unchanged_prev_entry, changed) if unchanged else ([], None, None)
+        pending.appendleft(following) if following is not None else None
+        looked_up.pop(path, None)
+        changed.discard(path)
+        if prev_entries is None or not clone(entry, prev_entries):
+            yield entry
+            pending.extendleft(reversed(read))
+        else:
+            for child in read:
+                looked_up.pop(child.path.as_posix(), None)
+        entry = next_entry()
+
+
+def _clone_unchanged(entries: DirEntryGenerator, params: dict, preserve_stats) -> DirEntryGenerator:
+    """
+    Clones from the previous backup the directories that did not change since then, the rest of entries are emitted.
+    """
+    entries = _clone_unchanged_dirs(entries, lambda entry: _clone_unchanged_dir(entry, params, preserve_stats))
+    if _can_clone(params):
+        entries = _clone_unchanged_subtrees(
+            entries,
+            params,
+            lambda entry, prev_entries: _clone_unchanged_dir(entry, params, preserve_stats, prev_entries),
+        )
+    return entries
+
+
 @action('to-directory', input='directory')
 def action_write_dir(inp: DirEntryGenerator, params: dict):
     logger = logging.getLogger(__name__).getChild('action_write_dir')
@@ -127,36 +792,44 @@ def action_write_dir(inp: DirEntryGenerator, params: dict):
     dest_path = Path(params['path'])
     parent = backup_path / dest_path
     preserve_stats = params.get('preserveStats', 'utime')
+    workers = params.get('workers', 1)
+    catalog: Optional[Catalog] = params.get('_catalog')
     parent.mkdir(0o755, parents=params.get('parents', False), exist_ok=True)
 
     raise_if_type_is_incorrect(preserve_stats, (str, bool), 'preserveStats must be a string or a boolean')
+    raise_if_type_is_incorrect(workers, int, 'workers must be an int')
+    if workers < 1:
+        raise ValueError('workers must be, at least, 1')
 
     logger.debug(f'Writing directory generator to {parent}')
-    for entry in inp:
-        entry_path = parent / entry.path
-        if entry.type == 'dir':
-            logger.debug(f'Creating directory {entry_path}')
-            entry_path.mkdir(0o755, exist_ok=True)
-        elif entry.type == 'symlink':
-            logger.debug(f'Creating symlink {entry_path} pointing to {entry.link_content}')
-            os.symlink(entry.link_content, str(entry_path))
-        elif entry.type == 'file':
-            logger.debug(f'Creating file {entry_path}')
-            action_copy_file(None, {
-                '_stream': entry.stream,
-                '_stat': entry.stats,
-                '_backup_path': params['_backup_path'],
-                '_prev_backup_path': params.get('_prev_backup_path'),
-                'to': dest_path / entry.path,
-                'chunkSize': params.get('chunkSize', 1024 * 8),
-                'reflink': params.get('reflink', False),
-                'forceCopy': params.get('forceCopy', False),
-                'preserveStats': False,
-            })
-
-        if preserve_stats:
-            logger.debug(f'Modifying stats of file {entry_path} to match the originals')
-            _preserve_stats(entry_path, entry.stats, entry.xattrs, preserve_stats)
+    inp = _clone_unchanged(inp, params, preserve_stats)
+    file_writer = _FileWriter(workers, params, preserve_stats)
+    # Directories that are being written (the innermost last), with the copies of their files that are running
+    open_dirs: List[Tuple[str, Path, Optional[DirEntry], List[Future]]] = [('', parent, None, [])]
+    try:
+        for entry in inp:
+            entry_path = parent / entry.path
+            rel_path = entry.path.as_posix()
+            while len(open_dirs) > 1 and not rel_path.startswith(open_dirs[-1][0] + '/'):
+                _close_directory(open_dirs.pop(), preserve_stats)
+
+            if entry.type == 'dir':
+                logger.debug(f'Creating directory {entry_path}')
+                entry_path.mkdir(0o755, exist_ok=True)
+                open_dirs.append((rel_path, entry_path, entry, []))
+                catalog.add(entry_path, entry.stats) if catalog is not None else None
+            elif entry.type == 'symlink':
+                _write_symlink(entry, entry_path, catalog, preserve_stats)
+            elif entry.type == 'file' and entry.hardlink is not None:
+                _write_hardlink(entry, parent, open_dirs, catalog)
+            elif entry.type == 'file':
+                file_writer.write(entry, open_dirs[-1][3])
+
+        while len(open_dirs) > 1:
+            _close_directory(open_dirs.pop(), preserve_stats)
+        _FileWriter.wait(open_dirs[0][3])
+    finally:
+        file_writer.close()
 
     return parent
 
@@ -173,8 +846,22 @@ def action_reverse_write_dir(_, params: dict):
 def action_copy_directory(_, params: dict):
     new_params = params.copy()
     new_params['path'] = params['to']
+    preserve_stats = params.get('preserveStats', 'utime')
     return action_write_dir(
-        action_read_dir(_, {'path': params['from'], 'resolveSymlinks': params.get('resolveSymlinks')}),
+        action_read_dir(_, {
+            'path': params['from'],
+            'resolveSymlinks': params.get('resolveSymlinks'),
+            'parallelScan': params.get('parallelScan', 1),
+            'include': params.get('include'),
+            'exclude': params.get('exclude'),
+            'maxFileSize': params.get('maxFileSize'),
+            'oneFileSystem': params.get('oneFileSystem', False),
+            'hardlinks': params.get('hardlinks', True),
+            'prefetchXattrs': params.get(
+                'prefetchXattrs',
+                preserve_stats is True or (isinstance(preserve_stats, str) and 'xattr' in preserve_stats),
+            ),
+        }),
         new_params,
     )
 
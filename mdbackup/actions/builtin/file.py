@@ -1,16 +1,26 @@
+import errno
 import fcntl
 import io
 import logging
 import os
 from pathlib import Path
+import stat
+from typing import Iterable, Optional, Tuple
 
-from mdbackup.actions.builtin._os_utils import _preserve_stats, _read_xattrs
+from mdbackup.actions.builtin._os_utils import _data_segments, _is_sparse, _preserve_stats, _read_xattrs
 from mdbackup.actions.builtin.command import action_command
 from mdbackup.actions.container import action, unaction
 from mdbackup.actions.ds import InputDataStream
+from mdbackup.catalog import Catalog
+from mdbackup.hashing import format_hash, hash_algorithm_of, hash_file, new_hasher
 from mdbackup.utils import raise_if_type_is_incorrect
 
 
+_KERNEL_COPY_SIZE = 1024 * 1024 * 8
+_FICLONE = 1074041865
+_KERNEL_COPY_UNSUPPORTED_ERRNOS = (errno.EINVAL, errno.ENOSYS, errno.EXDEV, errno.EOPNOTSUPP, errno.EBADF)
+
+
 @action('from-file', output='stream:file')
 def action_read_file(_, params) -> io.FileIO:
     raise_if_type_is_incorrect(params, (dict, str), 'parameters must be a dictionary or an object')
@@ -106,23 +116,169 @@ def _file_has_changed(entry, old_file: Path) -> bool:
     return mod_time_current != mod_time_prev
 
 
-def _write_file(inp: InputDataStream, out, chunk_size):
+def _file_is_in_previous_backup(entry, prev_path: Path, prev_catalog: Optional[Catalog]) -> bool:
+    """
+    Checks if the file of the previous backup at ``prev_path`` is the same as the original file. If the previous
+    backup has a catalog, the stats stored in it are used and the previous backup folder is not read.
+    """
+    if prev_catalog is None:
+        return not _file_has_changed(entry, prev_path) if prev_path.exists() else False
+
+    prev_entry = prev_catalog.get(prev_path)
+    return prev_entry is not None and prev_entry.size == entry.st_size and prev_entry.mtime_ns == entry.st_mtime_ns
+
+
+# Not all python versions nor platforms have these functions, these will be None if not available
+_copy_file_range = getattr(os, 'copy_file_range', None)
+_sendfile = (lambda in_fd, out_fd, count: os.sendfile(out_fd, in_fd, None, count)) if hasattr(os, 'sendfile') else None
+_splice = getattr(os, 'splice', None)
+
+
+def _kernel_copy(inp, out, chunk_size: int) -> bool:
+    """
+    Tries to copy the contents of ``inp`` into ``out`` without passing the data through the interpreter. For regular
+    files, ``copy_file_range`` and ``sendfile`` are used, and for pipes, ``splice``. Returns ``False`` if none of them
+    could copy the whole stream, in which case the rest of the data must be copied using the good old loop. Only
+    unbuffered files are supported, any buffered data would be lost if the file descriptor is read directly.
+    """
+    logger = logging.getLogger(__name__).getChild('_kernel_copy')
+    if not isinstance(inp, io.FileIO) or not isinstance(out, io.FileIO):
+        return False
+
+    in_fd = inp.fileno()
+    out_fd = out.fileno()
+    in_stat = os.fstat(in_fd)
+    if stat.S_ISREG(in_stat.st_mode):
+        candidates = [_copy_file_range, _sendfile]
+    elif stat.S_ISFIFO(in_stat.st_mode):
+        candidates = [_splice]
+    else:
+        return False
+
+    count = max(chunk_size, _KERNEL_COPY_SIZE)
+    for copy in candidates:
+        if copy is None:
+            continue
+        copied = 0
+        try:
+            written = copy(in_fd, out_fd, count)
+            while written > 0:
+                copied += written
+                written = copy(in_fd, out_fd, count)
+        except OSError as e:
+            if e.errno not in _KERNEL_COPY_UNSUPPORTED_ERRNOS:
+                raise
+            # Data already copied is not lost: the offsets have moved, so the next method continues from here
+            logger.debug(f'Kernel copy method is not supported for this file ({e}), trying the next one')
+            continue
+
+        # Some special files (like the ones in procfs) report EOF from the start, let the loop handle them
+        if copied > 0 or not stat.S_ISREG(in_stat.st_mode):
+            return True
+
+    return False
+
+
+def _copy_range(in_fd: int, out_fd: int, in_offset: int, out_offset: int, size: int, chunk_size: int):
+    if _copy_file_range is not None:
+        try:
+            while size > 0:
+                copied = _copy_file_range(in_fd, out_fd, size, in_offset, out_offset)
+                if copied == 0:
+                    return
+                in_offset, out_offset, size = in_offset + copied, out_offset + copied, size - copied
+            return
+        except OSError as e:
+            if e.errno not in _KERNEL_COPY_UNSUPPORTED_ERRNOS:
+                raise
+
+    while size > 0:
+        data = os.pread(in_fd, min(size, chunk_size), in_offset)
+        if len(data) == 0:
+            return
+        written = os.pwrite(out_fd, data, out_offset)
+        in_offset, out_offset, size = in_offset + written, out_offset + written, size - written
+
+
+def _sparse_copy(inp, out, chunk_size: int) -> bool:
+    """
+    If ``inp`` is a sparse file, copies only the parts that have data. The holes are skipped, so they are left as
+    holes in ``out`` (which must be a regular file without contents after its position) and they are never read nor
+    written. Returns ``False`` if the file has no holes or they cannot be found, in which case nothing was copied.
+    """
+    logger = logging.getLogger(__name__).getChild('_sparse_copy')
+    if not isinstance(inp, io.FileIO) or not isinstance(out, io.FileIO):
+        return False
+
+    in_fd = inp.fileno()
+    out_fd = out.fileno()
+    in_stat = os.fstat(in_fd)
+    if not _is_sparse(in_stat) or not stat.S_ISREG(os.fstat(out_fd).st_mode):
+        return False
+
+    start = os.lseek(in_fd, 0, os.SEEK_CUR)
+    out_start = os.lseek(out_fd, 0, os.SEEK_CUR)
+    try:
+        segments = _data_segments(in_fd, start, in_stat.st_size)
+    except OSError as e:
+        if e.errno not in _KERNEL_COPY_UNSUPPORTED_ERRNOS:
+            raise
+        logger.debug(f'Holes of the file cannot be found ({e}), it will be copied completely')
+        os.lseek(in_fd, start, os.SEEK_SET)
+        return False
+
+    logger.debug(f'Copying {sum(size for _, size in segments)} bytes of data of a sparse file of {in_stat.st_size}')
+    for offset, size in segments:
+        _copy_range(in_fd, out_fd, offset, out_start + offset - start, size, chunk_size)
+    # The holes at the end of the file only exist once the size is set
+    os.ftruncate(out_fd, out_start + in_stat.st_size - start)
+    os.lseek(in_fd, in_stat.st_size, os.SEEK_SET)
+    return True
+
+
+def _write_file(inp: InputDataStream, out, chunk_size, hasher=None):
+    """
+    Writes the contents of ``inp`` into ``out``. If a ``hasher`` is given, the contents are hashed while they are
+    copied, so the data must pass through the interpreter and the copies done by the kernel are not used.
+    """
     raise_if_type_is_incorrect(chunk_size, int, 'chunkSize is not a string')
+    if hasher is None and (_sparse_copy(inp, out, chunk_size) or _kernel_copy(inp, out, chunk_size)):
+        out.close()
+        return
+
+    # Blocks of zeros are not written into regular files, they are left as holes (like ``cp --sparse=auto`` does)
+    skip_zeros = isinstance(out, io.FileIO) and stat.S_ISREG(os.fstat(out.fileno()).st_mode)
     data = inp.read(chunk_size)
     while data is not None and len(data) != 0:
-        out.write(data)
+        hasher.update(data) if hasher is not None else None
+        if skip_zeros and data.count(0) == len(data):
+            out.seek(len(data), os.SEEK_CUR)
+        else:
+            out.write(data)
         data = inp.read(chunk_size)
+    out.truncate() if skip_zeros else None
     out.close()
 
 
+def _get_hash_algorithm(params: dict) -> Optional[str]:
+    hash_algorithm = params.get('hashAlgorithm', params.get('_hash_algorithm'))
+    raise_if_type_is_incorrect(hash_algorithm, (str, type(None)), 'hashAlgorithm must be a string')
+    return hash_algorithm
+
+
 @action('to-file', input='stream')
 def action_write_file(inp: InputDataStream, params):
     full_path = _checks(params)
+    hash_algorithm = _get_hash_algorithm(params)
+    hasher = new_hasher(hash_algorithm) if hash_algorithm is not None else None
 
     file_object = open(full_path, 'wb', buffering=0)
     chunk_size = params.get('chunkSize', 1024 * 8)
-    _write_file(inp, file_object, chunk_size)
+    _write_file(inp, file_object, chunk_size, hasher)
 
+    catalog: Optional[Catalog] = params.get('_catalog')
+    if hasher is not None and catalog is not None:
+        catalog.add(full_path, full_path.lstat(), format_hash(hash_algorithm, hasher))
     return full_path
 
 
@@ -143,6 +299,22 @@ def action_reverse_read_file(inp: InputDataStream, params):
     _write_file(inp, file_object, chunk_size)
 
 
+def _get_prev_hash(prev_path: Path, prev_catalog: Optional[Catalog], hash_algorithm: str) -> Optional[str]:
+    """
+    :return: The hash of the file in the previous backup, if it was computed with the same algorithm
+    """
+    prev_entry = prev_catalog.get(prev_path) if prev_catalog is not None else None
+    prev_hash = prev_entry.hash if prev_entry is not None else None
+    return prev_hash if hash_algorithm_of(prev_hash) == hash_algorithm else None
+
+
+def _open_orig_stream(orig_path: Optional[Path], orig_stream):
+    if orig_path is not None:
+        return open(orig_path, 'rb', buffering=0)
+    # The stream can be given as a function to open it only when it is really going to be read
+    return orig_stream() if callable(orig_stream) else orig_stream
+
+
 @action('copy-file')
 def action_copy_file(_, params: dict):
     logger = logging.getLogger(__name__).getChild('action_copy_file')
@@ -152,6 +324,8 @@ def action_copy_file(_, params: dict):
     dest_path = _checks(params)
     in_path = Path(params['to'])
     preserve_stats = params.get('preserveStats', 'utime')
+    hash_algorithm = _get_hash_algorithm(params)
+    file_hash = None
 
     raise_if_type_is_incorrect(preserve_stats, (str, bool), 'preserveStats must be a string or a boolean')
 
@@ -159,7 +333,7 @@ def action_copy_file(_, params: dict):
     if params.get('_prev_backup_path') is not None and not params.get('forceCopy', False):
         logger.debug('Checking if the file can be cloned from previous backup')
         prev_in_path = Path(params['_prev_backup_path']) / in_path
-        avoid_copy = not _file_has_changed(orig_stat, prev_in_path) if prev_in_path.exists() else False
+        avoid_copy = _file_is_in_previous_backup(orig_stat, prev_in_path, params.get('_prev_catalog'))
 
     if avoid_copy:
         try:
@@ -176,21 +350,26 @@ def action_copy_file(_, params: dict):
             # Probably the clone cannot be done due to hard-link cannot be created
             avoid_copy = False
 
+    if avoid_copy and hash_algorithm is not None:
+        file_hash = _get_prev_hash(prev_in_path, params.get('_prev_catalog'), hash_algorithm)
+        file_hash = file_hash if file_hash is not None else hash_file(dest_path, hash_algorithm)
+
     if not avoid_copy:
         logger.debug(f'Copying file {orig_path} to {in_path}')
-        action_write_file(
-            open(orig_path, 'rb', buffering=0) if orig_path is not None else orig_stream,
-            {
-                '_backup_path': params['_backup_path'],
-                'to': in_path,
-                'chunkSize': params.get('chunkSize', 1024 * 8),
-            },
-        )
+        hasher = new_hasher(hash_algorithm) if hash_algorithm is not None else None
+        stream = _open_orig_stream(orig_path, orig_stream)
+        try:
+            _write_file(stream, open(dest_path, 'wb', buffering=0), params.get('chunkSize', 1024 * 8), hasher)
+        finally:
+            stream.close() if orig_path is not None else None
+        file_hash = format_hash(hash_algorithm, hasher) if hasher is not None else None
 
     if preserve_stats:
-        xattrs = _read_xattrs(orig_path) if orig_path is not None else None
+        xattrs = (lambda: _read_xattrs(orig_path)) if orig_path is not None else None
         _preserve_stats(dest_path, orig_stat, xattrs, preserve_stats)
 
+    catalog: Optional[Catalog] = params.get('_catalog')
+    catalog.add(dest_path, orig_stat, file_hash) if catalog is not None else None
     return dest_path
 
 
@@ -214,17 +393,57 @@ def action_reverse_copy_file(_, params: dict):
         logger.debug('File will not be copied')
     else:
         logger.debug(f'Copying file {orig_path if orig_path is not None else "*stream*"} to {dest_path}')
-        _write_file(
-            open(orig_path, 'rb', buffering=0) if orig_path is not None else orig_stream,
-            open(dest_path, 'wb', buffering=0),
-            params.get('chunkSize', 1024 * 8),
-        )
+        stream = _open_orig_stream(orig_path, orig_stream)
+        try:
+            _write_file(stream, open(dest_path, 'wb', buffering=0), params.get('chunkSize', 1024 * 8))
+        finally:
+            stream.close() if orig_path is not None else None
 
     if preserve_stats:
-        xattrs = _read_xattrs(orig_path) if orig_path is not None else None
+        xattrs = (lambda: _read_xattrs(orig_path)) if orig_path is not None else None
         _preserve_stats(dest_path, orig_stat, xattrs, preserve_stats)
 
 
+def _reflink(orig_path: Path, dest_path: Path) -> bool:
+    """
+    Does a Copy on Write clone of the file, if the file system supports it (only on Linux).
+    https://stackoverflow.com/questions/52766388/how-can-i-use-the-copy-on-write-of-a-btrfs-from-c-code
+    https://github.com/coreutils/coreutils/blob/master/src/copy.c#L370
+    :return: False if the file could not be cloned, and then ``dest_path`` does not exist
+    """
+    logger = logging.getLogger(__name__).getChild('_reflink')
+    src_fd = os.open(orig_path, flags=os.O_RDONLY)
+    try:
+        dst_fd = os.open(dest_path, flags=os.O_WRONLY | os.O_CREAT | os.O_TRUNC, mode=os.fstat(src_fd).st_mode & 0o7777)
+        try:
+            fcntl.ioctl(dst_fd, _FICLONE, src_fd)
+            return True
+        except OSError:
+            logger.debug(f'Could not copy {orig_path} using CoW', exc_info=1)
+        finally:
+            os.close(dst_fd)
+    finally:
+        os.close(src_fd)
+    os.unlink(dest_path)
+    return False
+
+
+def _clone_files(files: Iterable[Tuple[Path, Path]], reflink: bool, preserve_stats):
+    """
+    Clones a batch of files like ``clone-file`` does, without its checks. Used to clone a lot of files at once (i.e.
+    whole directories from the previous backup). Once a Copy on Write clone fails, the rest of files of the batch are
+    cloned using hardlinks, as they will probably be in the same file system.
+    :param files: The pairs of paths of the original file and the clone
+    """
+    reflink = reflink and os.uname().sysname == 'Linux'
+    for orig_path, dest_path in files:
+        reflink = reflink and _reflink(orig_path, dest_path)
+        if not reflink:
+            os.link(str(orig_path), str(dest_path))
+        elif preserve_stats:
+            _preserve_stats(dest_path, orig_path.lstat(), lambda: _read_xattrs(orig_path), preserve_stats)
+
+
 @action('clone-file')
 def action_clone_file(_, params: dict):
     logger = logging.getLogger(__name__).getChild('action_clone_file')
@@ -237,27 +456,10 @@ def action_clone_file(_, params: dict):
     cow_failed = False
     if params.get('reflink', True):
         if os.uname().sysname == 'Linux':
-            # Do a Copy on Write clone if possible (only on Linux)
-            # https://stackoverflow.com/questions/52766388/how-can-i-use-the-copy-on-write-of-a-btrfs-from-c-code
-            # https://github.com/coreutils/coreutils/blob/master/src/copy.c#L370
-            if not dest_path.exists():
-                dest_path.touch(orig_path.lstat().st_mode)
-            src_fd = os.open(orig_path, flags=os.O_RDONLY)
-            dst_fd = os.open(dest_path, flags=os.O_WRONLY | os.O_TRUNC)
-            try:
-                logger.debug(f'Copying using CoW from {orig_path} to {dest_path}')
-                fcntl.ioctl(dst_fd, 1074041865, src_fd)  # FICLONE but hardcoded
-            except OSError:
-                logger.debug('Could not copy using CoW', exc_info=1)
-                cow_failed = True
-            os.close(src_fd)
-            os.close(dst_fd)
-            if cow_failed:
-                os.unlink(dest_path)
-
-            if preserve_stats:
-                xattrs = _read_xattrs(orig_path)
-                _preserve_stats(dest_path, orig_path.lstat(), xattrs, preserve_stats)
+            logger.debug(f'Copying using CoW from {orig_path} to {dest_path}')
+            cow_failed = not _reflink(orig_path, dest_path)
+            if not cow_failed and preserve_stats:
+                _preserve_stats(dest_path, orig_path.lstat(), lambda: _read_xattrs(orig_path), preserve_stats)
         else:
             cow_failed = True
 
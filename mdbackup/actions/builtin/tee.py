@@ -0,0 +1,108 @@
+import logging
+import os
+from pathlib import Path
+from threading import Thread
+from typing import Any, Dict, List, Optional
+
+from mdbackup.actions.container import action
+from mdbackup.actions.ds import InputDataStream
+from mdbackup.actions.runner import run_task_actions
+from mdbackup.utils import raise_if_type_is_incorrect
+
+
+def _branch_actions(branch: List[Dict[str, Any]], params: dict) -> List[Dict[str, Any]]:
+    """
+    Injects the parameters of the tee action (the environment and the internal parameters like ``_backup_path``) into
+    the actions of a branch, as it is done for the actions of a task.
+    """
+    inherited_params = {key: value for key, value in params.items() if key not in ('branches', 'chunkSize')}
+    actions = []
+    for action_def in branch:
+        raise_if_type_is_incorrect(action_def, dict, 'each action of a branch must be a dictionary', required=True)
+        key, value = next(iter(action_def.items()))
+        if isinstance(value, dict):
+            actions.append({key: {**inherited_params, **value}})
+        else:
+            actions.append({key: value})
+    return actions
+
+
+def _write_all(fd: int, data: bytes):
+    view = memoryview(data)
+    while len(view) > 0:
+        written = os.write(fd, view)
+        view = view[written:]
+
+
+def _run_branch(name: str, actions: List[Dict[str, Any]], read_fd: int, results: list, index: int):
+    logger = logging.getLogger(__name__).getChild('_run_branch')
+    inp = os.fdopen(read_fd, 'rb', buffering=0, closefd=True)
+    try:
+        results[index] = run_task_actions(name, actions, inp)
+    except Exception as e:
+        logger.error(f'Branch {name} failed')
+        results[index] = e
+    finally:
+        # Closing the read side makes the tee writes fail (instead of blocking) if the branch did not read everything
+        inp.close()
+
+
+@action('tee', input='stream')
+def action_tee(inp: InputDataStream, params) -> Optional[Path]:
+    logger = logging.getLogger(__name__).getChild('action_tee')
+    raise_if_type_is_incorrect(params, dict, 'parameters must be a dictionary', required=True)
+    branches = params.get('branches')
+    chunk_size = params.get('chunkSize', 1024 * 64)
+
+    raise_if_type_is_incorrect(branches, list, 'branches must be a list of lists of actions', required=True)
+    raise_if_type_is_incorrect(chunk_size, int, 'chunkSize must be an int')
+    if len(branches) == 0:
+        raise ValueError('tee requires at least one branch')
+
+    branches_actions = []
+    for branch in branches:
+        raise_if_type_is_incorrect(branch, list, 'each branch must be a list of actions', required=True)
+        branches_actions.append(_branch_actions(branch, params))
+
+    results: list = [None] * len(branches_actions)
+    write_fds: Dict[int, int] = {}
+    threads: List[Thread] = []
+    try:
+        for i, actions in enumerate(branches_actions):
+            read_fd, write_fd = os.pipe()
+            write_fds[i] = write_fd
+            thread = Thread(target=_run_branch,
+                            args=(f'tee#{i}', actions, read_fd, results, i),
+                            name=f'mdbackup-tee-{i}',
+                            daemon=True)
+            thread.start()
+            threads.append(thread)
+
+        data = inp.read(chunk_size)
+        while data is not None and len(data) != 0 and len(write_fds) > 0:
+            for i, write_fd in list(write_fds.items()):
+                try:
+                    _write_all(write_fd, data)
+                except BrokenPipeError:
+                    # The branch stopped reading (probably failed), the rest of branches continue
+                    logger.warning(f'Branch tee#{i} stopped reading the stream')
+                    os.close(write_fd)
+                    del write_fds[i]
+            data = inp.read(chunk_size)
+    finally:
+        for write_fd in write_fds.values():
+            os.close(write_fd)
+        for thread in threads:
+            thread.join()
+
+    failed = [(i, result) for i, result in enumerate(results) if not isinstance(result, Path)]
+    if len(failed) > 0:
+        raise RuntimeError(
+            '\n\n'.join(f'tee#{i}: {result if result is not None else "did not return a path"}'
+                        for i, result in failed),
+            failed,
+        )
+
+    for i, result in enumerate(results[1:], start=1):
+        logger.info(f'Branch tee#{i} wrote {result}')
+    return results[0]
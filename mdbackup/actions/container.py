@@ -119,6 +119,10 @@ def get_unaction(identifier: str) -> _AnyAction:
     return _actions[identifier].unaction
 
 
+def get_expected_input(identifier: str) -> Optional[str]:
+    return _actions[identifier].input
+
+
 def are_compatible(id1: str, id2: str) -> Optional[str]:
     action1 = _actions[id1]
     action2 = _actions[id2]
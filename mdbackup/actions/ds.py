@@ -1,73 +1,138 @@
 import io
 import os
 from pathlib import Path
+import stat
 import subprocess
-from typing import Callable, Generator, Optional, Union
+from types import MappingProxyType
+from typing import Callable, Generator, Mapping, Optional, Union
 
 from mdbackup.actions.builtin._os_utils import _read_xattrs
 
 
+EMPTY_XATTRS: Mapping[str, bytes] = MappingProxyType({})
+_NOT_READ = object()
+
+
 class DirEntry:
-    stream: Optional[io.IOBase] = None
-    link_content: Optional[str] = None
-    real_path: Optional[Path] = None
-    xattrs: Optional[dict] = None
+    """
+    An entry of a directory tree. To keep low the memory used when there are lots of entries, the instances have no
+    ``__dict__``, the paths are stored as strings, the stats are stored as a compact ``StatResult`` and all entries
+    without extended attributes share the same empty (and read only) ``EMPTY_XATTRS``.
+    """
+
+    __slots__ = ('type', 'stats', 'link_content', 'hardlink', 'read_contents', '__path', '__real_path', '__stream',
+                 '__xattrs')
 
-    def __init__(self, _type: str, path: Path, stats, **kwargs):
+    def __init__(self, _type: str, path: Union[str, Path], stats, **kwargs):
         self.type = _type
-        self.path = path
-        self.stats = stats
+        self.__path = str(path)
+        self.stats = StatResult.from_stat_result(stats)
+        self.__stream = None
+        self.link_content: Optional[str] = None
+        # Path (relative to the root of the tree) of a previous entry that is the same file, if this one is a hardlink
+        self.hardlink: Optional[str] = None
+        # If set, the contents of the directory have not been read because they did not change since the previous
+        # backup, calling it reads them
+        self.read_contents: Optional[Callable[[], 'DirEntryGenerator']] = None
         if self.type == 'file':
-            self.stream = kwargs['stream']
+            self.__stream = kwargs.get('stream')
+            self.hardlink = kwargs.get('hardlink')
         elif self.type == 'symlink':
             self.link_content = kwargs['link_content']
 
-        self.real_path = kwargs.get('real_path')
-        self.xattrs = kwargs.get('xattrs')
+        real_path = kwargs.get('real_path')
+        self.__real_path = str(real_path) if real_path is not None else None
+        self.__xattrs = self.__compact_xattrs(kwargs['xattrs']) if 'xattrs' in kwargs else _NOT_READ
+
+    @property
+    def path(self) -> Path:
+        """
+        :return: The path of the entry, relative to the root of the tree
+        """
+        return Path(self.__path)
+
+    @property
+    def real_path(self) -> Optional[Path]:
+        """
+        :return: The path of the entry in the file system, if the entry comes from it
+        """
+        return Path(self.__real_path) if self.__real_path is not None else None
+
+    @property
+    def xattrs(self) -> Optional[Mapping[str, bytes]]:
+        """
+        :return: The extended attributes of the entry. For entries read from the disk, they are read the first time
+        they are requested, so they are only read for the entries that are going to use them. If they cannot be read,
+        returns ``None``.
+        """
+        if self.__xattrs is _NOT_READ:
+            try:
+                xattrs = _read_xattrs(self.__real_path) if self.__real_path is not None else None
+            except (PermissionError, OSError):
+                # Extended attributes cannot be read for some good reason
+                xattrs = None
+            self.__xattrs = self.__compact_xattrs(xattrs)
+        return self.__xattrs
+
+    @staticmethod
+    def __compact_xattrs(xattrs: Optional[Mapping[str, bytes]]) -> Optional[Mapping[str, bytes]]:
+        return xattrs if xattrs is None or len(xattrs) > 0 else EMPTY_XATTRS
+
+    @property
+    def stream(self) -> Optional[io.IOBase]:
+        """
+        :return: The contents of the file. For files read from the disk, the file is opened the first time the
+        stream is requested, so files that are never read are never opened.
+        """
+        if self.__stream is None and self.type == 'file' and self.__real_path is not None:
+            self.__stream = open(self.__real_path, 'rb', buffering=0)
+        return self.__stream
+
+    def close(self):
+        """
+        Closes the stream of the file, if it was opened. Must be called once the contents of the file are consumed.
+        """
+        if self.__stream is not None:
+            self.__stream.close()
 
     @staticmethod
     def from_real_path(path: Path, root_path: Optional[Path] = None, **kwargs) -> 'DirEntry':
-        stats = path.lstat()
         rel_path = path.relative_to(root_path) if root_path is not None else path
-        try:
-            xattrs = _read_xattrs(path)
-        except (PermissionError, OSError):
-            # Extended attributes cannot be read for some good reason
-            xattrs = None
-
-        if path.is_dir():
-            return DirEntry('dir', rel_path, stats, real_path=path, xattrs=xattrs, **kwargs)
-        elif path.is_symlink():
-            return DirEntry('symlink',
-                            rel_path,
-                            stats,
-                            link_content=os.readlink(path),
-                            real_path=path,
-                            xattrs=xattrs,
-                            **kwargs)
-        elif path.is_file():
-            return DirEntry('file',
-                            rel_path, stats,
-                            stream=open(path, 'rb', buffering=0),
-                            real_path=path,
-                            xattrs=xattrs,
-                            **kwargs)
+        return DirEntry.from_stat(path, rel_path, path.lstat(), real_path=path, **kwargs)
+
+    @staticmethod
+    def from_stat(path: Union[str, Path], rel_path: Path, stats, **kwargs) -> 'DirEntry':
+        """
+        Creates the entry for the file in ``path`` using its already known ``lstat()`` result, so the type is known
+        without doing more stat calls. The extended attributes are not read until they are requested.
+        """
+        kwargs.setdefault('real_path', path)
+        if stat.S_ISDIR(stats.st_mode):
+            return DirEntry('dir', rel_path, stats, **kwargs)
+        elif stat.S_ISLNK(stats.st_mode):
+            return DirEntry('symlink', rel_path, stats, link_content=os.readlink(path), **kwargs)
+        elif stat.S_ISREG(stats.st_mode):
+            return DirEntry('file', rel_path, stats, **kwargs)
         else:
             raise TypeError('Expected directory, symlink or file for a path')
 
     @staticmethod
     def from_tar_info(tar_info, **kwargs) -> 'DirEntry':
-        stats = StatResult()
-        stats.st_mode = tar_info.mode
-        stats.st_uid = tar_info.uid
-        stats.st_gid = tar_info.gid
-        stats.st_mtime = tar_info.mtime
-        stats.st_size = tar_info.size
+        stats = StatResult(
+            st_mode=tar_info.mode,
+            st_uid=tar_info.uid,
+            st_gid=tar_info.gid,
+            st_size=tar_info.size,
+            st_mtime_ns=int(tar_info.mtime * 1_000_000_000),
+        )
 
         if tar_info.isdir():
             stats.st_mode = stats.st_mode | os.st.S_IFDIR
             return DirEntry('dir', tar_info.name, stats, **kwargs)
-        elif tar_info.islnk() or tar_info.issym():
+        elif tar_info.islnk():
+            stats.st_mode = stats.st_mode | os.st.S_IFREG
+            return DirEntry('file', tar_info.name, stats, hardlink=tar_info.linkname, **kwargs)
+        elif tar_info.issym():
             stats.st_mode = stats.st_mode | os.st.S_IFLNK
             return DirEntry('symlink', tar_info.name, stats, link_content=tar_info.linkname, **kwargs)
         elif tar_info.isreg():
@@ -91,17 +156,58 @@ DirEntryToDataStreamTransformAction = Callable[[DirEntryGenerator, dict], Output
 DirEntryFinalAction = Callable[[DirEntryGenerator, dict], None]
 
 
+def read_all_contents(entries: DirEntryGenerator) -> DirEntryGenerator:
+    """
+    Reads the contents of the directories that were not read because they did not change since the previous backup
+    (see ``DirEntry.read_contents``), for the actions that need all the entries.
+    """
+    for entry in entries:
+        yield entry
+        if entry.read_contents is not None:
+            yield from read_all_contents(entry.read_contents())
+
+
 class StatResult:
-    st_mode: int = 0
-    st_ino: int = 0
-    st_dev: int = 0
-    st_nlink: int = 0
-    st_uid: int = 0
-    st_gid: int = 0
-    st_size: int = 0
-    st_atime: float = 0.0
-    st_mtime: float = 0.0
-    st_ctime: float = 0.0
-    st_atime_ns: int = 0
-    st_mtime_ns: int = 0
-    st_ctime_ns: int = 0
+    """
+    Compact version of ``os.stat_result`` that only keeps the fields used by the actions. The times are stored in
+    nanoseconds only, the ``float`` versions are calculated from them.
+    """
+
+    __slots__ = ('st_mode', 'st_ino', 'st_dev', 'st_nlink', 'st_uid', 'st_gid', 'st_size',
+                 'st_atime_ns', 'st_mtime_ns', 'st_ctime_ns')
+
+    def __init__(self, st_mode: int = 0, st_ino: int = 0, st_dev: int = 0, st_nlink: int = 0, st_uid: int = 0,
+                 st_gid: int = 0, st_size: int = 0, st_atime_ns: int = 0, st_mtime_ns: int = 0, st_ctime_ns: int = 0):
+        self.st_mode = st_mode
+        self.st_ino = st_ino
+        self.st_dev = st_dev
+        self.st_nlink = st_nlink
+        self.st_uid = st_uid
+        self.st_gid = st_gid
+        self.st_size = st_size
+        self.st_atime_ns = st_atime_ns
+        self.st_mtime_ns = st_mtime_ns
+        self.st_ctime_ns = st_ctime_ns
+
+    @property
+    def st_atime(self) -> float:
+        return self.st_atime_ns / 1_000_000_000
+
+    @property
+    def st_mtime(self) -> float:
+        return self.st_mtime_ns / 1_000_000_000
+
+    @property
+    def st_ctime(self) -> float:
+        return self.st_ctime_ns / 1_000_000_000
+
+    @staticmethod
+    def from_stat_result(stats) -> 'StatResult':
+        """
+        Converts the result of ``os.stat()`` (or similar) into a ``StatResult``. If it is already one, it is returned
+        as is.
+        """
+        if isinstance(stats, StatResult):
+            return stats
+        return StatResult(stats.st_mode, stats.st_ino, stats.st_dev, stats.st_nlink, stats.st_uid, stats.st_gid,
+                          stats.st_size, stats.st_atime_ns, stats.st_mtime_ns, stats.st_ctime_ns)
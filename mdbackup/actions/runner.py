@@ -1,12 +1,30 @@
+from collections import deque
 import io
 import logging
+import os
 from pathlib import Path
+import stat
 import subprocess
+import sys
+from threading import Thread
+import time
 import types
-from typing import Any, Dict, List, Optional, Tuple
+from typing import Any, Deque, Dict, List, Optional, Tuple
 
-from mdbackup.actions.container import are_compatible, get_action, get_unaction, is_final
-from mdbackup.actions.ds import OutputDataStream
+from mdbackup.actions.container import are_compatible, get_action, get_expected_input, get_unaction, is_final
+from mdbackup.actions.ds import DirEntryGenerator, InputDataStream, OutputDataStream
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+
+_STDERR_BUFFER_SIZE = 64 * 1024
+_STDERR_LINE_SIZE = 8 * 1024
+# F_SETPIPE_SZ is only available in Python 3.10+, but the value is the same in every Linux
+_F_SETPIPE_SZ = getattr(fcntl, 'F_SETPIPE_SZ', 1031 if sys.platform.startswith('linux') else None)
+_PIPE_MAX_SIZE_PATH = Path('/proc/sys/fs/pipe-max-size')
 
 
 def _get_action_key_from_definition(action_def: dict):
@@ -23,12 +41,15 @@ def _get_unaction_from_definition(action_def: dict) -> Tuple[Any, dict, str]:
     return (get_unaction(key), action_def[key], key)
 
 
-def _check_for_incompatible_actions(actions: List[Dict[str, Any]]):
+def _check_for_incompatible_actions(actions: List[Dict[str, Any]], has_input: bool = False):
     if len(actions) == 0:
         return
 
     logger = logging.getLogger(__name__).getChild('_check_for_incompatible_actions')
     prev_action = _get_action_key_from_definition(actions[0])
+    if has_input and get_expected_input(prev_action) != 'stream':
+        logger.warning(f'{prev_action} cannot receive a stream as input')
+        raise Exception(f'{prev_action} cannot receive a stream as input')
     for action_def in actions[1:]:
         action = _get_action_key_from_definition(action_def)
         comp = are_compatible(prev_action, action)
@@ -83,15 +104,224 @@ def _process_output(output, action_key: str):
     return prev_input, thing
 
 
-def _cleanup(things_to_dipose: List[Tuple[OutputDataStream, str]], has_raised: bool):
+class _StderrBuffer:
+    """
+    Keeps the last ``max_size`` bytes of the lines written into the ``stderr`` of a process. Each line is logged (in
+    debug) as soon as it is appended.
+    """
+
+    def __init__(self, action_key: str, max_size: int = _STDERR_BUFFER_SIZE):
+        self.__logger = logging.getLogger(__name__).getChild('stderr').getChild(action_key)
+        self.__max_size = max_size
+        self.__lines: Deque[bytes] = deque()
+        self.__size = 0
+        self.__truncated = False
+
+    def append(self, line: bytes):
+        if self.__logger.isEnabledFor(logging.DEBUG):
+            self.__logger.debug(line.decode('utf-8', errors='replace').rstrip())
+        self.__lines.append(line)
+        self.__size += len(line)
+        while self.__size > self.__max_size and len(self.__lines) > 1:
+            self.__size -= len(self.__lines.popleft())
+            self.__truncated = True
+
+    def contents(self) -> str:
+        """
+        :return: The last lines appended, starting with ``[...]`` if some lines were discarded.
+        """
+        contents = b''.join(self.__lines).decode('utf-8', errors='replace')
+        return f'[...]\n{contents}' if self.__truncated else contents
+
+
+class _StderrCollector:
+    """
+    Reads continuously the ``stderr`` of a process in a background thread, so a process that writes a lot in it does
+    not get blocked when the pipe is full. Only the last ``max_size`` bytes are kept.
+    """
+
+    def __init__(self, stream, action_key: str, max_size: int = _STDERR_BUFFER_SIZE):
+        # Unbuffered streams (like the ones of processes with bufsize=0) would read the lines byte by byte
+        self.__stream = io.BufferedReader(stream) if isinstance(stream, io.RawIOBase) else stream
+        self.__buffer = _StderrBuffer(action_key, max_size)
+        self.__thread = Thread(target=self.__run, name=f'mdbackup-stderr-{action_key}', daemon=True)
+
+    def start(self) -> '_StderrCollector':
+        self.__thread.start()
+        return self
+
+    def __run(self):
+        try:
+            while True:
+                line = self.__stream.readline(_STDERR_LINE_SIZE)
+                if len(line) == 0:
+                    break
+                self.__buffer.append(line)
+        except (OSError, ValueError):
+            # The stream has been closed, nothing more can be read
+            pass
+        finally:
+            self.__stream.close()
+
+    def join(self) -> str:
+        """
+        Waits until the stream is fully read and returns the contents kept in the buffer.
+        :return: The last lines of the stream.
+        """
+        self.__thread.join()
+        return self.__buffer.contents()
+
+
+def _collect_stderr(output, action_key: str, collectors: Dict[int, _StderrCollector]):
+    if isinstance(output, subprocess.Popen) and output.stderr is not None:
+        collectors[id(output)] = _StderrCollector(output.stderr, action_key).start()
+
+
+def _set_pipe_size(stream, size: Optional[int]) -> Optional[int]:
+    """
+    Grows the pipe behind the stream (if it is a pipe) to ``size`` bytes. If the size is bigger than allowed, the
+    maximum size allowed by the system is used instead. Returns the size the pipe has now, or ``None`` if it could
+    not be changed.
+    """
+    if size is None or fcntl is None or _F_SETPIPE_SZ is None:
+        return None
+
+    logger = logging.getLogger(__name__).getChild('_set_pipe_size')
+    try:
+        fd = stream.fileno()
+        if not stat.S_ISFIFO(os.fstat(fd).st_mode):
+            return None
+    except (AttributeError, OSError, ValueError):
+        return None
+
+    try:
+        return fcntl.fcntl(fd, _F_SETPIPE_SZ, size)
+    except PermissionError:
+        # Unprivileged processes cannot go beyond the system maximum
+        try:
+            max_size = int(_PIPE_MAX_SIZE_PATH.read_text())
+            if max_size < size:
+                return fcntl.fcntl(fd, _F_SETPIPE_SZ, max_size)
+        except (OSError, ValueError):
+            pass
+    except OSError as e:
+        logger.debug(f'Could not change the size of the pipe: {e}')
+    return None
+
+
+def _new_stage_stats(action_key: str) -> Dict[str, Any]:
+    return {
+        'action': action_key,
+        'wallTime': None,
+        'cpuTime': None,
+        'maxRss': None,
+        'bytesIn': None,
+        'bytesOut': None,
+        'pipeSize': None,
+    }
+
+
+def _read_process_io(pid: int) -> Optional[Dict[str, int]]:
+    try:
+        with open(f'/proc/{pid}/io', 'r') as io_file:
+            return {key: int(value) for key, value in (line.split(': ') for line in io_file if ': ' in line)}
+    except (OSError, ValueError):
+        return None
+
+
+def _wait_process_with_usage(process: subprocess.Popen, stage: Dict[str, Any]) -> int:
+    """
+    Waits the process like ``Popen.wait()`` but reaps it using ``wait4()`` to get its resource usage, and fills the
+    stats of the stage with it. When available (Linux), the I/O counters of the process are read as well just before
+    reaping it. The process is reaped holding the same lock ``Popen`` uses, so no other thread sees the process as
+    running (and sends a signal to a reused pid) after it has been reaped and before its return code is set.
+    """
+    if hasattr(os, 'waitid'):
+        try:
+            os.waitid(os.P_PID, process.pid, os.WEXITED | os.WNOWAIT)
+            io_counters = _read_process_io(process.pid)
+            if io_counters is not None:
+                stage['bytesIn'] = io_counters.get('rchar')
+                stage['bytesOut'] = io_counters.get('wchar')
+        except ChildProcessError:
+            pass
+
+    with process._waitpid_lock:
+        if process.returncode is not None:
+            return process.returncode
+        try:
+            _, status, rusage = os.wait4(process.pid, 0)
+        except ChildProcessError:
+            # Already reaped by someone else
+            rusage = None
+        else:
+            process.returncode = os.WEXITSTATUS(status) if os.WIFEXITED(status) else -os.WTERMSIG(status)
+    if rusage is None:
+        return process.wait()
+
+    stage['cpuTime'] = rusage.ru_utime + rusage.ru_stime
+    # Linux gives the value in KiB, macOS in bytes
+    stage['maxRss'] = rusage.ru_maxrss if sys.platform == 'darwin' else rusage.ru_maxrss * 1024
+    return process.returncode
+
+
+class _ProcessWaiter:
+    """
+    Reaps the process of a stage in a background thread as soon as it ends, so the wall time and the resource usage
+    of the stage are the ones of its process, and not the ones of the whole pipeline.
+    """
+
+    def __init__(self, process: subprocess.Popen, stage: Dict[str, Any], start: float):
+        self.__process = process
+        self.__stage = stage
+        self.__start = start
+        self.__thread = Thread(target=self.__run, name=f'mdbackup-wait-{stage["action"]}', daemon=True)
+
+    def start(self) -> '_ProcessWaiter':
+        self.__thread.start()
+        return self
+
+    def __run(self):
+        _wait_process_with_usage(self.__process, self.__stage)
+        self.__stage['wallTime'] = time.monotonic() - self.__start
+
+    def join(self) -> int:
+        """
+        Waits until the process has been reaped.
+        :return: The return code of the process.
+        """
+        self.__thread.join()
+        return self.__process.wait()
+
+
+def _wait_stage_process(output, stages: Dict[int, Tuple[Dict[str, Any], float]], waiters: Dict[int, _ProcessWaiter]):
+    if isinstance(output, subprocess.Popen) and id(output) in stages:
+        stage, start = stages[id(output)]
+        waiters[id(output)] = _ProcessWaiter(output, stage, start).start()
+
+
+def _cleanup(things_to_dipose: List[Tuple[OutputDataStream, str]],
+             has_raised: bool,
+             stderr_collectors: Optional[Dict[int, _StderrCollector]] = None,
+             process_waiters: Optional[Dict[int, _ProcessWaiter]] = None):
     logger = logging.getLogger(__name__).getChild('_cleanup')
+    stderr_collectors = stderr_collectors if stderr_collectors is not None else {}
+    process_waiters = process_waiters if process_waiters is not None else {}
     failed = []
     for (thing, action) in things_to_dipose:
         logger.debug(f'Waiting for {action} to dispose')
         if isinstance(thing, subprocess.Popen):
             thing.send_signal(subprocess.signal.SIGTERM) if has_raised else None
-            lines = ''.join(map(lambda l: l.decode('utf-8'), thing.stderr))
-            rc = thing.wait()
+            collector = stderr_collectors.get(id(thing))
+            if collector is None:
+                lines = ''.join(map(lambda line: line.decode('utf-8'), thing.stderr))
+            # The stats of the stage are filled by its waiter, when the process ended
+            waiter = process_waiters.get(id(thing))
+            rc = waiter.join() if waiter is not None else thing.wait()
+            if collector is not None:
+                lines = collector.join()
+            stdout = getattr(thing, 'stdout', None)
+            stdout.close() if stdout is not None else None
             if rc != 0:
                 failed.append((action, lines))
         else:
@@ -101,43 +331,124 @@ def _cleanup(things_to_dipose: List[Tuple[OutputDataStream, str]], has_raised: b
         raise RuntimeError('\n\n'.join((f'{action}:\n{lines}' for action, lines in failed)), failed)
 
 
-def run_task_actions(task_name: str, actions: List[Dict[str, Any]]) -> Optional[Path]:
+def _file_size(stream) -> Optional[int]:
+    try:
+        stats = os.fstat(stream.fileno())
+    except (AttributeError, OSError, ValueError):
+        return None
+    return stats.st_size if stat.S_ISREG(stats.st_mode) else None
+
+
+def _timed_entries(entries: DirEntryGenerator, stage: Dict[str, Any], start: float) -> DirEntryGenerator:
+    """
+    Emits the entries of a stage that returns a directory, and records its wall time when all of them have been
+    consumed or the generator is closed.
+    """
+    try:
+        yield from entries
+    finally:
+        stage['wallTime'] = time.monotonic() - start
+
+
+def _record_stage(stats: Optional[List[Dict[str, Any]]],
+                  stages: Dict[int, Tuple[Dict[str, Any], float]],
+                  action_key: str,
+                  start: float,
+                  output,
+                  stream,
+                  pipe_size: Optional[int]):
+    """
+    Adds the stats of the stage. The wall time is known when the output of the stage ends: processes are waited (see
+    ``_ProcessWaiter``), directories are wrapped to know when their entries are consumed and regular files are already
+    written when the action returns. For the rest of streams (i.e. pipes written by a thread), the end is not known.
+    :return: The stream to pass to the next stage
+    """
+    if stats is None:
+        return stream
+
+    stage = _new_stage_stats(action_key)
+    stage['pipeSize'] = pipe_size
+    stats.append(stage)
+    if isinstance(output, subprocess.Popen):
+        # The rest of measurements are taken when the process ends
+        stages[id(output)] = (stage, start)
+    elif isinstance(stream, types.GeneratorType):
+        return _timed_entries(stream, stage, start)
+    else:
+        stage['bytesOut'] = _file_size(stream)
+        if stage['bytesOut'] is not None:
+            stage['wallTime'] = time.monotonic() - start
+    return stream
+
+
+def _record_final_stage(stats: Optional[List[Dict[str, Any]]], action_key: str, start: float, result: Path):
+    if stats is None:
+        return
+
+    stage = _new_stage_stats(action_key)
+    stage['wallTime'] = time.monotonic() - start
+    stage['bytesIn'] = result.stat().st_size if result.is_file() else None
+    stats.append(stage)
+
+
+def run_task_actions(task_name: str,
+                     actions: List[Dict[str, Any]],
+                     inp: Optional[InputDataStream] = None,
+                     stats: Optional[List[Dict[str, Any]]] = None,
+                     pipe_size: Optional[int] = None) -> Optional[Path]:
+    """
+    Runs the actions of a task and returns the path of the result of the final action. If ``inp`` is defined, it will
+    be passed as input to the first action. If ``stats`` is a list, it will be filled with the measurements of each
+    action: wall time (in seconds), bytes that went in and out of it, size of the pipe of its output and, for
+    processes, CPU time (in seconds) and the peak of memory (in bytes). Measurements that cannot be done for an action
+    are left as ``None``. If ``pipe_size`` is defined, the pipes between actions will be grown to that size (in bytes).
+    """
     logger = logging.getLogger(__name__).getChild('run_task_actions')
     if len(actions) == 0:
         logger.warning(f'Task {task_name} has no actions')
         return
 
     logger.info(f'Starting run of task {task_name}')
-    _check_for_incompatible_actions(actions)
+    _check_for_incompatible_actions(actions, has_input=inp is not None)
 
     things_to_dipose: List[Tuple[OutputDataStream, str]] = []
-    prev_input = None
+    stages: Dict[int, Tuple[Dict[str, Any], float]] = {}
+    stderr_collectors: Dict[int, _StderrCollector] = {}
+    process_waiters: Dict[int, _ProcessWaiter] = {}
+    prev_input = inp
     has_raised = False
     try:
         for action_def in actions[:-1]:
             action, params, action_key = _get_action_from_definition(action_def)
             logger.info(f'Running action {action_key}')
 
+            start = time.monotonic()
             output = action(prev_input, params)
             prev_input, thing = _process_output(output, action_key)
+            _collect_stderr(output, action_key, stderr_collectors)
+            applied_pipe_size = _set_pipe_size(prev_input, pipe_size)
             things_to_dipose.append(thing) if thing is not None else None
+            prev_input = _record_stage(stats, stages, action_key, start, output, prev_input, applied_pipe_size)
+            _wait_stage_process(output, stages, process_waiters)
 
         action, params, action_key = _get_action_from_definition(actions[-1])
         logger.info(f'Running final action {action_key} and waiting for the whole process to end')
+        start = time.monotonic()
         result = action(prev_input, params)
         if result is None or not isinstance(result, Path):
             raise ValueError(f'Action {action_key} does not return the path of its output (return value must be Path)')
+        _record_final_stage(stats, action_key, start, result)
         return result
     except Exception as e:
         has_raised = True
         logger.exception('An action raised an exception')
         raise e
     finally:
-        _cleanup(things_to_dipose, has_raised)
+        _cleanup(things_to_dipose, has_raised, stderr_collectors, process_waiters)
         logger.info(f'End running task {task_name}')
 
 
-def run_task_unactions(task_name: str, actions: List[Dict[str, Any]]):
+def run_task_unactions(task_name: str, actions: List[Dict[str, Any]], pipe_size: Optional[int] = None):
     logger = logging.getLogger(__name__).getChild('run_task_unactions')
     if len(actions) == 0:
         logger.warning(f'Task {task_name} has no actions')
@@ -148,6 +459,7 @@ def run_task_unactions(task_name: str, actions: List[Dict[str, Any]]):
     _check_for_missing_unactions(actions)
 
     things_to_dipose: List[Tuple[OutputDataStream, str]] = []
+    stderr_collectors: Dict[int, _StderrCollector] = {}
     prev_input = None
     has_raised = False
     unactions = list(reversed(actions))
@@ -158,6 +470,8 @@ def run_task_unactions(task_name: str, actions: List[Dict[str, Any]]):
 
             output = unaction(prev_input, params)
             prev_input, thing = _process_output(output, unaction_key)
+            _collect_stderr(output, unaction_key, stderr_collectors)
+            _set_pipe_size(prev_input, pipe_size)
             things_to_dipose.append(thing) if thing is not None else None
 
         unaction, params, unaction_key = _get_unaction_from_definition(unactions[-1])
@@ -168,5 +482,5 @@ def run_task_unactions(task_name: str, actions: List[Dict[str, Any]]):
         logger.exception('An unaction raised an exception')
         raise e
     finally:
-        _cleanup(things_to_dipose, has_raised)
+        _cleanup(things_to_dipose, has_raised, stderr_collectors=stderr_collectors)
         logger.info(f'End running task {task_name}')
@@ -0,0 +1,250 @@
+import asyncio
+from concurrent.futures import Executor, Future
+import inspect
+import logging
+import os
+from pathlib import Path
+import subprocess
+from threading import Lock, Thread
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+from mdbackup.actions.ds import InputDataStream, OutputDataStream
+from mdbackup.actions.runner import (
+    _check_for_incompatible_actions,
+    _get_action_from_definition,
+    _process_output,
+    _record_final_stage,
+    _record_stage,
+    _set_pipe_size,
+    _STDERR_LINE_SIZE,
+    _StderrBuffer,
+    _wait_process_with_usage,
+)
+
+
+_event_loop: Optional[asyncio.AbstractEventLoop] = None
+_event_loop_lock = Lock()
+
+
+class _AsyncStderrReader:
+    """
+    Reads the ``stderr`` of a process from the event loop as soon as something is written into it, without using
+    any thread. Only the last lines are kept, see ``_StderrBuffer``.
+    """
+
+    def __init__(self, stream, action_key: str, loop: asyncio.AbstractEventLoop):
+        self.__stream = stream
+        self.__fd = stream.fileno()
+        self.__loop = loop
+        self.__buffer = _StderrBuffer(action_key)
+        self.__pending = b''
+        self.__done = loop.create_future()
+        os.set_blocking(self.__fd, False)
+        loop.add_reader(self.__fd, self.__read)
+
+    def __read(self):
+        try:
+            data = os.read(self.__fd, _STDERR_LINE_SIZE)
+        except BlockingIOError:
+            return
+        except OSError:
+            data = b''
+
+        if len(data) == 0:
+            self.__finish()
+            return
+
+        *lines, self.__pending = (self.__pending + data).split(b'\n')
+        for line in lines:
+            self.__buffer.append(line + b'\n')
+        if len(self.__pending) >= _STDERR_LINE_SIZE:
+            self.__buffer.append(self.__pending)
+            self.__pending = b''
+
+    def __finish(self):
+        if len(self.__pending) > 0:
+            self.__buffer.append(self.__pending)
+            self.__pending = b''
+        self.__loop.remove_reader(self.__fd)
+        self.__stream.close()
+        self.__done.set_result(None)
+
+    async def join(self) -> str:
+        """
+        Waits until the stream is fully read and returns the contents kept in the buffer.
+        :return: The last lines of the stream.
+        """
+        await self.__done
+        return self.__buffer.contents()
+
+
+def _wait_process(process: subprocess.Popen, stage: Optional[Dict[str, Any]]) -> int:
+    return process.wait() if stage is None else _wait_process_with_usage(process, stage)
+
+
+def _pidfd_open(pid: int) -> Optional[int]:
+    if not hasattr(os, 'pidfd_open'):
+        return None
+    try:
+        return os.pidfd_open(pid)
+    except OSError:
+        return None
+
+
+async def _wait_process_async(process: subprocess.Popen, stage: Optional[Dict[str, Any]]) -> int:
+    """
+    Waits for the process to end without blocking the event loop. In Linux, a ``pidfd`` is used to know when the
+    process ends. In other platforms, the process is waited in a thread of the default executor.
+    """
+    loop = asyncio.get_running_loop()
+    pidfd = _pidfd_open(process.pid)
+    if pidfd is None:
+        return await loop.run_in_executor(None, _wait_process, process, stage)
+
+    try:
+        exited = loop.create_future()
+        loop.add_reader(pidfd, lambda: exited.done() or exited.set_result(None))
+        try:
+            await exited
+        finally:
+            loop.remove_reader(pidfd)
+    finally:
+        os.close(pidfd)
+
+    # The process has already ended, so this will not block
+    return _wait_process(process, stage)
+
+
+async def _wait_stage_process_async(process: subprocess.Popen, stage: Dict[str, Any], start: float) -> int:
+    """
+    Waits for the process of a stage and records its wall time as soon as it ends, and not when the whole pipeline
+    ends.
+    """
+    rc = await _wait_process_async(process, stage)
+    stage['wallTime'] = time.monotonic() - start
+    return rc
+
+
+async def _cleanup_async(things_to_dipose: List[Tuple[OutputDataStream, str]],
+                         has_raised: bool,
+                         stderr_readers: Dict[int, _AsyncStderrReader],
+                         process_waiters: Dict[int, asyncio.Task]):
+    logger = logging.getLogger(__name__).getChild('_cleanup_async')
+    failed = []
+    for (thing, action) in things_to_dipose:
+        logger.debug(f'Waiting for {action} to dispose')
+        if isinstance(thing, subprocess.Popen):
+            thing.send_signal(subprocess.signal.SIGTERM) if has_raised else None
+            waiter = process_waiters.get(id(thing))
+            rc = await waiter if waiter is not None else await _wait_process_async(thing, None)
+            reader = stderr_readers.get(id(thing))
+            lines = await reader.join() if reader is not None else ''
+            stdout = getattr(thing, 'stdout', None)
+            stdout.close() if stdout is not None else None
+            if rc != 0:
+                failed.append((action, lines))
+        else:
+            thing.close()
+
+    if len(failed) > 0:
+        raise RuntimeError('\n\n'.join((f'{action}:\n{lines}' for action, lines in failed)), failed)
+
+
+async def _call_action(action, inp, params, executor: Optional[Executor]):
+    if inspect.iscoroutinefunction(action):
+        return await action(inp, params)
+    # Even starting an action can block (i.e. opening a file or reading a folder), so it does not run in the loop
+    return await asyncio.get_running_loop().run_in_executor(executor, action, inp, params)
+
+
+async def run_task_actions_async(task_name: str,
+                                 actions: List[Dict[str, Any]],
+                                 inp: Optional[InputDataStream] = None,
+                                 stats: Optional[List[Dict[str, Any]]] = None,
+                                 pipe_size: Optional[int] = None,
+                                 executor: Optional[Executor] = None) -> Optional[Path]:
+    """
+    Runs the actions of a task like ``run_task_actions`` but as a coroutine, so many tasks can run in the same event
+    loop. Processes are waited and their ``stderr`` is read from the event loop, without a thread for each of them.
+    Actions can be coroutine functions (``async def``) and they will be awaited. The rest of actions run in the
+    ``executor`` (by default, the default executor of the loop), as they can block: the final action blocks until all
+    the data is read, and only one action of the task runs in it at the same time.
+    """
+    logger = logging.getLogger(__name__).getChild('run_task_actions_async')
+    if len(actions) == 0:
+        logger.warning(f'Task {task_name} has no actions')
+        return
+
+    logger.info(f'Starting run of task {task_name}')
+    _check_for_incompatible_actions(actions, has_input=inp is not None)
+
+    loop = asyncio.get_running_loop()
+    things_to_dipose: List[Tuple[OutputDataStream, str]] = []
+    stages: Dict[int, Tuple[Dict[str, Any], float]] = {}
+    stderr_readers: Dict[int, _AsyncStderrReader] = {}
+    process_waiters: Dict[int, asyncio.Task] = {}
+    prev_input = inp
+    has_raised = False
+    try:
+        for action_def in actions[:-1]:
+            action, params, action_key = _get_action_from_definition(action_def)
+            logger.info(f'Running action {action_key}')
+
+            start = time.monotonic()
+            output = await _call_action(action, prev_input, params, executor)
+            prev_input, thing = _process_output(output, action_key)
+            if isinstance(output, subprocess.Popen) and output.stderr is not None:
+                stderr_readers[id(output)] = _AsyncStderrReader(output.stderr, action_key, loop)
+            applied_pipe_size = _set_pipe_size(prev_input, pipe_size)
+            if thing is not None:
+                things_to_dipose.append(thing)
+            prev_input = _record_stage(stats, stages, action_key, start, output, prev_input, applied_pipe_size)
+            if isinstance(output, subprocess.Popen) and id(output) in stages:
+                process_waiters[id(output)] = loop.create_task(_wait_stage_process_async(output, *stages[id(output)]))
+
+        action, params, action_key = _get_action_from_definition(actions[-1])
+        logger.info(f'Running final action {action_key} and waiting for the whole process to end')
+        start = time.monotonic()
+        result = await _call_action(action, prev_input, params, executor)
+        if result is None or not isinstance(result, Path):
+            raise ValueError(f'Action {action_key} does not return the path of its output (return value must be Path)')
+        _record_final_stage(stats, action_key, start, result)
+        return result
+    except Exception as e:
+        has_raised = True
+        logger.exception('An action raised an exception')
+        raise e
+    finally:
+        await _cleanup_async(things_to_dipose, has_raised, stderr_readers, process_waiters)
+        logger.info(f'End running task {task_name}')
+
+
+def _get_event_loop() -> asyncio.AbstractEventLoop:
+    global _event_loop
+    with _event_loop_lock:
+        if _event_loop is None:
+            _event_loop = asyncio.new_event_loop()
+            Thread(target=_event_loop.run_forever, name='mdbackup-asyncio', daemon=True).start()
+        return _event_loop
+
+
+def submit_to_event_loop(coroutine) -> Future:
+    """
+    Schedules the coroutine in the event loop shared by all the tasks, which runs in its own thread (created on the
+    first call).
+    :return: The future (of ``concurrent.futures``) of the result of the coroutine
+    """
+    return asyncio.run_coroutine_threadsafe(coroutine, _get_event_loop())
+
+
+def run_task_actions_in_event_loop(task_name: str,
+                                   actions: List[Dict[str, Any]],
+                                   inp: Optional[InputDataStream] = None,
+                                   stats: Optional[List[Dict[str, Any]]] = None,
+                                   pipe_size: Optional[int] = None) -> Optional[Path]:
+    """
+    Runs the actions of a task using ``run_task_actions_async`` in the event loop shared by all the tasks (see
+    ``submit_to_event_loop``), and waits for the result.
+    """
+    return submit_to_event_loop(run_task_actions_async(task_name, actions, inp, stats, pipe_size)).result()
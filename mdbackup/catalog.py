@@ -0,0 +1,175 @@
+import logging
+from pathlib import Path
+import sqlite3
+from threading import Lock
+import time
+from typing import Dict, Generator, NamedTuple, Optional, Tuple
+
+
+class CatalogEntry(NamedTuple):
+    path: str
+    size: int
+    mtime_ns: int
+    inode: int
+    mode: int
+    hash: Optional[str]
+
+
+class Catalog:
+    """
+    Index of the entries written into a backup, with the stats that the original entries had when they were copied.
+    It is stored in a SQLite database inside the backup folder, with the paths relative to the backup folder as key,
+    so the next backup can know if a file has changed without reading the previous backup folder. The catalog can be
+    used from several threads at the same time. The writes are grouped in transactions of some entries, so call
+    ``close()`` when the backup is done to write the last ones.
+    """
+
+    _BATCH_SIZE = 1000
+
+    def __init__(self, path: Path, root: Path, read_only: bool = False):
+        self.__path = path
+        self.__root = root
+        self.__lock = Lock()
+        # The entries not written yet, by their path
+        self.__pending: Dict[str, Tuple[str, int, int, int, int, Optional[str]]] = {}
+        if read_only:
+            self.__db = sqlite3.connect(f'{path.absolute().as_uri()}?mode=ro', uri=True, check_same_thread=False)
+            # Fails now if the file is not a catalog
+            self.__db.execute('SELECT 1 FROM files LIMIT 1').fetchall()
+        else:
+            self.__db = sqlite3.connect(str(path), check_same_thread=False)
+            # The catalog can be created again from the backup contents, there is no need to wait for the disk
+            self.__db.execute('PRAGMA synchronous = OFF')
+            self.__db.execute('''
+                CREATE TABLE IF NOT EXISTS files (
+                    path TEXT PRIMARY KEY,
+                    size INTEGER NOT NULL,
+                    mtime_ns INTEGER NOT NULL,
+                    inode INTEGER NOT NULL,
+                    mode INTEGER NOT NULL,
+                    hash TEXT
+                ) WITHOUT ROWID
+            ''')
+            self.__db.execute('CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value) WITHOUT ROWID')
+            # If the backup is resumed, the catalog keeps the time when the backup started the first time
+            self.__db.execute("INSERT OR IGNORE INTO meta VALUES ('startedNs', ?)", (time.time_ns(),))
+            self.__db.commit()
+
+    @property
+    def path(self) -> Path:
+        return self.__path
+
+    @property
+    def root(self) -> Path:
+        """
+        :return: The folder where the paths of the catalog are relative to
+        """
+        return self.__root
+
+    @property
+    def started_ns(self) -> Optional[int]:
+        """
+        :return: The time (in nanoseconds) when the backup started, or ``None`` if the catalog does not know it
+        """
+        with self.__lock:
+            try:
+                row = self.__db.execute("SELECT value FROM meta WHERE key = 'startedNs'").fetchone()
+            except sqlite3.OperationalError:
+                # Catalogs created by older versions have no meta table
+                return None
+        return row[0] if row is not None else None
+
+    def add(self, path: Path, stats, file_hash: Optional[str] = None):
+        """
+        Records the entry written at ``path`` (inside the root folder) with the stats of the original entry.
+        """
+        rel_path = Path(path).relative_to(self.__root).as_posix()
+        with self.__lock:
+            self.__pending[rel_path] = (
+                rel_path, stats.st_size, stats.st_mtime_ns, stats.st_ino, stats.st_mode, file_hash,
+            )
+            if len(self.__pending) >= self._BATCH_SIZE:
+                self.__flush()
+
+    def remove(self, path: Path):
+        """
+        Forgets the entry written at ``path`` (inside the root folder) and, if it is a folder, the entries inside it.
+        """
+        rel_path = Path(path).relative_to(self.__root).as_posix()
+        with self.__lock:
+            self.__pending = {
+                key: row for key, row in self.__pending.items()
+                if key != rel_path and not key.startswith(rel_path + '/')
+            }
+            self.__db.execute(
+                'DELETE FROM files WHERE path = ? OR (path >= ? AND path < ?)',
+                (rel_path, rel_path + '/', rel_path + '0'),
+            )
+            self.__db.commit()
+
+    def get(self, path: Path) -> Optional[CatalogEntry]:
+        """
+        :return: The entry written at ``path`` (inside the root folder), or ``None`` if it is not in the catalog
+        """
+        try:
+            rel_path = Path(path).relative_to(self.__root).as_posix()
+        except ValueError:
+            return None
+
+        with self.__lock:
+            # Only if the entry is waiting to be written, flushing on every lookup would write a transaction each time
+            self.__flush() if rel_path in self.__pending else None
+            row = self.__db.execute(
+                'SELECT path, size, mtime_ns, inode, mode, hash FROM files WHERE path = ?',
+                (rel_path,),
+            ).fetchone()
+        return CatalogEntry(*row) if row is not None else None
+
+    def entries(self, prefix: Optional[str] = None) -> Generator[CatalogEntry, None, None]:
+        """
+        :param prefix: If defined, only the entries inside this folder (relative to the root folder) are returned.
+        :return: The entries of the catalog, sorted by path
+        """
+        with self.__lock:
+            self.__flush()
+            if prefix is None:
+                rows = self.__db.execute('SELECT path, size, mtime_ns, inode, mode, hash FROM files ORDER BY path')
+            else:
+                prefix = prefix.rstrip('/')
+                # The paths inside the folder are between "prefix/" and "prefix0" ('0' goes after '/'), so the range
+                # can be looked up in the primary key instead of checking all the paths
+                rows = self.__db.execute(
+                    'SELECT path, size, mtime_ns, inode, mode, hash FROM files WHERE path >= ? AND path < ? '
+                    'ORDER BY path',
+                    (prefix + '/', prefix + '0'),
+                )
+            rows = rows.fetchall()
+        return (CatalogEntry(*row) for row in rows)
+
+    def close(self):
+        with self.__lock:
+            self.__flush()
+            self.__db.close()
+
+    def __flush(self):
+        if len(self.__pending) > 0:
+            self.__db.executemany('INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, ?)', self.__pending.values())
+            self.__db.commit()
+            self.__pending = {}
+
+    @staticmethod
+    def open_previous(path: Path, root: Path) -> Optional['Catalog']:
+        """
+        Opens the catalog of a previous backup to read it.
+        :return: The catalog, or ``None`` if the backup has no catalog or it cannot be read
+        """
+        logger = logging.getLogger(__name__).getChild('Catalog').getChild('open_previous')
+        if not path.exists():
+            logger.debug(f'Previous backup has no catalog at {path}')
+            return None
+
+        try:
+            return Catalog(path, root, read_only=True)
+        except sqlite3.DatabaseError:
+            logger.warning(f'Catalog {path} cannot be read, it will not be used')
+            return None
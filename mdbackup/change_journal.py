@@ -0,0 +1,333 @@
+import ctypes
+import ctypes.util
+import errno
+import fcntl
+import hashlib
+import json
+import logging
+import os
+from pathlib import Path
+import select
+import struct
+from threading import Event
+import time
+from typing import Dict, List, Optional, Set, Tuple
+
+
+CHANGES_FOLDER_NAME = '.changes'
+
+# A directory is recorded again if it changes after this time since it was recorded the last time, so the journal
+# does not grow with every write. Readers also accept records a bit older than they ask for, to cover this.
+_RECORD_INTERVAL_NS = 1_000_000_000
+_MARGIN_NS = 60 * _RECORD_INTERVAL_NS
+_COMPACT_LINES = 100_000
+
+_IN_MODIFY = 0x00000002
+_IN_ATTRIB = 0x00000004
+_IN_CLOSE_WRITE = 0x00000008
+_IN_MOVED_FROM = 0x00000040
+_IN_MOVED_TO = 0x00000080
+_IN_CREATE = 0x00000100
+_IN_DELETE = 0x00000200
+_IN_DELETE_SELF = 0x00000400
+_IN_MOVE_SELF = 0x00000800
+_IN_Q_OVERFLOW = 0x00004000
+_IN_IGNORED = 0x00008000
+_IN_ONLYDIR = 0x01000000
+_IN_DONT_FOLLOW = 0x02000000
+_IN_EXCL_UNLINK = 0x04000000
+_IN_ISDIR = 0x40000000
+_IN_CLOEXEC = 0o2000000
+_WATCH_MASK = _IN_MODIFY | _IN_ATTRIB | _IN_CLOSE_WRITE | _IN_MOVED_FROM | _IN_MOVED_TO | _IN_CREATE | \
+    _IN_DELETE | _IN_DELETE_SELF | _IN_MOVE_SELF | _IN_ONLYDIR | _IN_DONT_FOLLOW | _IN_EXCL_UNLINK
+_EVENT_HEADER = struct.Struct('iIII')
+
+
+def journal_path(changes_folder: Path, root: Path) -> Path:
+    """
+    :return: The path of the journal of the changes inside ``root``
+    """
+    return changes_folder / (hashlib.sha1(str(root).encode('utf-8')).hexdigest()[:16] + '.journal')
+
+
+class ChangeJournal:
+    """
+    Records the directories whose contents have changed inside a folder (the root), so a backup can read only those
+    and take the rest from the previous backup. The journal is written by a watcher (see ``ChangeWatcher``) and it is a
+    file with one JSON object per line: the first one has the root and the time when the watcher started to see the
+    changes, the rest are the directories that changed (relative to the root) with the time they changed, or the times
+    when some changes were lost. While the watcher runs, it holds a lock on a file next to the journal, so the
+    readers know that the journal is still being written. Times are in nanoseconds.
+    """
+
+    def __init__(self, path: Path, root: Path):
+        self.__path = path
+        self.__root = root
+        self.__lock_path = path.with_name(path.name + '.lock')
+        self.__lock_fd: Optional[int] = None
+        self.__file = None
+        self.__lines = 0
+        self.__started_ns = 0
+        self.__overflow_ns: Optional[int] = None
+        self.__recorded: Dict[str, int] = {}
+
+    @property
+    def path(self) -> Path:
+        return self.__path
+
+    @property
+    def root(self) -> Path:
+        return self.__root
+
+    def lock(self):
+        """
+        Locks the journal to write into it. Raises ``RuntimeError`` if another watcher is writing into it.
+        """
+        self.__path.parent.mkdir(0o755, parents=True, exist_ok=True)
+        fd = os.open(self.__lock_path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            os.close(fd)
+            raise RuntimeError(f'The changes of {self.__root} are already being recorded by another watcher')
+        self.__lock_fd = fd
+
+    def start(self, started_ns: int):
+        """
+        Starts a new journal, removing the previous contents. ``started_ns`` is the time since the changes are seen.
+        """
+        self.__started_ns = started_ns
+        self.__overflow_ns = None
+        self.__recorded = {}
+        self.__rewrite([{'root': str(self.__root), 'startedNs': started_ns}])
+
+    def record(self, rel_path: str, now_ns: Optional[int] = None):
+        """
+        Records that the contents of the directory (relative to the root) have changed.
+        """
+        now_ns = now_ns if now_ns is not None else time.time_ns()
+        if now_ns - self.__recorded.get(rel_path, 0) < _RECORD_INTERVAL_NS:
+            return
+        self.__recorded[rel_path] = now_ns
+        self.__write({'dir': rel_path, 'timeNs': now_ns})
+        if self.__lines >= _COMPACT_LINES:
+            self.__compact()
+
+    def overflow(self, now_ns: Optional[int] = None):
+        """
+        Records that some changes have been lost, so the journal cannot be used for the backups that started before.
+        """
+        self.__overflow_ns = now_ns if now_ns is not None else time.time_ns()
+        self.__write({'overflowNs': self.__overflow_ns})
+
+    def close(self):
+        self.__file.close() if self.__file is not None else None
+        self.__file = None
+        if self.__lock_fd is not None:
+            os.close(self.__lock_fd)
+            self.__lock_fd = None
+
+    def is_being_written(self) -> bool:
+        """
+        :return: True if a watcher is running and writing into the journal
+        """
+        try:
+            fd = os.open(self.__lock_path, os.O_RDONLY)
+        except FileNotFoundError:
+            return False
+        try:
+            fcntl.flock(fd, fcntl.LOCK_SH | fcntl.LOCK_NB)
+            return False
+        except BlockingIOError:
+            return True
+        finally:
+            os.close(fd)
+
+    def changed_dirs(self, since_ns: int) -> Optional[Set[str]]:
+        """
+        Reads the directories that have changed since the given time.
+        :return: The directories (relative to the root), or ``None`` if the journal cannot tell which directories have
+        changed since then: there is no journal, the watcher is not running, it started later or some changes were
+        lost.
+        """
+        logger = logging.getLogger(__name__).getChild('ChangeJournal').getChild('changed_dirs')
+        if not self.is_being_written() or not self.__path.exists():
+            logger.info(f'There is no watcher recording the changes of {self.__root}')
+            return None
+
+        changed: Set[str] = set()
+        with open(self.__path, 'r') as journal_file:
+            header = json.loads(journal_file.readline() or '{}')
+            if header.get('root') != str(self.__root) or header.get('startedNs', since_ns + 1) > since_ns:
+                logger.info(f'The journal of {self.__root} does not have all changes since the previous backup')
+                return None
+
+            since_ns -= _MARGIN_NS
+
+            for line in journal_file:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    # The last line could be being written right now
+                    continue
+                if entry.get('overflowNs', 0) >= since_ns:
+                    logger.info(f'Some changes of {self.__root} were lost since the previous backup')
+                    return None
+                if entry.get('timeNs', 0) >= since_ns:
+                    changed.add(entry['dir'])
+        return changed
+
+    def __write(self, entry: dict):
+        self.__file.write(json.dumps(entry) + '\n')
+        self.__file.flush()
+        self.__lines += 1
+
+    def __compact(self):
+        # Only the last time each directory was recorded is needed
+        entries = [{'root': str(self.__root), 'startedNs': self.__started_ns}]
+        entries.extend([{'overflowNs': self.__overflow_ns}] if self.__overflow_ns is not None else [])
+        entries.extend({'dir': rel_path, 'timeNs': time_ns} for rel_path, time_ns in self.__recorded.items())
+        self.__rewrite(entries)
+
+    def __rewrite(self, entries: List[dict]):
+        # Written in a temporary file and renamed, so the readers always see a complete journal
+        tmp_path = self.__path.with_name(self.__path.name + '.tmp')
+        with open(tmp_path, 'w') as journal_file:
+            journal_file.writelines(json.dumps(entry) + '\n' for entry in entries)
+        os.replace(tmp_path, self.__path)
+        self.__file.close() if self.__file is not None else None
+        self.__file = open(self.__path, 'a')
+        self.__lines = len(entries)
+
+
+class _Inotify:
+    """
+    Minimal wrapper of the ``inotify`` API of Linux.
+    """
+
+    def __init__(self):
+        libc_name = ctypes.util.find_library('c')
+        if not hasattr(os, 'uname') or os.uname().sysname != 'Linux' or libc_name is None:
+            raise NotImplementedError('Watching for changes is only supported in Linux')
+        self.__libc = ctypes.CDLL(libc_name, use_errno=True)
+        self.fd = self.__libc.inotify_init1(_IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), os.strerror(ctypes.get_errno()))
+
+    def add_watch(self, path: str) -> int:
+        wd = self.__libc.inotify_add_watch(self.fd, os.fsencode(path), _WATCH_MASK)
+        if wd < 0:
+            raise OSError(ctypes.get_errno(), os.strerror(ctypes.get_errno()), path)
+        return wd
+
+    def rm_watch(self, wd: int):
+        self.__libc.inotify_rm_watch(self.fd, wd)
+
+    def read_events(self) -> List[Tuple[int, int, str]]:
+        """
+        :return: The events that are available, as tuples of watch descriptor, mask and name
+        """
+        data = os.read(self.fd, 1024 * 64)
+        events = []
+        pos = 0
+        while pos < len(data):
+            wd, mask, _, name_size = _EVENT_HEADER.unpack_from(data, pos)
+            pos += _EVENT_HEADER.size
+            name = os.fsdecode(data[pos:pos + name_size].rstrip(b'\0'))
+            pos += name_size
+            events.append((wd, mask, name))
+        return events
+
+    def close(self):
+        os.close(self.fd)
+
+
+class ChangeWatcher:
+    """
+    Watches a folder (the root) and all the directories inside it using ``inotify``, and records into the journal the
+    directories whose contents change. New directories are watched as soon as they are seen. If the kernel loses
+    events or a directory cannot be watched (i.e. the limit of watches is reached), it is recorded in the journal.
+    """
+
+    def __init__(self, root: Path, journal: ChangeJournal):
+        self.__root = root
+        self.__journal = journal
+        self.__watches: Dict[int, str] = {}
+
+    def run(self, stop: Event):
+        """
+        Watches for changes until ``stop`` is set.
+        """
+        logger = logging.getLogger(__name__).getChild('ChangeWatcher').getChild('run')
+        inotify = _Inotify()
+        self.__journal.lock()
+        try:
+            watched_all = self.__watch_tree(inotify, str(self.__root), '', record=False)
+            # Changes done while the watches were being added could have been lost, so the journal starts after
+            self.__journal.start(time.time_ns())
+            self.__journal.overflow() if not watched_all else None
+            logger.info(f'Watching {len(self.__watches)} directories of {self.__root}')
+            while not stop.is_set():
+                readable, _, _ = select.select([inotify.fd], [], [], 1)
+                for event in (inotify.read_events() if len(readable) > 0 else ()):
+                    self.__process_event(inotify, *event)
+        finally:
+            self.__journal.close()
+            inotify.close()
+
+    def __process_event(self, inotify: _Inotify, wd: int, mask: int, name: str):
+        logger = logging.getLogger(__name__).getChild('ChangeWatcher').getChild('process_event')
+        if mask & _IN_Q_OVERFLOW:
+            logger.warning(f'Some changes of {self.__root} have been lost')
+            self.__journal.overflow()
+            return
+
+        rel_path = self.__watches.get(wd)
+        if rel_path is None:
+            return
+        if mask & _IN_IGNORED:
+            del self.__watches[wd]
+            return
+
+        self.__journal.record(rel_path)
+        if len(name) > 0 and mask & _IN_ISDIR:
+            child_rel_path = f'{rel_path}/{name}' if rel_path else name
+            if mask & _IN_MOVED_FROM:
+                # The watches keep the old paths, they are added again if the directory is moved inside the root
+                self.__unwatch_tree(inotify, child_rel_path)
+            elif mask & (_IN_CREATE | _IN_MOVED_TO):
+                if not self.__watch_tree(inotify, str(self.__root / child_rel_path), child_rel_path, record=True):
+                    self.__journal.overflow()
+
+    def __watch_tree(self, inotify: _Inotify, path: str, rel_path: str, record: bool) -> bool:
+        """
+        Watches the directory and all directories inside it. If ``record`` is set, all of them are recorded as changed
+        (they are new, and something could have changed inside them before they were watched).
+        :return: False if some directory could not be watched
+        """
+        logger = logging.getLogger(__name__).getChild('ChangeWatcher').getChild('watch_tree')
+        pending = [(path, rel_path)]
+        while len(pending) > 0:
+            path, rel_path = pending.pop()
+            try:
+                self.__watches[inotify.add_watch(path)] = rel_path
+                self.__journal.record(rel_path) if record else None
+                with os.scandir(path) as it:
+                    pending.extend((entry.path, f'{rel_path}/{entry.name}' if rel_path else entry.name)
+                                   for entry in it if entry.is_dir(follow_symlinks=False))
+            except FileNotFoundError:
+                # Removed while it was being watched
+                continue
+            except OSError as e:
+                if e.errno != errno.ENOSPC:
+                    raise
+                logger.warning(f'Cannot watch {path}, the limit of watches has been reached '
+                               '(see /proc/sys/fs/inotify/max_user_watches)')
+                return False
+        return True
+
+    def __unwatch_tree(self, inotify: _Inotify, rel_path: str):
+        for wd, watched_rel_path in list(self.__watches.items()):
+            if watched_rel_path == rel_path or watched_rel_path.startswith(rel_path + '/'):
+                inotify.rm_watch(wd)
+                del self.__watches[wd]
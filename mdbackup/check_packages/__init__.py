@@ -44,6 +44,13 @@ def check_paramiko(package: str):
         raise ImportError(f'To use {package}, you must install paramiko: pip install paramiko', e)
 
 
+def check_xxhash(package: str):
+    try:
+        import xxhash
+    except ImportError as e:
+        raise ImportError(f'To use {package}, you must install xxhash: pip install xxhash', e)
+
+
 def check(package: str, *funcs):
     def check_dec(func):
         @functools.wraps(func)
@@ -0,0 +1,217 @@
+import hashlib
+import io
+import json
+import logging
+import os
+from pathlib import Path
+import tempfile
+import time
+from typing import Any, Dict, Generator, Iterable, List, Optional, Set, Tuple
+
+
+CHUNKS_FOLDER_NAME = '.chunks'
+RECIPE_SUFFIX = '.chunks'
+RECIPE_VERSION = 1
+
+_READ_SIZE = 1024 * 1024 * 16
+
+
+def _anchor_bit(*parts: bytes) -> int:
+    return hashlib.blake2b(b''.join(parts), digest_size=1, person=b'mdbackup-cdc').digest()[0] & 1
+
+
+# Each byte value is assigned to one of two classes, and a chunk ends where the classes of the last bytes follow the
+# anchor pattern. Both are derived from a hash, so they never change: if they did, the data would be chunked in a
+# different way and nothing would be deduplicated against the chunks already stored.
+_CLASSES_TABLE = bytes(_anchor_bit(bytes([i])) for i in range(256))
+_ANCHOR_PATTERN = bytes(_anchor_bit(b'pattern', i.to_bytes(4, 'little')) for i in range(32))
+
+
+def _chunk_limits(average_size: int) -> Tuple[int, int, bytes]:
+    if average_size < 4096 or average_size & (average_size - 1) != 0:
+        raise ValueError('averageChunkSize must be a power of 2 and, at least, 4096')
+    # The anchor appears, more or less, once every 2^(length of the pattern) bytes after the minimum size
+    pattern = _ANCHOR_PATTERN[:average_size.bit_length() - 2]
+    return average_size // 4, average_size * 4, pattern
+
+
+def split_chunks(stream, average_size: int = 1024 * 1024) -> Generator[bytes, None, None]:
+    """
+    Splits the contents of the stream into chunks using content-defined chunking: the places where the stream is cut
+    depend on the data around them and not on their offset, so inserting or removing data only changes the chunks
+    around the modified part. The bytes are classified into two classes using a table, and a chunk ends when the last
+    bytes match the anchor pattern. Both steps are done with ``bytes.translate()`` and ``bytes.find()``, so the data
+    is never iterated byte by byte in python. The chunks are between a quarter and four times ``average_size``.
+    """
+    min_size, max_size, pattern = _chunk_limits(average_size)
+    buffer = bytearray()
+    eof = False
+    while not eof or len(buffer) > 0:
+        while not eof and len(buffer) < max(_READ_SIZE, max_size * 2):
+            data = stream.read(_READ_SIZE)
+            eof = data is None or len(data) == 0
+            buffer += data if not eof else b''
+
+        classes = buffer.translate(_CLASSES_TABLE)
+        pos = 0
+        # Without the end of the stream, the last chunk could not be cut in the right place yet
+        while len(buffer) - pos >= max_size or (eof and pos < len(buffer)):
+            anchor = classes.find(pattern, pos + min_size - len(pattern), pos + max_size)
+            end = anchor + len(pattern) if anchor >= 0 else min(pos + max_size, len(buffer))
+            yield bytes(buffer[pos:end])
+            pos = end
+        del buffer[:pos]
+
+
+class ChunksReader(io.RawIOBase):
+    """
+    Reads the contents of a list of chunks of a ``ChunkStore`` as a stream. Chunks are read one by one when needed.
+    """
+
+    def __init__(self, store: 'ChunkStore', chunks: Iterable[str]):
+        self.__store = store
+        self.__chunks = iter(chunks)
+        self.__current = memoryview(b'')
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer) -> int:
+        while len(self.__current) == 0:
+            chunk_hash = next(self.__chunks, None)
+            if chunk_hash is None:
+                return 0
+            self.__current = memoryview(self.__store.get(chunk_hash))
+
+        size = min(len(buffer), len(self.__current))
+        buffer[:size] = self.__current[:size]
+        self.__current = self.__current[size:]
+        return size
+
+
+class ChunkStore:
+    """
+    Content-addressed storage of chunks of data, shared by all the backups of the ``backupsPath``. Each chunk is
+    stored once, in a file named after the BLAKE2b hash of its contents, so the chunks that are equal in several
+    backups (or several times in the same backup) take the space of one. The backups store recipes, the list of
+    chunks needed to rebuild each file or stream.
+    """
+
+    def __init__(self, path: Path):
+        self.__path = path
+
+    @property
+    def path(self) -> Path:
+        return self.__path
+
+    def chunk_path(self, chunk_hash: str) -> Path:
+        return self.__path / chunk_hash[:2] / chunk_hash
+
+    def put(self, data: bytes) -> Tuple[str, bool]:
+        """
+        Stores the chunk if it was not stored yet.
+        :return: The hash of the chunk and if it has been written (``False`` if it was already stored).
+        """
+        chunk_hash = hashlib.blake2b(data, digest_size=32).hexdigest()
+        chunk_path = self.chunk_path(chunk_hash)
+        try:
+            # The modified time tells the garbage collection that the chunk is being used (see collect_garbage)
+            os.utime(chunk_path)
+            return chunk_hash, False
+        except FileNotFoundError:
+            pass
+
+        chunk_path.parent.mkdir(0o755, parents=True, exist_ok=True)
+        # Written in a temporary file and renamed, so a chunk is either complete or does not exist
+        fd, tmp_path = tempfile.mkstemp(dir=chunk_path.parent, prefix='.tmp-')
+        try:
+            with os.fdopen(fd, 'wb') as chunk_file:
+                chunk_file.write(data)
+            os.chmod(tmp_path, 0o644)
+            os.replace(tmp_path, chunk_path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+        return chunk_hash, True
+
+    def get(self, chunk_hash: str) -> bytes:
+        """
+        :return: The contents of the chunk, after checking that they match the hash
+        """
+        data = self.chunk_path(chunk_hash).read_bytes()
+        if hashlib.blake2b(data, digest_size=32).hexdigest() != chunk_hash:
+            raise ValueError(f'Chunk {chunk_hash} is corrupted')
+        return data
+
+    def write_stream(self, stream, average_size: int) -> Tuple[List[List[Any]], int]:
+        """
+        Splits the stream into chunks and stores them.
+        :return: The list of chunks (hash and size) and how many bytes were new
+        """
+        chunks = []
+        new_bytes = 0
+        for data in split_chunks(stream, average_size):
+            chunk_hash, written = self.put(data)
+            chunks.append([chunk_hash, len(data)])
+            new_bytes += len(data) if written else 0
+        return chunks, new_bytes
+
+    def read_stream(self, chunks: List[List[Any]]) -> ChunksReader:
+        return ChunksReader(self, (chunk_hash for chunk_hash, _ in chunks))
+
+    def collect_garbage(self, referenced: Set[str], grace_period: float = 0) -> int:
+        """
+        Removes the chunks that are not in ``referenced``. The recipe of a backup is written once all its chunks are
+        stored, so the chunks written (or reused) in the last ``grace_period`` seconds are kept, as they can belong to
+        a backup that is still running.
+        :return: The number of chunks removed
+        """
+        logger = logging.getLogger(__name__).getChild('ChunkStore').getChild('collect_garbage')
+        removed = 0
+        if not self.__path.exists():
+            return removed
+
+        min_mtime = time.time() - grace_period
+        for folder in self.__path.iterdir():
+            for chunk_path in folder.iterdir():
+                # Temporary files are chunks being written right now
+                if chunk_path.name in referenced or chunk_path.name.startswith('.tmp-'):
+                    continue
+                if chunk_path.stat().st_mtime > min_mtime:
+                    logger.debug(f'Keeping recent chunk {chunk_path.name}')
+                else:
+                    logger.debug(f'Removing unused chunk {chunk_path.name}')
+                    chunk_path.unlink()
+                    removed += 1
+        return removed
+
+
+def write_recipe(path: Path, entries: Iterable[Dict[str, Any]]):
+    """
+    Writes the recipe of a backup, one JSON object per line. The first line is a header with the version.
+    """
+    with open(path, 'w') as recipe:
+        recipe.write(json.dumps({'version': RECIPE_VERSION}) + '\n')
+        for entry in entries:
+            recipe.write(json.dumps(entry) + '\n')
+
+
+def read_recipe(path: Path) -> Generator[Dict[str, Any], None, None]:
+    with open(path, 'r') as recipe:
+        header = json.loads(recipe.readline())
+        if header.get('version') != RECIPE_VERSION:
+            raise ValueError(f'Recipe {path} has an unsupported version {header.get("version")}')
+        for line in recipe:
+            yield json.loads(line)
+
+
+def referenced_chunks(folders: Iterable[Path], referenced: Optional[Set[str]] = None) -> Set[str]:
+    """
+    :return: The hashes of all the chunks used by the recipes inside the folders (i.e. the backups).
+    """
+    referenced = referenced if referenced is not None else set()
+    for folder in folders:
+        for recipe_path in folder.rglob(f'*{RECIPE_SUFFIX}'):
+            for entry in read_recipe(recipe_path):
+                referenced.update(chunk_hash for chunk_hash, _ in entry.get('chunks', []))
+    return referenced
@@ -63,6 +63,11 @@ class Config(object):
         self.__actions_modules = conf.get('actionsModules', [])
         self.__log_level = logging.getLevelName(conf.get('logLevel', 'WARNING'))
         self.__max_backups_kept = conf.get('maxBackupsKept', 7)
+        self.__max_parallel_tasks = conf.get('maxParallelTasks', 1)
+        self.__max_parallel_tasks_definitions = conf.get('maxParallelTasksDefinitions', 1)
+        self.__pipe_size = conf.get('pipeSize')
+        self.__hash_algorithm = conf.get('hashAlgorithm')
+        self.__engine = conf.get('engine', 'threads')
         self.__env = conf.get('env', {})
         self.__secrets = [
             SecretConfig(key, secret_dict.get('envDefs'), secret_dict['config'], secret_dict.get('storageProviders'))
@@ -70,6 +75,7 @@ class Config(object):
         ]
         self.__hooks = conf.get('hooks', {})
         self.__cloud = CloudConfig(conf.get('cloud', {'providers': []}))
+        self.__watch_paths = [Path(path) for path in conf.get('watchPaths', [])]
 
         Config.__check_paths('backupsPath', self.__backups_path)
 
@@ -113,6 +119,41 @@ class Config(object):
         """
         return self.__max_backups_kept
 
+    @property
+    def max_parallel_tasks(self) -> int:
+        """
+        :return: The maximum number of tasks of a tasks definition file that can run at the same time
+        """
+        return self.__max_parallel_tasks
+
+    @property
+    def max_parallel_tasks_definitions(self) -> int:
+        """
+        :return: The maximum number of tasks definition files that can run at the same time
+        """
+        return self.__max_parallel_tasks_definitions
+
+    @property
+    def pipe_size(self) -> Optional[int]:
+        """
+        :return: If defined, the size in bytes of the pipes between the actions of a task
+        """
+        return self.__pipe_size
+
+    @property
+    def hash_algorithm(self) -> Optional[str]:
+        """
+        :return: If defined, the algorithm used to hash the files while they are written
+        """
+        return self.__hash_algorithm
+
+    @property
+    def engine(self) -> str:
+        """
+        :return: The engine used to run the actions of the tasks, ``threads`` or ``asyncio``
+        """
+        return self.__engine
+
     @property
     def env(self) -> Dict[str, str]:
         """
@@ -134,6 +175,13 @@ class Config(object):
         """
         return self.__cloud
 
+    @property
+    def watch_paths(self) -> List[Path]:
+        """
+        :return: The folders whose changes are recorded by the ``watch`` mode
+        """
+        return self.__watch_paths
+
     @property
     def hooks(self) -> Dict[str, str]:
         """
@@ -0,0 +1,54 @@
+import hashlib
+from pathlib import Path
+from typing import Optional
+
+from mdbackup.check_packages import check_xxhash
+
+
+HASH_ALGORITHMS = ('blake2b', 'sha256', 'xxh3')
+
+_READ_SIZE = 1024 * 1024
+
+
+def new_hasher(algorithm: str):
+    """
+    Creates a hash object (like the ones of ``hashlib``) for the algorithm. ``blake2b`` and ``sha256`` are
+    cryptographic hashes, ``xxh3`` is a lot faster but it only detects accidental changes (requires ``xxhash``).
+    """
+    if algorithm == 'blake2b':
+        return hashlib.blake2b(digest_size=32)
+    if algorithm == 'sha256':
+        return hashlib.sha256()
+    if algorithm == 'xxh3':
+        check_xxhash('xxh3 hash algorithm')
+        import xxhash
+        return xxhash.xxh3_128()
+    raise ValueError(f'Unknown hash algorithm {algorithm}, must be one of {", ".join(HASH_ALGORITHMS)}')
+
+
+def format_hash(algorithm: str, hasher) -> str:
+    """
+    :return: The digest of the hash object, prefixed with the algorithm (``algorithm:hex digest``)
+    """
+    return f'{algorithm}:{hasher.hexdigest()}'
+
+
+def hash_algorithm_of(file_hash: Optional[str]) -> Optional[str]:
+    """
+    :return: The algorithm used to compute the hash, or ``None`` if there is no hash
+    """
+    return file_hash.split(':', 1)[0] if file_hash is not None else None
+
+
+def hash_file(path: Path, algorithm: str) -> str:
+    """
+    Reads the file to compute its hash.
+    :return: The hash, in the same format as ``format_hash``
+    """
+    hasher = new_hasher(algorithm)
+    with open(path, 'rb', buffering=0) as file:
+        data = file.read(_READ_SIZE)
+        while len(data) > 0:
+            hasher.update(data)
+            data = file.read(_READ_SIZE)
+    return format_hash(algorithm, hasher)
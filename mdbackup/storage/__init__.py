@@ -11,6 +11,10 @@ from mdbackup.check_packages import (
 from mdbackup.storage.storage import AbstractStorage
 
 
+# Suffix of the receipt that ``to-cloud`` writes next to the path of the uploaded stream
+CLOUD_RECEIPT_SUFFIX = '.cloud.yaml'
+
+
 @check('BackBlaze cloud storage', check_b2sdk, check_magic)
 def load_backblaze_storage():
     from mdbackup.storage.backblaze import B2Storage
@@ -50,6 +54,16 @@ __impls = {
     'sftp': load_sftp_storage,
 }
 
+# Providers that implement ``AbstractStorage.upload_stream``, known without loading them (and their dependencies)
+__stream_impls = ('s3', 'b2', 'ftp', 'ftps', 'sftp')
+
+
+def supports_upload_stream(params) -> bool:
+    """
+    :return: If the storage provider can upload streams (see ``AbstractStorage.upload_stream``)
+    """
+    return params.type.lower() in __stream_impls
+
 
 def create_storage_instance(params) -> Optional[AbstractStorage]:
     try:
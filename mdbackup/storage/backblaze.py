@@ -1,9 +1,11 @@
 import logging
 from pathlib import Path
-from typing import List, Union
+from typing import BinaryIO, Iterator, List, Union
 
 from b2sdk.account_info.in_memory import InMemoryAccountInfo
 from b2sdk.api import B2Api, Bucket
+from b2sdk.transfer.emerge.write_intent import WriteIntent
+from b2sdk.transfer.outbound.upload_source import UploadSourceBytes
 import magic
 
 from mdbackup.storage.storage import AbstractStorage
@@ -20,6 +22,7 @@ class B2Storage(AbstractStorage):
                                              application_key=config['appKey'])
         self.__bucket: Bucket = self.__b2_api.get_bucket_by_name(config['bucket'])
         self.__password: str = config.get('password')
+        self.__multipart_chunk_size: int = config.get('multipartChunkSize', 1024 * 1024 * 16)
         self.__pre = config.backups_path if not config.backups_path.endswith('/') else config.backups_path[:-1]
         self.__pre = self.__pre.lstrip('/') if self.__pre is not None else ''
 
@@ -44,17 +47,20 @@ class B2Storage(AbstractStorage):
         key = self.__ok_key(f'{parent}/{name}') + '/'
         return key[len(self.__pre):].lstrip('/')
 
-    def upload(self, path: Path, parent: Union[Path, str] = None):
+    def __file_key(self, name: str, parent: Union[Path, str, None]) -> str:
         if isinstance(parent, Path):
-            key = '/'.join(parent.absolute().parts + (path.name,))
+            key = '/'.join(parent.absolute().parts + (name,))
         elif isinstance(parent, str):
             if parent.endswith('/'):
-                key = (parent + path.name)
+                key = (parent + name)
             else:
-                key = f'{parent}/{path.name}'
+                key = f'{parent}/{name}'
         else:
-            key = path.name
-        key = self.__ok_key(key)
+            key = name
+        return self.__ok_key(key)
+
+    def upload(self, path: Path, parent: Union[Path, str] = None):
+        key = self.__file_key(path.name, parent)
         self.__log.info(f'Uploading file {key} (from {path})')
         file_to_upload = str(path.absolute())
         ret = self.__bucket.upload_local_file(local_file=file_to_upload,
@@ -63,6 +69,24 @@ class B2Storage(AbstractStorage):
                                               )
         self.__log.debug(ret)
 
+    def __stream_write_intents(self, stream: BinaryIO) -> Iterator[WriteIntent]:
+        offset = 0
+        data = stream.read(self.__multipart_chunk_size)
+        while data is not None and len(data) > 0:
+            yield WriteIntent(UploadSourceBytes(data), destination_offset=offset)
+            offset += len(data)
+            data = stream.read(self.__multipart_chunk_size)
+
+    def upload_stream(self, stream: BinaryIO, name: str, parent: Union[Path, str] = None):
+        key = self.__file_key(name, parent)
+        self.__log.info(f'Uploading stream into {key}')
+        # Each chunk of the stream is uploaded as a part of a large file
+        ret = self.__bucket.create_file_stream(self.__stream_write_intents(stream),
+                                               file_name=key,
+                                               content_type='application/octet-stream',
+                                               recommended_upload_part_size=self.__multipart_chunk_size)
+        self.__log.debug(ret)
+
     def delete(self, path: Union[Path, str]):
         full_path = self.__ok_key(path)
         self.__log.info(f'Deleting {full_path}')
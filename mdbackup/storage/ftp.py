@@ -1,7 +1,7 @@
 from ftplib import FTP, FTP_TLS
 import logging
 from pathlib import Path
-from typing import List, Union
+from typing import BinaryIO, List, Union
 
 from mdbackup.config import StorageConfig
 from mdbackup.storage.storage import AbstractStorage
@@ -49,6 +49,12 @@ class FTPStorage(AbstractStorage):
             self.__log.info(f'Uploading file {path} to {parent}')
             self.__conn.storbinary(f'STOR {path.name}', file_to_upload)
 
+    def upload_stream(self, stream: BinaryIO, name: str, parent: Union[Path, str] = '.'):
+        dir_path = self.__dir / (parent if parent is not None else '.')
+        self.__conn.cwd(str(dir_path))
+        self.__log.info(f'Uploading stream into {name} in {parent}')
+        self.__conn.storbinary(f'STOR {name}', stream)
+
     def delete(self, path: Union[Path, str]):
         path = self.__dir / path
         is_dir = False
@@ -1,8 +1,9 @@
 import logging
 from pathlib import Path
-from typing import List, Union
+from typing import BinaryIO, List, Union
 
 import boto3
+from boto3.s3.transfer import TransferConfig
 import magic
 
 from mdbackup.storage.storage import AbstractStorage
@@ -22,6 +23,7 @@ class S3Storage(AbstractStorage):
 
         self.__bucket: str = config['bucket']
         self.__storageclass: str = config.get('storageClass', 'STANDARD')
+        self.__multipart_chunk_size: int = config.get('multipartChunkSize', 1024 * 1024 * 16)
         self.__pre = config.backups_path if not config.backups_path.endswith('/') else config.backups_path[:-1]
         self.__pre = self.__pre.lstrip('/') if self.__pre is not None else ''
 
@@ -59,17 +61,20 @@ class S3Storage(AbstractStorage):
         self.__log.debug(ret)
         return key[len(self.__pre):].lstrip('/')
 
-    def upload(self, path: Path, parent: Union[Path, str, str] = None):
+    def __file_key(self, name: str, parent: Union[Path, str, None]) -> str:
         if isinstance(parent, Path):
-            key = '/'.join(parent.absolute().parts + (path.name,))
+            key = '/'.join(parent.absolute().parts + (name,))
         elif isinstance(parent, str):
             if parent.endswith('/'):
-                key = (parent + path.name)
+                key = (parent + name)
             else:
-                key = f'{parent}/{path.name}'
+                key = f'{parent}/{name}'
         else:
-            key = path.name
-        key = self.__ok_key(key)
+            key = name
+        return self.__ok_key(key)
+
+    def upload(self, path: Path, parent: Union[Path, str, str] = None):
+        key = self.__file_key(path.name, parent)
         self.__log.info(f'Uploading file {key} (from {path})')
         self.__s3.upload_file(str(path.absolute()),
                               self.__bucket,
@@ -79,6 +84,19 @@ class S3Storage(AbstractStorage):
                                   'StorageClass': self.__storageclass,
                               })
 
+    def upload_stream(self, stream: BinaryIO, name: str, parent: Union[Path, str] = None):
+        key = self.__file_key(name, parent)
+        self.__log.info(f'Uploading stream into {key}')
+        # Uses multipart uploads, each part is read into memory before uploading it
+        self.__s3.upload_fileobj(stream,
+                                 self.__bucket,
+                                 key,
+                                 ExtraArgs={
+                                     'ContentType': 'application/octet-stream',
+                                     'StorageClass': self.__storageclass,
+                                 },
+                                 Config=TransferConfig(multipart_chunksize=self.__multipart_chunk_size))
+
     def delete(self, path: Union[Path, str]):
         full_path = self.__ok_key(path)
         self.__log.info(f'Deleting {full_path}')
@@ -1,7 +1,7 @@
 import logging
 from pathlib import Path
 import stat
-from typing import List, Union
+from typing import BinaryIO, List, Union
 
 from paramiko import (
     AutoAddPolicy,
@@ -85,6 +85,13 @@ class SFTPStorage(AbstractStorage):
         self.__log.info(f'Uploading file {path} to {parent}')
         self.__conn.put(str(path), path.name, confirm=True)
 
+    def upload_stream(self, stream: BinaryIO, name: str, parent: Union[Path, str] = '.'):
+        dir_path = self.__dir / (parent if parent is not None else '.')
+        self.__conn.chdir(str(dir_path))
+        self.__log.info(f'Uploading stream into {name} in {parent}')
+        # The size is not known beforehand, so it cannot be confirmed
+        self.__conn.putfo(stream, name, confirm=False)
+
     def delete(self, path: Union[Path, str]):
         path = self.__dir / path
         path_stats = self.__conn.stat(str(path))
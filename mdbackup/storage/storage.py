@@ -1,6 +1,6 @@
 from abc import ABC, abstractmethod
 from pathlib import Path
-from typing import List, Union
+from typing import BinaryIO, List, Union
 
 
 class AbstractStorage(ABC):
@@ -16,6 +16,13 @@ class AbstractStorage(ABC):
     def upload(self, path: Path, parent: Union[Path, str, Path] = None):
         pass
 
+    def upload_stream(self, stream: BinaryIO, name: str, parent: Union[Path, str] = None):
+        """
+        Uploads the contents of the stream, until it ends, into a file named ``name`` inside ``parent``. The stream
+        cannot be seeked nor its size known beforehand. Not all storage providers support this.
+        """
+        raise NotImplementedError(f'{type(self).__name__} does not support uploading streams')
+
     @abstractmethod
     def delete(self, path: Union[Path, str]):
         pass
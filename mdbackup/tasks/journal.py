@@ -0,0 +1,116 @@
+import json
+import logging
+import os
+from pathlib import Path
+from threading import Lock
+from typing import Any, Dict, List, Optional, Tuple
+
+
+class Journal:
+    """
+    Records the tasks that finished successfully while a backup is being done, so an interrupted backup can be
+    resumed later without running again the tasks that already finished. The journal is a file with one JSON object
+    per line: the first one identifies the backup, the rest are the finished tasks. Each line is written to disk as
+    soon as the task finishes.
+    """
+
+    def __init__(self, path: Path):
+        self.__path = path
+        self.__lock = Lock()
+        self.__backup_name: Optional[str] = None
+        self.__resumed = False
+        self.__finished: Dict[str, Dict[str, Tuple[Path, Optional[List[Dict[str, Any]]]]]] = {}
+
+    @property
+    def path(self) -> Path:
+        return self.__path
+
+    @property
+    def backup_name(self) -> Optional[str]:
+        """
+        :return: The name of the backup the journal belongs to
+        """
+        return self.__backup_name
+
+    @property
+    def resumed(self) -> bool:
+        """
+        :return: True if the journal was read from the disk, so it belongs to an interrupted backup
+        """
+        return self.__resumed
+
+    def exists(self) -> bool:
+        return self.__path.exists()
+
+    def load(self) -> bool:
+        """
+        Reads the journal from the disk. Lines that cannot be read (i.e. the last one if the process was killed while
+        writing it) are ignored.
+        :return: True if the journal could be read
+        """
+        logger = logging.getLogger(__name__).getChild('Journal').getChild('load')
+        self.__backup_name = None
+        self.__resumed = False
+        self.__finished = {}
+        try:
+            with open(self.__path, 'r') as journal_file:
+                lines = journal_file.readlines()
+        except FileNotFoundError:
+            return False
+
+        for line in lines:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                logger.warning(f'Ignoring malformed line in journal {self.__path}')
+                continue
+
+            if 'backup' in entry:
+                self.__backup_name = entry['backup']
+            elif 'tasksDefinition' in entry:
+                tasks_finished = self.__finished.setdefault(entry['tasksDefinition'], {})
+                tasks_finished[entry['task']] = (Path(entry['result']), entry.get('stats'))
+
+        self.__resumed = self.__backup_name is not None
+        return self.__resumed
+
+    def start(self, backup_name: str):
+        """
+        Creates a new journal for the backup, removing any previous contents.
+        """
+        self.__backup_name = backup_name
+        self.__resumed = False
+        self.__finished = {}
+        with self.__lock:
+            with open(self.__path, 'w') as journal_file:
+                self.__write(journal_file, {'backup': backup_name})
+
+    def task_finished(self, tasks_file_name: str, task_name: str, result: Path,
+                      stats: Optional[List[Dict[str, Any]]] = None):
+        """
+        Records that a task has finished successfully, with its result path (relative to the backup folder).
+        """
+        with self.__lock:
+            self.__finished.setdefault(tasks_file_name, {})[task_name] = (result, stats)
+            with open(self.__path, 'a') as journal_file:
+                self.__write(journal_file, {
+                    'tasksDefinition': tasks_file_name,
+                    'task': task_name,
+                    'result': str(result),
+                    'stats': stats,
+                })
+
+    def finished_tasks(self, tasks_file_name: str) -> Dict[str, Tuple[Path, Optional[List[Dict[str, Any]]]]]:
+        """
+        :return: The tasks of the tasks definition file that already finished, with their results and stats
+        """
+        return dict(self.__finished.get(tasks_file_name, {}))
+
+    def has_finished_tasks(self) -> bool:
+        return any(len(tasks) > 0 for tasks in self.__finished.values())
+
+    @staticmethod
+    def __write(journal_file, entry: dict):
+        journal_file.write(json.dumps(entry) + '\n')
+        journal_file.flush()
+        os.fsync(journal_file.fileno())
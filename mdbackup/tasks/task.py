@@ -1,4 +1,4 @@
-from typing import Any, Dict, List
+from typing import Any, Dict, List, Optional
 
 from mdbackup.tasks.task_cloud_options import TaskCloudOptions
 
@@ -9,6 +9,12 @@ class Task:
         self.__env = task.get('env', {})
         self.__actions = task['actions']
         self.__stop_on_fail = task.get('stopOnFail', True)
+        self.__depends_on = task.get('dependsOn', [])
+        if isinstance(self.__depends_on, str):
+            self.__depends_on = [self.__depends_on]
+        self.__pipe_size = task.get('pipeSize')
+        if self.__pipe_size is not None and (not isinstance(self.__pipe_size, int) or self.__pipe_size < 4096):
+            raise ValueError('pipeSize must be an integer of, at least, 4096')
         self.__cloud = TaskCloudOptions(task.get('cloud', {}))
 
     @property
@@ -27,6 +33,14 @@ class Task:
     def stop_on_fail(self) -> bool:
         return self.__stop_on_fail
 
+    @property
+    def depends_on(self) -> List[str]:
+        return self.__depends_on
+
+    @property
+    def pipe_size(self) -> Optional[int]:
+        return self.__pipe_size
+
     @property
     def cloud(self) -> TaskCloudOptions:
         return self.__cloud
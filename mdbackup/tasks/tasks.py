@@ -26,6 +26,8 @@ class Tasks:
         self.__name = tasks.get('name', '.'.join(path.name.split('.')[:-1]))
         self.__inside_folder = tasks.get('inside')
         self.__env = tasks.get('env', {})
+        self.__max_parallel_tasks = tasks.get('maxParallelTasks')
+        self.__engine = tasks.get('engine')
         self.__tasks = []
 
         for task, i in zip(tasks['tasks'], range(len(tasks['tasks']))):
@@ -40,6 +42,43 @@ class Tasks:
             if task_names.count(task_name) > 1:
                 raise ValueError(f'Task name "{task_name}" is repeated, tasks cannot have duplicated names')
 
+        if self.__max_parallel_tasks is not None:
+            if not isinstance(self.__max_parallel_tasks, int) or self.__max_parallel_tasks < 1:
+                raise ValueError('maxParallelTasks must be a positive integer')
+
+        if self.__engine is not None and self.__engine not in ('threads', 'asyncio'):
+            raise ValueError('engine must be threads or asyncio')
+
+        self.__check_dependencies()
+
+    def __check_dependencies(self):
+        tasks_by_name = {task.name: task for task in self.__tasks}
+        for task in self.__tasks:
+            for dependency in task.depends_on:
+                if dependency not in tasks_by_name:
+                    raise ValueError(f'Task "{task.name}" depends on "{dependency}", which does not exist')
+                if dependency == task.name:
+                    raise ValueError(f'Task "{task.name}" cannot depend on itself')
+
+        # Depth-first search looking for back-edges (cycles) in the dependency graph
+        visited = set()
+        visiting = []
+
+        def visit(task_name: str):
+            if task_name in visiting:
+                cycle = ' -> '.join(visiting[visiting.index(task_name):] + [task_name])
+                raise ValueError(f'Tasks have a circular dependency: {cycle}')
+            if task_name in visited:
+                return
+            visiting.append(task_name)
+            for dependency in tasks_by_name[task_name].depends_on:
+                visit(dependency)
+            visiting.pop()
+            visited.add(task_name)
+
+        for task in self.__tasks:
+            visit(task.name)
+
     @property
     def file_name(self) -> str:
         return self.__file_name
@@ -56,6 +95,14 @@ class Tasks:
     def env(self) -> Dict[str, Any]:
         return self.__env
 
+    @property
+    def max_parallel_tasks(self) -> Optional[int]:
+        return self.__max_parallel_tasks
+
+    @property
+    def engine(self) -> Optional[str]:
+        return self.__engine
+
     @property
     def tasks(self) -> List[Task]:
         return self.__tasks
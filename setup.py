@@ -75,5 +75,8 @@ setuptools.setup(
         'vault': [
             'requests ~= 2.31',
         ],
+        'xxhash': [
+            'xxhash ~= 3.4',
+        ],
     },
 )
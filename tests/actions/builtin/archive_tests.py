@@ -0,0 +1,40 @@
+import io
+import os
+from pathlib import Path
+import tarfile
+import tempfile
+
+from tests.classes import TestCaseWithoutLogs
+
+from mdbackup.actions.builtin._os_utils import _is_sparse
+from mdbackup.actions.builtin.archive import action_tar
+from mdbackup.actions.builtin.directory import action_read_dir
+
+
+class SparseTarTests(TestCaseWithoutLogs):
+    def setUp(self):
+        super().setUp()
+        self.tmp = tempfile.TemporaryDirectory()
+        self.root = Path(self.tmp.name)
+        self.source = self.root / 'disk.img'
+        with open(self.source, 'wb') as source:
+            source.seek(8 * 1024 * 1024)
+            source.write(os.urandom(1024 * 1024))
+            source.truncate(64 * 1024 * 1024)
+        if not _is_sparse(self.source.stat()):
+            self.skipTest('File system does not support sparse files')
+
+    def tearDown(self):
+        super().tearDown()
+        self.tmp.cleanup()
+
+    def test_tar_should_store_only_the_data_of_sparse_files(self):
+        with action_tar(action_read_dir(None, {'path': str(self.root)}), None) as stream:
+            data = stream.read()
+
+        self.assertLess(len(data), 2 * 1024 * 1024)
+        with tarfile.open(fileobj=io.BytesIO(data)) as tar:
+            member = tar.getmember('disk.img')
+            self.assertTrue(member.issparse())
+            self.assertEqual(64 * 1024 * 1024, member.size)
+            self.assertEqual(self.source.read_bytes(), tar.extractfile(member).read())
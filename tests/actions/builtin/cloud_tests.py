@@ -0,0 +1,118 @@
+import io
+import os
+from pathlib import Path
+import tempfile
+from unittest.mock import Mock, patch
+
+from tests.classes import TestCaseWithoutLogs
+
+from mdbackup.actions.builtin.cloud import _get_provider, action_write_cloud, check_cloud_provider
+from mdbackup.config import StorageConfig
+from mdbackup.utils import read_data_file
+
+
+class ActionWriteCloudTests(TestCaseWithoutLogs):
+    def setUp(self):
+        super().setUp()
+        self.tmp = tempfile.TemporaryDirectory()
+        self.root = Path(self.tmp.name)
+        (self.root / 'databases').mkdir()
+        self.data = os.urandom(1024 * 100 + 3)
+        self.providers = [
+            StorageConfig({'type': 's3', 'backupsPath': '/s3-backups'}),
+            StorageConfig({'type': 'sftp', 'backupsPath': '/sftp-backups'}),
+        ]
+        self.chunks = []
+        self.storage = Mock()
+        self.storage.create_folder.side_effect = lambda name, parent=None: f'{parent}/{name}' if parent else name
+        self.storage.upload_stream.side_effect = self._upload_stream
+
+    def tearDown(self):
+        super().tearDown()
+        self.tmp.cleanup()
+
+    def _upload_stream(self, stream, name, parent):
+        data = stream.read(1024 * 16)
+        while len(data) > 0:
+            self.chunks.append(data)
+            data = stream.read(1024 * 16)
+
+    def _write(self, **params):
+        with patch('mdbackup.actions.builtin.cloud.create_storage_instance', return_value=self.storage) as create:
+            receipt = action_write_cloud(io.BytesIO(self.data), {
+                '_backup_path': str(self.root),
+                '_cloud_providers': self.providers,
+                '_cloud_path': '2024-01-01T00:00/inside',
+                **params,
+            })
+        return receipt, create
+
+    def test_stream_should_be_uploaded_in_chunks(self):
+        self._write(path='databases/dump.sql', provider='sftp')
+
+        self.assertEqual(self.data, b''.join(self.chunks))
+        self.assertGreater(len(self.chunks), 1)
+        self.storage.upload_stream.assert_called_once()
+        self.assertEqual(('dump.sql', '2024-01-01T00:00/inside/databases'), self.storage.upload_stream.call_args[0][1:])
+
+    def test_receipt_should_be_written_next_to_the_path(self):
+        receipt, create = self._write(path='databases/dump.sql', provider=1)
+
+        create.assert_called_once_with(self.providers[1])
+        self.assertEqual(self.root / 'databases' / 'dump.sql.cloud.yaml', receipt)
+        self.assertEqual({
+            'type': 'sftp',
+            'backupsPath': '/sftp-backups',
+            'path': '2024-01-01T00:00/inside/databases/dump.sql',
+            'size': len(self.data),
+        }, read_data_file(receipt))
+        self.assertFalse((self.root / 'databases' / 'dump.sql').exists())
+
+    def test_unknown_provider_type_should_fail_before_uploading(self):
+        self.storage = None
+        with self.assertRaises(ValueError):
+            self._write(path='dump.sql', provider='s3')
+
+        self.assertFalse((self.root / 'dump.sql.cloud.yaml').exists())
+
+    def test_absolute_path_should_fail(self):
+        with self.assertRaises(ValueError):
+            self._write(path='/dump.sql', provider='s3')
+
+    def test_providers_that_cannot_upload_streams_should_fail_before_uploading(self):
+        self.providers.append(StorageConfig({'type': 'gdrive', 'backupsPath': '/gdrive-backups'}))
+
+        with self.assertRaises(NotImplementedError):
+            self._write(path='dump.sql', provider='gdrive')
+        self.storage.create_folder.assert_not_called()
+        self.assertIs(self.providers[1], check_cloud_provider({
+            'path': 'dump.sql',
+            'provider': 'sftp',
+            '_cloud_providers': self.providers,
+        }))
+
+
+class GetProviderTests(TestCaseWithoutLogs):
+    def setUp(self):
+        super().setUp()
+        self.providers = [
+            StorageConfig({'type': 's3', 'backupsPath': '/'}),
+            StorageConfig({'type': 'b2', 'backupsPath': '/'}),
+        ]
+
+    def test_provider_should_be_chosen_by_index_or_type(self):
+        self.assertIs(self.providers[1], _get_provider({'_cloud_providers': self.providers, 'provider': 1}))
+        self.assertIs(self.providers[1], _get_provider({'_cloud_providers': self.providers, 'provider': 'B2'}))
+
+    def test_provider_is_required_with_more_than_one(self):
+        with self.assertRaises(ValueError):
+            _get_provider({'_cloud_providers': self.providers})
+        self.assertIs(self.providers[0], _get_provider({'_cloud_providers': self.providers[:1]}))
+
+    def test_unknown_providers_should_fail(self):
+        with self.assertRaises(IndexError):
+            _get_provider({'_cloud_providers': self.providers, 'provider': 2})
+        with self.assertRaises(KeyError):
+            _get_provider({'_cloud_providers': self.providers, 'provider': 'ftp'})
+        with self.assertRaises(ValueError):
+            _get_provider({'_cloud_providers': []})
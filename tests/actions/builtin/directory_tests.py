@@ -0,0 +1,499 @@
+import io
+import os
+from pathlib import Path
+import stat
+import tarfile
+import tempfile
+import threading
+import time
+from unittest.mock import patch
+
+from tests.classes import TestCaseWithoutLogs
+
+from mdbackup.actions.builtin import directory
+from mdbackup.actions.builtin.archive import action_tar, action_untar
+from mdbackup.actions.builtin.directory import action_read_dir, action_reverse_read_dir, action_write_dir
+from mdbackup.catalog import Catalog
+from mdbackup.change_journal import ChangeJournal, CHANGES_FOLDER_NAME, journal_path
+
+
+class HardlinksTests(TestCaseWithoutLogs):
+    def setUp(self):
+        super().setUp()
+        self.tmp = tempfile.TemporaryDirectory()
+        self.root = Path(self.tmp.name)
+        self.source = self.root / 'source'
+        (self.source / 'a').mkdir(parents=True)
+        (self.source / 'b').mkdir()
+        (self.source / 'a' / 'file').write_bytes(b'contents')
+        os.link(self.source / 'a' / 'file', self.source / 'b' / 'link')
+        (self.source / 'b' / 'other').write_bytes(b'other')
+
+    def tearDown(self):
+        super().tearDown()
+        self.tmp.cleanup()
+
+    def _links(self):
+        paths = [entry.path.as_posix() for entry in action_read_dir(None, {'path': str(self.source)})]
+        # The order of the entries depends on the file system
+        return ('a/file', 'b/link') if paths.index('a/file') < paths.index('b/link') else ('b/link', 'a/file')
+
+    def test_read_dir_should_mark_the_later_links_of_a_file_as_hardlinks(self):
+        first, later = self._links()
+        entries = {entry.path.as_posix(): entry for entry in action_read_dir(None, {'path': str(self.source)})}
+
+        self.assertIsNone(entries[first].hardlink)
+        self.assertEqual(first, entries[later].hardlink)
+        self.assertIsNone(entries['b/other'].hardlink)
+
+    def test_read_dir_without_hardlinks_should_not_mark_them(self):
+        entries = action_read_dir(None, {'path': str(self.source), 'hardlinks': False})
+
+        self.assertTrue(all(entry.hardlink is None for entry in entries))
+
+    def test_write_dir_should_link_the_hardlinks(self):
+        for workers in (1, 4):
+            with self.subTest(workers=workers):
+                path = f'dest{workers}'
+                action_write_dir(action_read_dir(None, {'path': str(self.source)}), {
+                    '_backup_path': str(self.root),
+                    'path': path,
+                    'workers': workers,
+                })
+
+                file_stat = (self.root / path / 'a' / 'file').stat()
+                self.assertEqual(2, file_stat.st_nlink)
+                self.assertEqual(file_stat.st_ino, (self.root / path / 'b' / 'link').stat().st_ino)
+                self.assertEqual(b'contents', (self.root / path / 'b' / 'link').read_bytes())
+
+    def test_tar_should_store_the_hardlinks_as_links(self):
+        first, later = self._links()
+        with action_tar(action_read_dir(None, {'path': str(self.source)}), None) as stream:
+            data = stream.read()
+
+        with tarfile.open(fileobj=io.BytesIO(data)) as tar:
+            link = tar.getmember(later)
+            self.assertTrue(link.islnk())
+            self.assertEqual(first, link.linkname)
+
+        action_reverse_read_dir(action_untar(io.BytesIO(data), None), {
+            '_backup_path': str(self.root),
+            'path': str(self.root / 'restored'),
+        })
+        restored = self.root / 'restored'
+        self.assertEqual((restored / 'a' / 'file').stat().st_ino, (restored / 'b' / 'link').stat().st_ino)
+        self.assertEqual(b'contents', (restored / 'b' / 'link').read_bytes())
+
+
+class FileWriterTests(TestCaseWithoutLogs):
+    def setUp(self):
+        super().setUp()
+        self.tmp = tempfile.TemporaryDirectory()
+        self.root = Path(self.tmp.name)
+        self.source = self.root / 'source'
+        self.events = []
+        for name in ('a', 'b'):
+            (self.source / name).mkdir(parents=True)
+            for i in range(8):
+                (self.source / name / f'file-{i}').write_bytes(os.urandom(100 + i))
+        # In the same directory, so the copy of the file can still be running when the link is written
+        os.link(self.source / 'a' / 'file-3', self.source / 'a' / 'link')
+        for name, mode in (('a', 0o750), ('b', 0o700)):
+            os.chmod(self.source / name, mode)
+            os.utime(self.source / name, ns=(1_000_000_000, 1_000_000_000))
+
+    def tearDown(self):
+        super().tearDown()
+        self.tmp.cleanup()
+
+    def _write(self, workers: int, preserve_stats):
+        original_write = directory._write_file_entry
+        original_link = os.link
+        original_preserve_stats = directory._preserve_stats
+
+        def slow_write(entry, params, preserve):
+            # The copies finish out of order, and after the rest of the entries of their directory are read
+            time.sleep(0.05 if entry.path.name in ('file-3', 'link') else 0.01)
+            original_write(entry, params, preserve)
+            self.events.append(('write', entry.path.as_posix()))
+
+        def link(src, dst):
+            self.events.append(('link', Path(src).relative_to(self.root / 'dest').as_posix()))
+            original_link(src, dst)
+
+        def record_stats(entry_path, *args):
+            self.events.append(('stats', Path(entry_path).relative_to(self.root / 'dest').as_posix()))
+            original_preserve_stats(entry_path, *args)
+
+        with patch.object(directory, '_write_file_entry', side_effect=slow_write), \
+                patch.object(directory.os, 'link', side_effect=link), \
+                patch.object(directory, '_preserve_stats', side_effect=record_stats):
+            action_write_dir(action_read_dir(None, {'path': str(self.source)}), {
+                '_backup_path': str(self.root),
+                'path': 'dest',
+                'workers': workers,
+                'preserveStats': preserve_stats,
+            })
+
+    def test_hardlinks_should_wait_for_the_copy_of_their_file(self):
+        self._write(4, False)
+
+        link = next(event for event in self.events if event[0] == 'link')
+        self.assertIn(link[1], ('a/file-3', 'a/link'))
+        self.assertLess(self.events.index(('write', link[1])), self.events.index(link))
+        dest = self.root / 'dest'
+        self.assertEqual((dest / 'a' / 'file-3').stat().st_ino, (dest / 'a' / 'link').stat().st_ino)
+        self.assertEqual((self.source / 'a' / 'file-3').read_bytes(), (dest / 'a' / 'link').read_bytes())
+
+    def test_directory_stats_should_be_changed_after_its_files_are_written(self):
+        self._write(4, 'chmod,utime')
+
+        for name, mode in (('a', 0o750), ('b', 0o700)):
+            with self.subTest(directory=name):
+                stats_changed = self.events.index(('stats', name))
+                written = [
+                    i for i, (kind, path) in enumerate(self.events) if kind == 'write' and path.startswith(f'{name}/')
+                ]
+                self.assertEqual(8, len(written))
+                self.assertTrue(all(i < stats_changed for i in written))
+                dir_stat = (self.root / 'dest' / name).stat()
+                self.assertEqual(mode, stat.S_IMODE(dir_stat.st_mode))
+                self.assertEqual(1_000_000_000, dir_stat.st_mtime_ns)
+
+
+class ChangeJournalTests(TestCaseWithoutLogs):
+    def setUp(self):
+        super().setUp()
+        self.tmp = tempfile.TemporaryDirectory()
+        self.root = Path(self.tmp.name).resolve()
+        self.source = self.root / 'source'
+        self.backups = self.root / 'backups'
+        for name in ('a', 'b'):
+            (self.source / name).mkdir(parents=True)
+            (self.source / name / 'file').write_bytes(name.encode('utf-8'))
+        self.journal = ChangeJournal(journal_path(self.backups / CHANGES_FOLDER_NAME, self.source), self.source)
+        self.journal.lock()
+        self.journal.start(1)
+        self._backup('first')
+
+    def tearDown(self):
+        super().tearDown()
+        self.journal.close()
+        self.tmp.cleanup()
+
+    def _backup(self, name: str, prev_name: str = None):
+        backup_path = self.backups / name
+        backup_path.mkdir(parents=True)
+        catalog = Catalog(backup_path / '.catalog.sqlite', backup_path)
+        prev_catalog = Catalog.open_previous(self.backups / prev_name / '.catalog.sqlite', self.backups / prev_name) \
+            if prev_name is not None else None
+        params = {
+            '_backup_path': str(backup_path),
+            '_backups_path': str(self.backups),
+            '_prev_backup_path': str(self.backups / prev_name) if prev_name is not None else None,
+            '_catalog': catalog,
+            '_prev_catalog': prev_catalog,
+        }
+        entries = list(action_read_dir(None, {**params, 'path': str(self.source), 'changeJournal': True}))
+        action_write_dir(iter(entries), {**params, 'path': 'data'})
+        catalog.close()
+        prev_catalog.close() if prev_catalog is not None else None
+        return {entry.path.as_posix(): entry for entry in entries}
+
+    def test_read_dir_should_only_read_the_changed_dirs(self):
+        (self.source / 'b' / 'file').write_bytes(b'changed')
+        self.journal.record('b')
+
+        entries = self._backup('second', 'first')
+
+        self.assertIsNotNone(entries['a'].read_contents)
+        self.assertNotIn('a/file', entries)
+        self.assertIsNone(entries['b'].read_contents)
+        self.assertIn('b/file', entries)
+
+    def test_write_dir_should_clone_the_unchanged_dirs_from_the_previous_backup(self):
+        (self.source / 'b' / 'file').write_bytes(b'changed')
+        self.journal.record('b')
+
+        self._backup('second', 'first')
+
+        data = self.backups / 'second' / 'data'
+        self.assertEqual(b'a', (data / 'a' / 'file').read_bytes())
+        self.assertEqual(b'changed', (data / 'b' / 'file').read_bytes())
+        self.assertEqual((self.source / 'a').stat().st_mtime_ns, (data / 'a').stat().st_mtime_ns)
+        catalog = Catalog.open_previous(self.backups / 'second' / '.catalog.sqlite', self.backups / 'second')
+        self.assertIsNotNone(catalog.get(data / 'a' / 'file'))
+        catalog.close()
+
+    def test_write_dir_should_read_the_unchanged_dirs_with_changed_files(self):
+        # The journal missed the change, the directory has the same modified time
+        a_stat = (self.source / 'a').stat()
+        (self.source / 'a' / 'file').write_bytes(b'A')
+        os.utime(self.source / 'a' / 'file', ns=(1_000_000_000, 1_000_000_000))
+        os.utime(self.source / 'a', ns=(a_stat.st_atime_ns, a_stat.st_mtime_ns))
+
+        self._backup('second', 'first')
+
+        self.assertEqual(b'A', (self.backups / 'second' / 'data' / 'a' / 'file').read_bytes())
+
+    def test_read_dir_with_unknown_changes_should_read_everything(self):
+        self.journal.overflow()
+
+        entries = self._backup('second', 'first')
+
+        self.assertIn('a/file', entries)
+        self.assertTrue(all(entry.read_contents is None for entry in entries.values()))
+
+
+class UnchangedSubtreesTests(TestCaseWithoutLogs):
+    def setUp(self):
+        super().setUp()
+        self.tmp = tempfile.TemporaryDirectory()
+        self.root = Path(self.tmp.name)
+        self.source = self.root / 'source'
+        for name in ('a/x', 'a/y', 'b'):
+            (self.source / name).mkdir(parents=True)
+            (self.source / name / 'file').write_bytes(name.encode('utf-8'))
+        os.symlink('x/file', self.source / 'a' / 'link')
+        self._backup('first')
+
+    def tearDown(self):
+        super().tearDown()
+        self.tmp.cleanup()
+
+    def _backup(self, name: str, prev_name: str = None, **params):
+        backup_path = self.root / name
+        backup_path.mkdir()
+        catalog = Catalog(backup_path / '.catalog.sqlite', backup_path)
+        prev_path = self.root / prev_name if prev_name is not None else None
+        prev_catalog = Catalog.open_previous(prev_path / '.catalog.sqlite', prev_path) if prev_path else None
+        with patch.object(directory, 'action_copy_file', wraps=directory.action_copy_file) as copy_file:
+            action_write_dir(action_read_dir(None, {'path': str(self.source)}), {
+                '_backup_path': str(backup_path),
+                '_prev_backup_path': str(prev_path) if prev_path is not None else None,
+                '_catalog': catalog,
+                '_prev_catalog': prev_catalog,
+                'path': 'data',
+                **params,
+            })
+        catalog.close()
+        prev_catalog.close() if prev_catalog is not None else None
+        return sorted(Path(call.args[1]['to']).as_posix() for call in copy_file.call_args_list)
+
+    def test_write_dir_should_clone_the_unchanged_subtrees_at_once(self):
+        (self.source / 'a' / 'y' / 'file').write_bytes(b'changed')
+
+        copied = self._backup('second', 'first')
+
+        data = self.root / 'second' / 'data'
+        self.assertListEqual(['data/a/y/file'], copied)
+        self.assertEqual(b'a/x', (data / 'a' / 'x' / 'file').read_bytes())
+        self.assertEqual(b'b', (data / 'b' / 'file').read_bytes())
+        self.assertEqual(b'changed', (data / 'a' / 'y' / 'file').read_bytes())
+        self.assertEqual('x/file', os.readlink(data / 'a' / 'link'))
+        self.assertEqual((self.source / 'a' / 'x').stat().st_mtime_ns, (data / 'a' / 'x').stat().st_mtime_ns)
+        catalog = Catalog.open_previous(self.root / 'second' / '.catalog.sqlite', self.root / 'second')
+        self.assertEqual(5, len(list(catalog.entries(prefix='data/a'))))
+        catalog.close()
+
+    def test_write_dir_should_clone_the_subtrees_in_batches_with_workers(self):
+        for i in range(10):
+            (self.source / 'b' / f'file{i}').write_bytes(b'more')
+        self._backup('second', 'first')
+
+        with patch.object(directory, '_CLONE_BATCH_SIZE', 2):
+            copied = self._backup('third', 'second', workers=4)
+
+        self.assertListEqual([], copied)
+        self.assertEqual(b'more', (self.root / 'third' / 'data' / 'b' / 'file9').read_bytes())
+
+    def test_write_dir_should_not_clone_subtrees_with_too_many_entries(self):
+        with patch.object(directory, '_MAX_UNCHANGED_SUBTREE_ENTRIES', 2):
+            copied = self._backup('second', 'first')
+
+        # a has too many entries, but its subdirectories are cloned
+        self.assertListEqual([], copied)
+        self.assertEqual(b'a/y', (self.root / 'second' / 'data' / 'a' / 'y' / 'file').read_bytes())
+
+    def test_write_dir_should_look_up_each_entry_once(self):
+        (self.source / 'a' / 'y' / 'file').write_bytes(b'changed')
+
+        with patch.object(directory, '_unchanged_prev_entry', wraps=directory._unchanged_prev_entry) as look_up:
+            with patch.object(directory, '_MAX_UNCHANGED_SUBTREE_ENTRIES', 3):
+                self._backup('second', 'first')
+
+        paths = [call.args[0].path.as_posix() for call in look_up.call_args_list]
+        self.assertEqual(sorted(set(paths)), sorted(paths))
+        self.assertEqual(b'changed', (self.root / 'second' / 'data' / 'a' / 'y' / 'file').read_bytes())
+
+    def test_write_dir_with_force_copy_should_copy_everything(self):
+        copied = self._backup('second', 'first', forceCopy=True)
+
+        self.assertListEqual(['data/a/x/file', 'data/a/y/file', 'data/b/file'], copied)
+
+    def test_write_dir_should_not_clone_subtrees_without_the_hashes_at_once(self):
+        copied = self._backup('second', 'first', hashAlgorithm='sha256')
+        copied_again = self._backup('third', 'second', hashAlgorithm='sha256')
+
+        self.assertListEqual(['data/a/x/file', 'data/a/y/file', 'data/b/file'], copied)
+        self.assertListEqual([], copied_again)
+        catalog = Catalog.open_previous(self.root / 'third' / '.catalog.sqlite', self.root / 'third')
+        self.assertTrue(catalog.get(self.root / 'third' / 'data' / 'b' / 'file').hash.startswith('sha256:'))
+        catalog.close()
+
+
+class ParallelScanTests(TestCaseWithoutLogs):
+    def setUp(self):
+        super().setUp()
+        self.tmp = tempfile.TemporaryDirectory()
+        self.source = Path(self.tmp.name) / 'source'
+        # More entries than a batch of the scanner in some directories, and a few levels of nested directories
+        for i in range(3):
+            for j in range(3):
+                folder = self.source / f'dir-{i}' / f'sub-{j}' / 'deep'
+                folder.mkdir(parents=True)
+                (folder / 'file').write_bytes(b'deep')
+            for j in range(150 if i == 1 else 10):
+                (self.source / f'dir-{i}' / f'file-{j}').write_bytes(os.urandom(j))
+        (self.source / 'file').write_bytes(b'root')
+        (self.source / 'excluded').mkdir()
+        (self.source / 'excluded' / 'file').write_bytes(b'excluded')
+        (self.source / 'dir-0' / 'symlink').symlink_to('file-1')
+        (self.source / 'dir-2' / 'symlink-to-dir').symlink_to('../dir-0/sub-1')
+        os.link(self.source / 'dir-1' / 'file-100', self.source / 'dir-2' / 'sub-0' / 'hardlink')
+
+    def tearDown(self):
+        super().tearDown()
+        self.tmp.cleanup()
+
+    def _read(self, **params):
+        return [
+            (entry.path.as_posix(), entry.type, entry.link_content, entry.hardlink, str(entry.real_path),
+             entry.stats.st_mode, entry.stats.st_size, entry.stats.st_mtime_ns)
+            for entry in action_read_dir(None, {'path': str(self.source), 'exclude': 'excluded', **params})
+        ]
+
+    def test_parallel_scan_should_yield_the_same_entries_in_the_same_order(self):
+        for resolve_symlinks in (False, True):
+            expected = self._read(resolveSymlinks=resolve_symlinks)
+            self.assertGreater(len(expected), 200)
+            for workers in (2, 8):
+                with self.subTest(resolve_symlinks=resolve_symlinks, workers=workers):
+                    self.assertEqual(expected, self._read(resolveSymlinks=resolve_symlinks, parallelScan=workers))
+
+    def _xattrs_readers(self, read):
+        readers = []
+
+        def read_xattrs(path):
+            readers.append(threading.current_thread().name)
+            return {}
+
+        with patch('mdbackup.actions.ds._read_xattrs', side_effect=read_xattrs):
+            for entry in read():
+                self.assertEqual({}, entry.xattrs)
+        return readers
+
+    def test_parallel_scan_should_read_the_xattrs_ahead_only_when_prefetched(self):
+        readers = self._xattrs_readers(lambda: action_read_dir(None, {'path': str(self.source), 'parallelScan': 4}))
+        self.assertGreater(len(readers), 200)
+        self.assertTrue(all(name == threading.current_thread().name for name in readers))
+
+        readers = self._xattrs_readers(lambda: action_read_dir(None, {
+            'path': str(self.source),
+            'parallelScan': 4,
+            'prefetchXattrs': True,
+        }))
+        self.assertGreater(len(readers), 200)
+        self.assertTrue(all(name.startswith('mdbackup-scan') for name in readers))
+
+    def test_copy_directory_should_prefetch_the_xattrs_when_they_are_preserved(self):
+        with patch.object(directory, 'action_read_dir', return_value=iter([])) as read_dir, \
+                patch.object(directory, 'action_write_dir') as write_dir:
+            for preserve_stats, prefetch in ((True, True), ('chmod,xattrs', True), ('utime', False), (False, False)):
+                directory.action_copy_directory(None, {
+                    'from': str(self.source),
+                    'to': 'copy',
+                    'parallelScan': 4,
+                    'preserveStats': preserve_stats,
+                })
+                self.assertEqual(prefetch, read_dir.call_args[0][1]['prefetchXattrs'])
+            self.assertEqual(4, write_dir.call_count)
+
+
+class ScanFilterTests(TestCaseWithoutLogs):
+    def setUp(self):
+        super().setUp()
+        self.tmp = tempfile.TemporaryDirectory()
+        self.source = Path(self.tmp.name) / 'source'
+        (self.source / 'excluded' / 'inside').mkdir(parents=True)
+        (self.source / 'excluded' / 'inside' / 'file').write_bytes(b'excluded')
+        (self.source / 'mount' / 'inside').mkdir(parents=True)
+        (self.source / 'mount' / 'inside' / 'file').write_bytes(b'other file system')
+        (self.source / 'kept').mkdir()
+        for size in (10, 100, 1000):
+            (self.source / 'kept' / f'file-{size}').write_bytes(os.urandom(size))
+        (self.source / 'kept' / 'symlink-to-big').symlink_to('file-1000')
+        self.scanned = []
+        scandir = os.scandir
+
+        def recording_scandir(path):
+            self.scanned.append(Path(path).relative_to(self.source).as_posix())
+            return scandir(path)
+
+        self.scandir_patch = patch.object(directory.os, 'scandir', side_effect=recording_scandir)
+        self.scandir_patch.start()
+
+    def tearDown(self):
+        super().tearDown()
+        self.scandir_patch.stop()
+        self.tmp.cleanup()
+
+    def _read(self, **params):
+        return sorted(entry.path.as_posix() for entry in action_read_dir(None, {'path': str(self.source), **params}))
+
+    def test_excluded_directories_should_not_be_read(self):
+        for workers in (1, 4):
+            with self.subTest(workers=workers):
+                self.scanned.clear()
+
+                paths = self._read(exclude='excluded', parallelScan=workers)
+
+                self.assertNotIn('excluded', paths)
+                self.assertNotIn('excluded/inside', self.scanned)
+                self.assertNotIn('excluded', self.scanned)
+                self.assertIn('mount/inside', self.scanned)
+
+    def test_files_bigger_than_max_file_size_should_be_skipped(self):
+        for resolve_symlinks in (False, True):
+            with self.subTest(resolve_symlinks=resolve_symlinks):
+                paths = self._read(maxFileSize=100, resolveSymlinks=resolve_symlinks)
+
+                self.assertIn('kept/file-10', paths)
+                self.assertIn('kept/file-100', paths)
+                self.assertNotIn('kept/file-1000', paths)
+                # Only the symlinks that are resolved have the size of the file
+                self.assertEqual(not resolve_symlinks, 'kept/symlink-to-big' in paths)
+                self.assertIn('kept', paths)
+
+    def test_one_file_system_should_not_cross_mount_points(self):
+        to_dir_entry = directory._to_dir_entry
+        mount_dev = self.source.stat().st_dev + 1
+
+        def in_another_file_system(entry, rel_path, scan_filter):
+            dir_entry = to_dir_entry(entry, rel_path, scan_filter)
+            dir_entry.stats.st_dev = mount_dev if rel_path.startswith('mount') else dir_entry.stats.st_dev
+            return dir_entry
+
+        for workers in (1, 4):
+            with self.subTest(workers=workers), \
+                    patch.object(directory, '_to_dir_entry', side_effect=in_another_file_system):
+                self.scanned.clear()
+
+                paths = self._read(oneFileSystem=True, parallelScan=workers)
+                all_paths = self._read(parallelScan=workers)
+
+                # The mount point is kept, but not what is inside
+                self.assertIn('mount', paths)
+                self.assertNotIn('mount/inside', paths)
+                self.assertIn('mount/inside/file', all_paths)
+                self.assertEqual(1, self.scanned.count('mount'))
@@ -0,0 +1,211 @@
+import errno
+import hashlib
+import os
+from pathlib import Path
+import tempfile
+from threading import Thread
+from unittest.mock import patch
+
+from tests.classes import TestCaseWithoutLogs
+
+from mdbackup.actions.builtin import file
+from mdbackup.actions.builtin._os_utils import _is_sparse
+from mdbackup.actions.builtin.file import _copy_range, _kernel_copy, _write_file, action_copy_file, \
+    action_write_file
+from mdbackup.catalog import Catalog
+
+
+class SparseCopyTests(TestCaseWithoutLogs):
+    def setUp(self):
+        super().setUp()
+        self.tmp = tempfile.TemporaryDirectory()
+        self.root = Path(self.tmp.name)
+        self.source = self.root / 'disk.img'
+        with open(self.source, 'wb') as source:
+            source.truncate(64 * 1024 * 1024)
+            source.seek(8 * 1024 * 1024)
+            source.write(os.urandom(1024 * 1024))
+        if not _is_sparse(self.source.stat()):
+            self.skipTest('File system does not support sparse files')
+
+    def tearDown(self):
+        super().tearDown()
+        self.tmp.cleanup()
+
+    def test_copy_file_should_keep_the_holes_of_a_sparse_file(self):
+        dest_path = action_copy_file(None, {'from': self.source, 'to': 'copy.img', '_backup_path': self.root})
+
+        self.assertEqual(self.source.read_bytes(), dest_path.read_bytes())
+        self.assertLess(dest_path.stat().st_blocks * 512, 4 * 1024 * 1024)
+
+    def test_copy_file_from_a_stream_should_leave_the_zeros_as_holes(self):
+        with open(self.source, 'rb') as source:
+            dest_path = action_copy_file(None, {
+                '_stream': source,
+                '_stat': self.source.stat(),
+                'to': 'copy.img',
+                '_backup_path': self.root,
+            })
+
+        self.assertEqual(self.source.read_bytes(), dest_path.read_bytes())
+        self.assertLess(dest_path.stat().st_blocks * 512, 4 * 1024 * 1024)
+
+
+class HashTests(TestCaseWithoutLogs):
+    def setUp(self):
+        super().setUp()
+        self.tmp = tempfile.TemporaryDirectory()
+        self.root = Path(self.tmp.name)
+        self.source = self.root / 'source'
+        self.source.write_bytes(b'contents' * 10000)
+        self.hash = f'sha256:{hashlib.sha256(self.source.read_bytes()).hexdigest()}'
+        self.catalogs = []
+
+    def tearDown(self):
+        super().tearDown()
+        for catalog in self.catalogs:
+            catalog.close()
+        self.tmp.cleanup()
+
+    def _backup(self, name: str, prev_name: str = None, **params):
+        backup_path = self.root / name
+        backup_path.mkdir()
+        catalog = Catalog(backup_path / '.catalog.sqlite', backup_path)
+        prev_path = self.root / prev_name if prev_name is not None else None
+        self.catalogs.append(catalog)
+        action_copy_file(None, {
+            'from': self.source,
+            'to': 'file',
+            '_backup_path': backup_path,
+            '_prev_backup_path': prev_path,
+            '_catalog': catalog,
+            '_prev_catalog': self.catalogs[-2] if prev_name is not None else None,
+            **params,
+        })
+        return catalog.get(backup_path / 'file')
+
+    def test_copy_file_should_store_the_hash_in_the_catalog(self):
+        entry = self._backup('first', hashAlgorithm='sha256')
+
+        self.assertEqual(self.hash, entry.hash)
+
+    def test_copy_file_should_reuse_the_hash_of_the_previous_backup(self):
+        self._backup('first', hashAlgorithm='sha256')
+        # If the file were read again, the hash would be different
+        (self.root / 'first' / 'file').unlink()
+        (self.root / 'first' / 'file').write_bytes(b'broken')
+        os.utime(self.root / 'first' / 'file', ns=(self.source.stat().st_atime_ns, self.source.stat().st_mtime_ns))
+
+        entry = self._backup('second', 'first', hashAlgorithm='sha256')
+
+        self.assertEqual(self.hash, entry.hash)
+
+    def test_copy_file_should_hash_the_clone_if_the_previous_backup_has_no_hash(self):
+        self._backup('first')
+
+        entry = self._backup('second', 'first', _hash_algorithm='sha256')
+
+        self.assertEqual(self.hash, entry.hash)
+        self.assertEqual((self.root / 'first' / 'file').stat().st_ino, (self.root / 'second' / 'file').stat().st_ino)
+
+    def test_write_file_should_store_the_hash_of_the_result_in_the_catalog(self):
+        catalog = Catalog(self.root / '.catalog.sqlite', self.root)
+        self.catalogs.append(catalog)
+
+        with open(self.source, 'rb') as stream:
+            path = action_write_file(stream, {'_backup_path': self.root, 'to': 'result', '_catalog': catalog,
+                                              'hashAlgorithm': 'sha256'})
+
+        self.assertEqual(self.hash, catalog.get(path).hash)
+        self.assertEqual(self.source.read_bytes(), path.read_bytes())
+
+
+def _failing(error: int):
+    def copy(*_):
+        raise OSError(error, os.strerror(error))
+    return copy
+
+
+class KernelCopyTests(TestCaseWithoutLogs):
+    def setUp(self):
+        super().setUp()
+        self.tmp = tempfile.TemporaryDirectory()
+        self.root = Path(self.tmp.name)
+        self.data = os.urandom(1024 * 1024 * 3 + 123)
+        self.source = self.root / 'source'
+        self.source.write_bytes(self.data)
+        self.dest = self.root / 'dest'
+
+    def tearDown(self):
+        super().tearDown()
+        self.tmp.cleanup()
+
+    def _copy(self) -> bool:
+        with open(self.source, 'rb', buffering=0) as inp, open(self.dest, 'wb', buffering=0) as out:
+            return _kernel_copy(inp, out, 8192)
+
+    def _spy(self, name: str):
+        original = getattr(file, name)
+        if original is None:
+            self.skipTest(f'{name} is not available')
+        return patch.object(file, name, side_effect=original)
+
+    def test_regular_files_should_be_copied_with_copy_file_range(self):
+        with self._spy('_copy_file_range') as copy_file_range, self._spy('_sendfile') as sendfile:
+            self.assertTrue(self._copy())
+
+        self.assertGreater(copy_file_range.call_count, 0)
+        self.assertEqual(0, sendfile.call_count)
+        self.assertEqual(self.data, self.dest.read_bytes())
+
+    def test_unsupported_copy_file_range_should_fall_back_to_sendfile(self):
+        for error in (errno.EXDEV, errno.EINVAL, errno.ENOSYS):
+            with self.subTest(error=errno.errorcode[error]):
+                with patch.object(file, '_copy_file_range', _failing(error)), self._spy('_sendfile') as sendfile:
+                    self.assertTrue(self._copy())
+
+                self.assertGreater(sendfile.call_count, 0)
+                self.assertEqual(self.data, self.dest.read_bytes())
+
+    def test_unsupported_kernel_copies_should_fall_back_to_the_loop(self):
+        with patch.object(file, '_copy_file_range', _failing(errno.ENOSYS)), \
+                patch.object(file, '_sendfile', _failing(errno.EINVAL)):
+            self.assertFalse(self._copy())
+            with open(self.source, 'rb', buffering=0) as inp, open(self.dest, 'wb', buffering=0) as out:
+                _write_file(inp, out, 8192)
+
+        self.assertEqual(self.data, self.dest.read_bytes())
+
+    def test_other_errors_should_be_raised(self):
+        with patch.object(file, '_copy_file_range', _failing(errno.EIO)):
+            with self.assertRaises(OSError):
+                self._copy()
+
+    def test_pipes_should_be_copied_with_splice(self):
+        read_fd, write_fd = os.pipe()
+
+        def write():
+            with open(write_fd, 'wb', buffering=0) as pipe:
+                pipe.write(self.data)
+
+        writer = Thread(target=write)
+        writer.start()
+        with self._spy('_splice') as splice, open(read_fd, 'rb', buffering=0) as inp, \
+                open(self.dest, 'wb', buffering=0) as out:
+            _write_file(inp, out, 8192)
+        writer.join()
+
+        self.assertGreater(splice.call_count, 0)
+        self.assertEqual(self.data, self.dest.read_bytes())
+
+    def test_copy_range_should_fall_back_to_pread_and_pwrite(self):
+        for copy_file_range in (file._copy_file_range, _failing(errno.EXDEV), None):
+            with self.subTest(copy_file_range=copy_file_range):
+                with patch.object(file, '_copy_file_range', copy_file_range), \
+                        open(self.source, 'rb', buffering=0) as inp, open(self.dest, 'wb', buffering=0) as out:
+                    out.truncate(len(self.data))
+                    _copy_range(inp.fileno(), out.fileno(), 1000, 2000, 1024 * 1024, 8192)
+
+                copied = self.dest.read_bytes()
+                self.assertEqual(self.data[1000:1000 + 1024 * 1024], copied[2000:2000 + 1024 * 1024])
+                self.assertEqual(bytes(2000), copied[:2000])
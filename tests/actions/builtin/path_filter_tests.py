@@ -0,0 +1,58 @@
+from tests.classes import TestCaseWithoutLogs
+
+from mdbackup.actions.builtin._path_filter import PathFilter
+
+
+class PathFilterTests(TestCaseWithoutLogs):
+    def test_pattern_without_slash_should_match_at_any_depth(self):
+        path_filter = PathFilter('*.tmp')
+
+        self.assertTrue(path_filter.matches('file.tmp', False))
+        self.assertTrue(path_filter.matches('a/b/file.tmp', False))
+        self.assertFalse(path_filter.matches('a/b/file.tmp.py', False))
+
+    def test_pattern_with_slash_should_be_anchored_to_the_root(self):
+        path_filter = PathFilter(['/cache', 'a/*.log'])
+
+        self.assertTrue(path_filter.matches('cache', True))
+        self.assertFalse(path_filter.matches('a/cache', True))
+        self.assertTrue(path_filter.matches('a/x.log', False))
+        self.assertFalse(path_filter.matches('a/b/x.log', False))
+
+    def test_pattern_ending_with_slash_should_only_match_directories(self):
+        path_filter = PathFilter('node_modules/')
+
+        self.assertTrue(path_filter.matches('app/node_modules', True))
+        self.assertFalse(path_filter.matches('app/node_modules', False))
+
+    def test_double_star_should_match_any_number_of_directories(self):
+        path_filter = PathFilter(['a/**/z', 'logs/**'])
+
+        self.assertTrue(path_filter.matches('a/z', False))
+        self.assertTrue(path_filter.matches('a/b/c/z', False))
+        self.assertFalse(path_filter.matches('b/z', False))
+        self.assertTrue(path_filter.matches('logs/x/y.log', False))
+
+    def test_question_mark_and_classes_should_match_one_character(self):
+        path_filter = PathFilter(['file?.txt', 'data[0-9].bin', 'other[!0-9].bin'])
+
+        self.assertTrue(path_filter.matches('file1.txt', False))
+        self.assertFalse(path_filter.matches('file10.txt', False))
+        self.assertTrue(path_filter.matches('data5.bin', False))
+        self.assertFalse(path_filter.matches('dataX.bin', False))
+        self.assertTrue(path_filter.matches('otherX.bin', False))
+        self.assertFalse(path_filter.matches('other5.bin', False))
+
+    def test_last_matching_pattern_should_decide(self):
+        path_filter = PathFilter(['*.log', '!important.log', 'logs/important.log'])
+
+        self.assertTrue(path_filter.matches('a.log', False))
+        self.assertFalse(path_filter.matches('important.log', False))
+        self.assertFalse(path_filter.matches('a/important.log', False))
+        self.assertTrue(path_filter.matches('logs/important.log', False))
+
+    def test_empty_patterns_should_match_nothing(self):
+        path_filter = PathFilter(['', '  '])
+
+        self.assertFalse(path_filter.matches('a', False))
+        self.assertFalse(path_filter.matches('a', True))
@@ -0,0 +1,102 @@
+import io
+import os
+from pathlib import Path
+import tempfile
+from threading import Thread
+
+from tests.classes import TestCaseWithoutLogs
+
+from mdbackup.actions.builtin.tee import action_tee
+from mdbackup.actions.container import _clean_actions, register_action
+
+
+def _collect(inp, params):
+    path = Path(params['_backup_path']) / params['path']
+    path.write_bytes(inp.read())
+    return path
+
+
+def _fail_early(_1, _2):
+    raise KeyError('early')
+
+
+def _fail_late(inp, _):
+    inp.read(1024)
+    raise KeyError('late')
+
+
+class TeeTests(TestCaseWithoutLogs):
+    def setUp(self):
+        super().setUp()
+        register_action('collect', _collect, expected_input='stream')
+        register_action('fail-early', _fail_early, expected_input='stream')
+        register_action('fail-late', _fail_late, expected_input='stream')
+        self.tmp = tempfile.TemporaryDirectory()
+        self.root = Path(self.tmp.name)
+        # Bigger than the pipes, so the tee blocks if a branch does not read
+        self.data = os.urandom(1024 * 1024 * 4 + 7)
+
+    def tearDown(self):
+        super().tearDown()
+        _clean_actions()
+        self.tmp.cleanup()
+
+    def _tee(self, *branches):
+        result = {}
+
+        def run():
+            try:
+                result['path'] = action_tee(io.BytesIO(self.data), {
+                    '_backup_path': str(self.root),
+                    'branches': list(branches),
+                })
+            except Exception as e:
+                result['error'] = e
+
+        thread = Thread(target=run, daemon=True)
+        thread.start()
+        thread.join(30)
+        self.assertFalse(thread.is_alive(), 'tee did not finish')
+        if 'error' in result:
+            raise result['error']
+        return result['path']
+
+    def test_tee_should_write_the_stream_to_all_branches(self):
+        self._tee(
+            [{'collect': {'path': 'a'}}],
+            [{'collect': {'path': 'b'}}],
+            [{'collect': {'path': 'c'}}],
+        )
+
+        for name in ('a', 'b', 'c'):
+            self.assertEqual(self.data, (self.root / name).read_bytes())
+
+    def test_tee_should_return_the_result_of_the_first_branch(self):
+        path = self._tee(
+            [{'collect': {'path': 'b'}}],
+            [{'collect': {'path': 'a'}}],
+        )
+
+        self.assertEqual(self.root / 'b', path)
+
+    def test_failing_branch_should_raise_without_stopping_the_rest(self):
+        for failure in ('fail-early', 'fail-late'):
+            with self.subTest(failure=failure):
+                with self.assertRaises(RuntimeError) as context:
+                    self._tee(
+                        [{'collect': {'path': failure}}],
+                        [{failure: {}}],
+                    )
+
+                self.assertIn('tee#1', str(context.exception))
+                self.assertEqual(self.data, (self.root / failure).read_bytes())
+
+    def test_failing_first_branch_should_raise(self):
+        with self.assertRaises(RuntimeError) as context:
+            self._tee(
+                [{'fail-early': {}}],
+                [{'collect': {'path': 'a'}}],
+            )
+
+        self.assertIn('tee#0', str(context.exception))
+        self.assertNotIn('tee#1', str(context.exception))
@@ -0,0 +1,26 @@
+from tests.classes import TestCaseWithoutLogs
+
+from mdbackup.actions.container import _clean_actions, get_expected_input, register_action
+
+
+class TestGetExpectedInput(TestCaseWithoutLogs):
+    def setUp(self):
+        register_action('initial', lambda _1, _2: True, output='stream')
+        register_action('stream-action', lambda _1, _2: True, expected_input='stream')
+        register_action('directory-action', lambda _1, _2: True, expected_input='directory')
+        return super().setUp()
+
+    def tearDown(self):
+        _clean_actions()
+        return super().tearDown()
+
+    def test_action_without_input_should_return_none(self):
+        self.assertIsNone(get_expected_input('initial'))
+
+    def test_action_with_input_should_return_its_type(self):
+        self.assertEqual('stream', get_expected_input('stream-action'))
+        self.assertEqual('directory', get_expected_input('directory-action'))
+
+    def test_get_non_existing_action_should_raise_keyerror(self):
+        with self.assertRaises(KeyError):
+            get_expected_input('almost-an-action')
@@ -1,7 +1,10 @@
 from pathlib import Path
+import stat
+import tarfile
 from unittest import TestCase
+from unittest.mock import patch
 
-from mdbackup.actions.ds import DirEntry
+from mdbackup.actions.ds import DirEntry, EMPTY_XATTRS, StatResult
 
 
 class DirEntryTests(TestCase):
@@ -58,3 +61,99 @@ class DirEntryTests(TestCase):
 
         with self.assertRaises(TypeError):
             DirEntry.from_real_path(path)
+
+    def test_from_stat_of_a_file_uses_the_given_stats(self):
+        path = Path('./tests/__init__.py')
+        stats = path.lstat()
+
+        entry = DirEntry.from_stat(str(path), Path('__init__.py'), stats)
+
+        self.assertEqual('file', entry.type)
+        self.assertEqual(Path('__init__.py'), entry.path)
+        self.assertEqual(path, entry.real_path)
+        self.assertEqual(stats.st_mode, entry.stats.st_mode)
+        self.assertEqual(stats.st_size, entry.stats.st_size)
+        self.assertEqual(stats.st_mtime_ns, entry.stats.st_mtime_ns)
+
+        entry.stream.close()
+
+    def test_from_stat_of_a_symlink_is_filled_correctly(self):
+        path = Path('./docs/README.md')
+
+        entry = DirEntry.from_stat(path, path, path.lstat())
+
+        self.assertEqual('symlink', entry.type)
+        self.assertEqual('../README.md', entry.link_content)
+        self.assertIsNone(entry.stream)
+
+    def test_from_real_path_of_a_file_should_not_open_it_until_the_stream_is_requested(self):
+        path = Path('./tests/__init__.py')
+
+        entry = DirEntry.from_real_path(path)
+
+        self.assertIsNone(entry._DirEntry__stream)
+        stream = entry.stream
+        self.assertIs(stream, entry.stream)
+        entry.close()
+        self.assertTrue(stream.closed)
+
+    def test_from_real_path_should_not_read_the_xattrs_until_they_are_requested(self):
+        entry = DirEntry.from_real_path(Path('./tests/__init__.py'))
+
+        with patch('mdbackup.actions.ds._read_xattrs', return_value={'user.key': b'value'}) as read_xattrs:
+            read_xattrs.assert_not_called()
+            self.assertEqual({'user.key': b'value'}, entry.xattrs)
+            self.assertEqual({'user.key': b'value'}, entry.xattrs)
+            read_xattrs.assert_called_once_with('tests/__init__.py')
+
+    def test_xattrs_that_cannot_be_read_should_be_none(self):
+        entry = DirEntry.from_real_path(Path('./tests/__init__.py'))
+
+        with patch('mdbackup.actions.ds._read_xattrs', side_effect=PermissionError()):
+            self.assertIsNone(entry.xattrs)
+
+    def test_entries_should_not_have_a_dict(self):
+        entry = DirEntry.from_real_path(Path('./tests/__init__.py'))
+
+        self.assertFalse(hasattr(entry, '__dict__'))
+        self.assertFalse(hasattr(entry.stats, '__dict__'))
+
+    def test_entries_without_xattrs_should_share_the_empty_xattrs(self):
+        entry = DirEntry('dir', 'a', StatResult(), xattrs={})
+
+        self.assertIs(EMPTY_XATTRS, entry.xattrs)
+        with self.assertRaises(TypeError):
+            entry.xattrs['user.key'] = b'value'
+
+
+class StatResultTests(TestCase):
+    def test_from_stat_result_should_keep_the_used_fields(self):
+        stats = Path('./tests/__init__.py').lstat()
+
+        result = StatResult.from_stat_result(stats)
+
+        self.assertEqual(stats.st_mode, result.st_mode)
+        self.assertEqual(stats.st_ino, result.st_ino)
+        self.assertEqual(stats.st_dev, result.st_dev)
+        self.assertEqual(stats.st_uid, result.st_uid)
+        self.assertEqual(stats.st_gid, result.st_gid)
+        self.assertEqual(stats.st_size, result.st_size)
+        self.assertEqual(stats.st_mtime_ns, result.st_mtime_ns)
+        self.assertAlmostEqual(stats.st_mtime, result.st_mtime, places=5)
+
+    def test_from_stat_result_of_a_stat_result_should_return_it(self):
+        stats = StatResult(st_size=10)
+
+        self.assertIs(stats, StatResult.from_stat_result(stats))
+
+    def test_from_tar_info_of_a_hardlink_should_be_a_file_linked_to_the_previous_entry(self):
+        tar_info = tarfile.TarInfo('folder/link')
+        tar_info.type = tarfile.LNKTYPE
+        tar_info.linkname = 'folder/file'
+        tar_info.mode = 0o644
+
+        entry = DirEntry.from_tar_info(tar_info)
+
+        self.assertEqual('file', entry.type)
+        self.assertEqual('folder/file', entry.hardlink)
+        self.assertTrue(stat.S_ISREG(entry.stats.st_mode))
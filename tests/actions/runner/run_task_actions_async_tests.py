@@ -0,0 +1,132 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from subprocess import PIPE, Popen
+import sys
+import threading
+import time
+
+from tests.classes import TestCaseWithoutLogs
+
+from mdbackup.actions.container import _clean_actions, register_action
+from mdbackup.actions.runner_async import run_task_actions_async, run_task_actions_in_event_loop
+
+
+async def _async_final(inp, _):
+    reader = asyncio.StreamReader()
+    await asyncio.get_running_loop().connect_read_pipe(lambda: asyncio.StreamReaderProtocol(reader), inp)
+    return Path((await reader.read()).decode('utf-8'))
+
+
+async def _slow_final(inp, params):
+    result = await _async_final(inp, params)
+    await asyncio.sleep(0.5)
+    return result
+
+
+class RunTaskActionsAsyncTests(TestCaseWithoutLogs):
+    def setUp(self):
+        super().setUp()
+        noisy = 'import sys; sys.stderr.write("noise\\n" * 200000); sys.stderr.flush(); sys.stdout.write("out")'
+        register_action('echo', lambda _, params: Popen(['echo', '-n', params], stdout=PIPE, stderr=PIPE),
+                        output='stream')
+        register_action('cat', lambda inp, _: Popen(['cat'], stdin=inp, stdout=PIPE, stderr=PIPE),
+                        expected_input='stream', output='stream')
+        register_action('sleep', lambda inp, _: Popen(['sh', '-c', 'sleep 0.5; cat'], stdin=inp, stdout=PIPE,
+                                                      stderr=PIPE),
+                        expected_input='stream', output='stream')
+        register_action('noisy', lambda _1, _2: Popen([sys.executable, '-c', noisy], stdout=PIPE, stderr=PIPE),
+                        output='stream')
+        register_action('fail', lambda inp, _: Popen(['sh', '-c', 'cat; echo broken >&2; exit 1'], stdin=inp,
+                                                     stdout=PIPE, stderr=PIPE),
+                        expected_input='stream', output='stream')
+        register_action('read', lambda inp, _: Path(inp.read().decode('utf-8')), expected_input='stream')
+        register_action('async-read', _async_final, expected_input='stream')
+        register_action('slow-read', _slow_final, expected_input='stream')
+        register_action('slow-echo', self._slow_echo, output='stream')
+        self.threads = []
+
+    def _slow_echo(self, _, params):
+        # Blocks like an action that opens a file or reads a folder before returning
+        self.threads.append(threading.current_thread().name)
+        time.sleep(0.5)
+        return Popen(['echo', '-n', params], stdout=PIPE, stderr=PIPE)
+
+    def tearDown(self):
+        super().tearDown()
+        _clean_actions()
+
+    def test_run_actions_should_work(self):
+        result = asyncio.run(run_task_actions_async('test', [{'echo': 'hello'}, {'cat': None}, {'read': None}]))
+
+        self.assertEqual(Path('hello'), result)
+
+    def test_run_actions_should_await_coroutine_actions(self):
+        result = asyncio.run(run_task_actions_async('test', [{'echo': 'hello'}, {'async-read': None}]))
+
+        self.assertEqual(Path('hello'), result)
+
+    def test_run_actions_with_noisy_process_should_not_block(self):
+        result = asyncio.run(run_task_actions_async('test', [{'noisy': None}, {'read': None}]))
+
+        self.assertEqual(Path('out'), result)
+
+    def test_run_actions_should_fail_if_process_fails(self):
+        with self.assertRaises(RuntimeError) as context:
+            asyncio.run(run_task_actions_async('test', [{'echo': 'hello'}, {'fail': None}, {'read': None}]))
+
+        self.assertEqual('fail:\nbroken\n', context.exception.args[0])
+
+    def test_run_actions_should_fill_stats(self):
+        stats = []
+
+        asyncio.run(run_task_actions_async('test', [{'echo': 'hello'}, {'cat': None}, {'read': None}], stats=stats))
+
+        self.assertEqual(['echo', 'cat', 'read'], [stage['action'] for stage in stats])
+        for stage in stats[:2]:
+            self.assertIsNotNone(stage['wallTime'])
+            self.assertIsNotNone(stage['cpuTime'])
+
+    def test_run_actions_should_measure_each_process_until_it_ends(self):
+        stats = []
+
+        asyncio.run(run_task_actions_async('test', [{'echo': 'hello'}, {'cat': None}, {'slow-read': None}],
+                                           stats=stats))
+
+        for stage in stats[:2]:
+            self.assertLess(stage['wallTime'], 0.5)
+        self.assertGreaterEqual(stats[2]['wallTime'], 0.5)
+
+    def test_run_many_actions_in_the_same_loop_should_run_them_at_the_same_time(self):
+        async def run_all():
+            return await asyncio.gather(*(
+                run_task_actions_async(f'test-{i}', [{'echo': str(i)}, {'sleep': None}, {'async-read': None}])
+                for i in range(10)
+            ))
+
+        start = time.monotonic()
+        results = asyncio.run(run_all())
+
+        self.assertEqual([Path(str(i)) for i in range(10)], results)
+        self.assertLess(time.monotonic() - start, 5 * 0.5)
+
+    def test_blocking_actions_should_run_in_the_executor_without_blocking_the_loop(self):
+        async def run_all(executor):
+            return await asyncio.gather(*(
+                run_task_actions_async(f'test-{i}', [{'slow-echo': str(i)}, {'async-read': None}], executor=executor)
+                for i in range(10)
+            ))
+
+        start = time.monotonic()
+        with ThreadPoolExecutor(max_workers=10, thread_name_prefix='test-actions') as executor:
+            results = asyncio.run(run_all(executor))
+
+        self.assertEqual([Path(str(i)) for i in range(10)], results)
+        self.assertLess(time.monotonic() - start, 5 * 0.5)
+        self.assertEqual(10, len(self.threads))
+        self.assertTrue(all(name.startswith('test-actions') for name in self.threads))
+
+    def test_run_actions_in_event_loop_should_work(self):
+        result = run_task_actions_in_event_loop('test', [{'echo': 'hello'}, {'cat': None}, {'read': None}])
+
+        self.assertEqual(Path('hello'), result)
@@ -1,12 +1,15 @@
-from io import FileIO
+from io import BufferedReader, FileIO
+import os
 from pathlib import Path
-from subprocess import Popen
+from subprocess import PIPE, Popen
+import threading
+import time
 from unittest.mock import MagicMock, Mock
 
 from tests.classes import TestCaseWithoutLogs
 
 from mdbackup.actions.container import _clean_actions, register_action
-from mdbackup.actions.runner import run_task_actions
+from mdbackup.actions.runner import _wait_process_with_usage, run_task_actions
 
 
 def _failure_impl(_1, _2):
@@ -18,7 +21,7 @@ def _register_actions(this=None):
         this._initial_stream_mock = Mock(spec=FileIO)
         this._middle_stream_mock = Mock(spec=Popen)
         this._middle_stream_mock.stdout = MagicMock(spec=FileIO)
-        this._middle_stream_mock.stderr = MagicMock(spec=FileIO)
+        this._middle_stream_mock.stderr = MagicMock(spec=BufferedReader)
         this._middle_stream_mock.wait.return_value = 0
         register_action('initial', lambda _1, _2: this._initial_stream_mock, output='stream')
         register_action('middle', lambda _1, _2: this._middle_stream_mock, expected_input='stream', output='stream')
@@ -148,7 +151,7 @@ class RunTaskActionsWithMultipleActionsTests(TestCaseWithoutLogs):
         with self.assertRaises(Exception):
             run_task_actions('test', actions)
 
-        self._middle_stream_mock.stderr.__iter__.assert_called()
+        self._middle_stream_mock.stderr.readline.assert_called()
 
     def test_run_actions_should_kill_process_if_action_raises(self):
         actions = [{'initial': 1}, {'middle': 2}, {'ffailure': 3}]
@@ -157,3 +160,174 @@ class RunTaskActionsWithMultipleActionsTests(TestCaseWithoutLogs):
             run_task_actions('test', actions)
 
         self._middle_stream_mock.send_signal.assert_called_once()
+
+
+class RunTaskActionsWithInputTests(TestCaseWithoutLogs):
+    _initial_stream_mock = None
+    _middle_stream_mock = None
+
+    def setUp(self):
+        super().setUp()
+        _register_actions(self)
+
+    def tearDown(self):
+        super().tearDown()
+        _clean_actions()
+
+    def test_run_actions_should_pass_the_input_to_the_first_action(self):
+        inp = Mock(spec=FileIO)
+        final_mock = Mock(return_value=Path('final-file'))
+        register_action('final-mock', final_mock, expected_input='stream')
+        actions = [{'final-mock': 1}]
+
+        result = run_task_actions('test', actions, inp)
+
+        self.assertEqual(Path('final-file'), result)
+        final_mock.assert_called_once_with(inp, 1)
+
+    def test_run_actions_with_input_should_work(self):
+        actions = [{'middle': 1}, {'final': 2}]
+
+        run_task_actions('test', actions, Mock(spec=FileIO))
+
+        self._middle_stream_mock.wait.assert_called_once()
+
+    def test_run_actions_with_input_and_first_action_not_accepting_streams_should_fail(self):
+        actions = [{'initial': 1}, {'final': 2}]
+
+        with self.assertRaises(Exception):
+            run_task_actions('test', actions, Mock(spec=FileIO))
+
+
+def _slow_read(inp, _):
+    data = inp.read()
+    time.sleep(0.5)
+    return Path(data.decode('utf-8'))
+
+
+def _entries(_1, _2):
+    yield 'a'
+    yield 'b'
+
+
+def _slow_read_entries(inp, _):
+    entries = list(inp)
+    time.sleep(0.5)
+    return Path(''.join(entries))
+
+
+def _thread_pipe(_1, _2):
+    read_fd, write_fd = os.pipe()
+
+    def write():
+        with open(write_fd, 'wb') as stream:
+            stream.write(b'piped')
+
+    threading.Thread(target=write).start()
+    return open(read_fd, 'rb', buffering=0)
+
+
+class RunTaskActionsWithStatsTests(TestCaseWithoutLogs):
+    def setUp(self):
+        super().setUp()
+        register_action('echo', lambda _1, _2: Popen(['echo', 'hello'], stdout=PIPE, stderr=PIPE), output='stream')
+        register_action('cat', lambda inp, _: Popen(['cat'], stdin=inp, stdout=PIPE, stderr=PIPE),
+                        expected_input='stream', output='stream')
+        register_action('read', lambda inp, _: Path(inp.read().decode('utf-8')), expected_input='stream')
+        register_action('fail', lambda inp, _: Popen(['false'], stdin=inp, stdout=PIPE, stderr=PIPE),
+                        expected_input='stream', output='stream')
+        register_action('slow-read', _slow_read, expected_input='stream')
+        register_action('entries', _entries, output='directory')
+        register_action('slow-read-entries', _slow_read_entries, expected_input='directory')
+        register_action('thread-pipe', _thread_pipe, output='stream')
+
+    def tearDown(self):
+        super().tearDown()
+        _clean_actions()
+
+    def test_run_actions_without_stats_should_not_fill_anything(self):
+        result = run_task_actions('test', [{'echo': None}, {'read': None}])
+
+        self.assertEqual(Path('hello\n'), result)
+
+    def test_run_actions_should_fill_stats_for_each_action(self):
+        stats = []
+
+        run_task_actions('test', [{'echo': None}, {'cat': None}, {'read': None}], stats=stats)
+
+        self.assertEqual(['echo', 'cat', 'read'], [stage['action'] for stage in stats])
+        for stage in stats:
+            self.assertIsNotNone(stage['wallTime'])
+            self.assertGreaterEqual(stage['wallTime'], 0)
+
+    def test_run_actions_should_measure_each_process_until_it_ends(self):
+        stats = []
+
+        run_task_actions('test', [{'echo': None}, {'cat': None}, {'slow-read': None}], stats=stats)
+
+        for stage in stats[:2]:
+            self.assertLess(stage['wallTime'], 0.5)
+        self.assertGreaterEqual(stats[2]['wallTime'], 0.5)
+
+    def test_run_actions_should_fill_process_usage_in_stats(self):
+        stats = []
+
+        run_task_actions('test', [{'echo': None}, {'cat': None}, {'read': None}], stats=stats)
+
+        for stage in stats[:2]:
+            self.assertIsNotNone(stage['cpuTime'])
+            self.assertGreater(stage['maxRss'], 0)
+        self.assertIsNone(stats[2]['cpuTime'])
+        self.assertIsNone(stats[2]['maxRss'])
+
+    def test_run_actions_with_stats_should_fail_if_process_fails(self):
+        stats = []
+
+        with self.assertRaises(RuntimeError):
+            run_task_actions('test', [{'echo': None}, {'fail': None}, {'read': None}], stats=stats)
+
+    def test_run_actions_should_measure_directories_until_their_entries_are_read(self):
+        stats = []
+
+        result = run_task_actions('test', [{'entries': None}, {'slow-read-entries': None}], stats=stats)
+
+        self.assertEqual(Path('ab'), result)
+        self.assertLess(stats[0]['wallTime'], 0.5)
+        self.assertGreaterEqual(stats[1]['wallTime'], 0.5)
+
+    def test_run_actions_should_not_measure_streams_written_by_threads(self):
+        stats = []
+
+        result = run_task_actions('test', [{'thread-pipe': None}, {'slow-read': None}], stats=stats)
+
+        self.assertEqual(Path('piped'), result)
+        self.assertIsNone(stats[0]['wallTime'])
+        self.assertGreaterEqual(stats[1]['wallTime'], 0.5)
+
+
+class WaitProcessWithUsageTests(TestCaseWithoutLogs):
+    def test_process_should_be_reaped_holding_the_lock_of_popen(self):
+        process = Popen(['true'])
+        lock = process._waitpid_lock
+        returncodes = []
+
+        class RecordingLock:
+            def __enter__(self):
+                lock.acquire()
+
+            def __exit__(self, *args):
+                # The return code is already set when other threads can poll the process
+                returncodes.append(process.returncode)
+                lock.release()
+
+        process._waitpid_lock = RecordingLock()
+        rc = _wait_process_with_usage(process, {})
+
+        self.assertEqual(0, rc)
+        self.assertEqual([0], returncodes)
+
+    def test_process_already_reaped_should_return_its_return_code(self):
+        process = Popen(['false'])
+        process.wait()
+
+        self.assertEqual(1, _wait_process_with_usage(process, {}))
@@ -1,4 +1,4 @@
-from io import FileIO
+from io import BufferedReader, FileIO
 from subprocess import Popen
 from unittest.mock import MagicMock, Mock
 
@@ -19,7 +19,7 @@ def _register_actions(this=None):
         this._initial_stream_mock = Mock(spec=FileIO)
         this._middle_stream_mock = Mock(spec=Popen)
         this._middle_stream_mock.stdout = MagicMock(spec=FileIO)
-        this._middle_stream_mock.stderr = MagicMock(spec=FileIO)
+        this._middle_stream_mock.stderr = MagicMock(spec=BufferedReader)
         this._middle_stream_mock.wait.return_value = 0
         register_action('final', nop, lambda _1, _2: this._initial_stream_mock, expected_input='stream')
         register_action('middle', nop, lambda _, _2: this._middle_stream_mock, expected_input='stream', output='stream')
@@ -141,7 +141,7 @@ class RunTaskUnactionsWithMultipleActionsTests(TestCaseWithoutLogs):
         with self.assertRaises(Exception):
             run_task_unactions('test', actions)
 
-        self._middle_stream_mock.stderr.__iter__.assert_called()
+        self._middle_stream_mock.stderr.readline.assert_called()
 
     def test_run_unactions_should_kill_process_if_action_raises(self):
         actions = [{'ifailure': 1}, {'middle': 2}, {'final': 3}]
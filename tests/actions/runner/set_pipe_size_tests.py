@@ -0,0 +1,62 @@
+import os
+from pathlib import Path
+from subprocess import PIPE, Popen
+import tempfile
+import unittest
+
+from tests.classes import TestCaseWithoutLogs
+
+from mdbackup.actions.container import _clean_actions, register_action
+from mdbackup.actions.runner import _F_SETPIPE_SZ, _set_pipe_size, run_task_actions
+
+
+@unittest.skipIf(_F_SETPIPE_SZ is None, 'pipe sizes cannot be changed in this platform')
+class SetPipeSizeTests(TestCaseWithoutLogs):
+    def test_set_pipe_size_should_grow_the_pipe(self):
+        read_fd, write_fd = os.pipe()
+        with os.fdopen(read_fd, 'rb', buffering=0) as stream:
+            size = _set_pipe_size(stream, 256 * 1024)
+            os.close(write_fd)
+
+        self.assertEqual(256 * 1024, size)
+
+    def test_set_pipe_size_without_size_should_do_nothing(self):
+        read_fd, write_fd = os.pipe()
+        with os.fdopen(read_fd, 'rb', buffering=0) as stream:
+            size = _set_pipe_size(stream, None)
+            os.close(write_fd)
+
+        self.assertIsNone(size)
+
+    def test_set_pipe_size_of_a_file_should_do_nothing(self):
+        with tempfile.TemporaryFile() as stream:
+            size = _set_pipe_size(stream, 256 * 1024)
+
+        self.assertIsNone(size)
+
+
+@unittest.skipIf(_F_SETPIPE_SZ is None, 'pipe sizes cannot be changed in this platform')
+class RunTaskActionsWithPipeSizeTests(TestCaseWithoutLogs):
+    def setUp(self):
+        super().setUp()
+        register_action('echo', lambda _1, _2: Popen(['echo', 'hello'], stdout=PIPE, stderr=PIPE), output='stream')
+        register_action('read', lambda inp, _: Path(inp.read().decode('utf-8')), expected_input='stream')
+
+    def tearDown(self):
+        super().tearDown()
+        _clean_actions()
+
+    def test_run_actions_should_record_the_pipe_size(self):
+        stats = []
+
+        run_task_actions('test', [{'echo': None}, {'read': None}], stats=stats, pipe_size=128 * 1024)
+
+        self.assertEqual(128 * 1024, stats[0]['pipeSize'])
+        self.assertIsNone(stats[1]['pipeSize'])
+
+    def test_run_actions_without_pipe_size_should_not_record_it(self):
+        stats = []
+
+        run_task_actions('test', [{'echo': None}, {'read': None}], stats=stats)
+
+        self.assertIsNone(stats[0]['pipeSize'])
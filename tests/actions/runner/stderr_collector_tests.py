@@ -0,0 +1,109 @@
+from io import BytesIO, FileIO, RawIOBase
+from pathlib import Path
+from subprocess import DEVNULL, PIPE, Popen
+import sys
+
+from tests.classes import TestCaseWithoutLogs
+
+from mdbackup.actions.builtin.command import action_command
+from mdbackup.actions.container import _clean_actions, register_action
+from mdbackup.actions.runner import _StderrCollector, run_task_actions
+
+
+_NOISY_SCRIPT = 'import sys; sys.stderr.write("noise\\n" * 200000); sys.stderr.flush(); sys.stdout.write("out")'
+
+
+class _CountingReads(RawIOBase):
+    def __init__(self, raw: FileIO):
+        super().__init__()
+        self.raw = raw
+        self.reads = 0
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer) -> int:
+        self.reads += 1
+        return self.raw.readinto(buffer)
+
+    def close(self):
+        self.raw.close()
+        super().close()
+
+
+class StderrCollectorTests(TestCaseWithoutLogs):
+    def test_collector_should_return_the_contents(self):
+        collector = _StderrCollector(BytesIO(b'line 1\nline 2\n'), 'test').start()
+
+        self.assertEqual('line 1\nline 2\n', collector.join())
+
+    def test_collector_should_keep_only_the_last_lines(self):
+        stream = BytesIO(b''.join(f'line {i}\n'.encode('utf-8') for i in range(1000)))
+
+        lines = _StderrCollector(stream, 'test', max_size=100).start().join()
+
+        self.assertTrue(lines.startswith('[...]\n'))
+        self.assertTrue(lines.endswith('line 999\n'))
+        self.assertLessEqual(len(lines), 100 + len('[...]\n'))
+
+    def test_collector_should_close_the_stream(self):
+        stream = BytesIO(b'line\n')
+
+        _StderrCollector(stream, 'test').start().join()
+
+        self.assertTrue(stream.closed)
+
+    def test_collector_should_not_read_unbuffered_streams_byte_by_byte(self):
+        process = action_command(DEVNULL, {'args': [sys.executable, '-c', _NOISY_SCRIPT]})
+        self.assertIsInstance(process.stderr, FileIO)
+        stream = _CountingReads(process.stderr)
+
+        lines = _StderrCollector(stream, 'test', max_size=1024 * 1024 * 2).start().join()
+        process.wait()
+        process.stdout.close()
+
+        self.assertEqual('noise\n' * 200000, lines)
+        self.assertLess(stream.reads, 1000)
+        self.assertTrue(process.stderr.closed)
+
+
+class RunTaskActionsWithNoisyProcessTests(TestCaseWithoutLogs):
+    def setUp(self):
+        super().setUp()
+        # Writes much more than the size of a pipe into stderr before writing into stdout
+        script = _NOISY_SCRIPT
+        register_action('noisy', lambda _1, _2: Popen([sys.executable, '-c', script], stdout=PIPE, stderr=PIPE),
+                        output='stream')
+        register_action('failing', lambda _1, _2: Popen([sys.executable, '-c', script + '; sys.exit(1)'],
+                                                        stdout=PIPE, stderr=PIPE),
+                        output='stream')
+        register_action('noisy-command', action_command, output='stream')
+        register_action('read', lambda inp, _: Path(inp.read().decode('utf-8')), expected_input='stream')
+
+    def tearDown(self):
+        super().tearDown()
+        _clean_actions()
+
+    def test_run_actions_with_noisy_process_should_not_block(self):
+        result = run_task_actions('test', [{'noisy': None}, {'read': None}])
+
+        self.assertEqual(Path('out'), result)
+
+    def test_run_actions_with_noisy_failing_process_should_report_the_last_lines(self):
+        with self.assertRaises(RuntimeError) as context:
+            run_task_actions('test', [{'failing': None}, {'read': None}])
+
+        message = context.exception.args[0]
+        self.assertIn('[...]', message)
+        self.assertTrue(message.endswith('noise\n'))
+
+    def test_run_actions_with_noisy_failing_command_should_report_the_last_lines(self):
+        with self.assertRaises(RuntimeError) as context:
+            run_task_actions('test', [
+                {'noisy-command': {'args': [sys.executable, '-c', _NOISY_SCRIPT + '; sys.exit(1)']}},
+                {'read': None},
+            ])
+
+        message = context.exception.args[0]
+        self.assertTrue(message.startswith('noisy-command:\n[...]\n'))
+        self.assertTrue(message.endswith('noise\n'))
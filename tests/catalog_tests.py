@@ -0,0 +1,119 @@
+from contextlib import closing
+from pathlib import Path
+import sqlite3
+import tempfile
+
+from tests.classes import TestCaseWithoutLogs
+
+from mdbackup.actions.ds import StatResult
+from mdbackup.catalog import Catalog
+
+
+class CatalogTests(TestCaseWithoutLogs):
+    def setUp(self):
+        super().setUp()
+        self.tmp = tempfile.TemporaryDirectory()
+        self.root = Path(self.tmp.name)
+        self.path = self.root / '.catalog.sqlite'
+
+    def tearDown(self):
+        super().tearDown()
+        self.tmp.cleanup()
+
+    def test_added_entries_should_be_found_by_their_path(self):
+        catalog = Catalog(self.path, self.root)
+
+        catalog.add(self.root / 'a' / 'b.txt', StatResult(st_size=10, st_mtime_ns=20, st_ino=30, st_mode=0o100644))
+
+        entry = catalog.get(self.root / 'a' / 'b.txt')
+        self.assertEqual('a/b.txt', entry.path)
+        self.assertEqual(10, entry.size)
+        self.assertEqual(20, entry.mtime_ns)
+        self.assertEqual(30, entry.inode)
+        self.assertEqual(0o100644, entry.mode)
+        self.assertIsNone(entry.hash)
+        catalog.close()
+
+    def test_unknown_paths_should_not_be_found(self):
+        catalog = Catalog(self.path, self.root)
+
+        self.assertIsNone(catalog.get(self.root / 'nope'))
+        self.assertIsNone(catalog.get(Path('/outside/of/the/root')))
+        catalog.close()
+
+    def test_closed_catalog_should_be_read_by_the_next_backup(self):
+        catalog = Catalog(self.path, self.root)
+        for i in range(Catalog._BATCH_SIZE + 5):
+            catalog.add(self.root / f'{i}', StatResult(st_size=i))
+        catalog.close()
+
+        prev_catalog = Catalog.open_previous(self.path, self.root)
+
+        self.assertIsNotNone(prev_catalog)
+        self.assertEqual(Catalog._BATCH_SIZE + 5, len(list(prev_catalog.entries())))
+        self.assertEqual(1003, prev_catalog.get(self.root / '1003').size)
+        prev_catalog.close()
+
+    def test_entries_should_be_sorted_and_filtered_by_folder(self):
+        catalog = Catalog(self.path, self.root)
+        for path in ('b/2', 'a/1', 'b/1', 'bb/1'):
+            catalog.add(self.root / path, StatResult())
+
+        self.assertEqual(['a/1', 'b/1', 'b/2', 'bb/1'], [entry.path for entry in catalog.entries()])
+        self.assertEqual(['b/1', 'b/2'], [entry.path for entry in catalog.entries('b')])
+        catalog.close()
+
+    def test_entries_of_a_folder_should_not_include_the_folders_with_the_same_prefix(self):
+        catalog = Catalog(self.path, self.root)
+        for path in ('b', 'b-c/1', 'b.d/1', 'b/1', 'b/c/2', 'b0/1', 'b0', 'ba/1'):
+            catalog.add(self.root / path, StatResult())
+
+        self.assertEqual(['b/1', 'b/c/2'], [entry.path for entry in catalog.entries('b')])
+        self.assertEqual(['b/1', 'b/c/2'], [entry.path for entry in catalog.entries('b/')])
+        self.assertEqual(['b/c/2'], [entry.path for entry in catalog.entries('b/c')])
+        self.assertEqual([], [entry.path for entry in catalog.entries('b/1')])
+        catalog.close()
+
+    def test_removed_folders_should_forget_their_entries(self):
+        catalog = Catalog(self.path, self.root)
+        for path in ('b', 'b/1', 'b/c/2', 'b-c/1', 'b0'):
+            catalog.add(self.root / path, StatResult())
+        catalog.close()
+        catalog = Catalog(self.path, self.root)
+        catalog.add(self.root / 'b' / 'pending', StatResult())
+
+        catalog.remove(self.root / 'b')
+
+        self.assertEqual(['b-c/1', 'b0'], [entry.path for entry in catalog.entries()])
+        catalog.close()
+
+    def test_get_should_only_write_the_pending_entries_when_it_looks_for_one_of_them(self):
+        catalog = Catalog(self.path, self.root)
+        catalog.add(self.root / 'a', StatResult(st_size=1))
+        with closing(sqlite3.connect(str(self.path))) as db:
+            self.assertIsNone(catalog.get(self.root / 'b'))
+            self.assertEqual(0, db.execute('SELECT COUNT(*) FROM files').fetchone()[0])
+
+            self.assertEqual(1, catalog.get(self.root / 'a').size)
+            self.assertEqual(1, db.execute('SELECT COUNT(*) FROM files').fetchone()[0])
+        catalog.close()
+
+    def test_started_time_should_be_kept_when_the_catalog_is_opened_again(self):
+        catalog = Catalog(self.path, self.root)
+        started_ns = catalog.started_ns
+        catalog.close()
+
+        Catalog(self.path, self.root).close()
+        prev_catalog = Catalog.open_previous(self.path, self.root)
+
+        self.assertIsNotNone(started_ns)
+        self.assertEqual(started_ns, prev_catalog.started_ns)
+        prev_catalog.close()
+
+    def test_open_previous_without_catalog_should_return_none(self):
+        self.assertIsNone(Catalog.open_previous(self.path, self.root))
+
+    def test_open_previous_of_an_invalid_file_should_return_none(self):
+        self.path.write_text('this is not a catalog')
+
+        self.assertIsNone(Catalog.open_previous(self.path, self.root))
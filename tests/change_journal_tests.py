@@ -0,0 +1,101 @@
+import os
+from pathlib import Path
+import tempfile
+from threading import Event, Thread
+import time
+
+from tests.classes import TestCaseWithoutLogs
+
+from mdbackup.change_journal import ChangeJournal, ChangeWatcher
+
+
+class ChangeJournalTests(TestCaseWithoutLogs):
+    def setUp(self):
+        super().setUp()
+        self.tmp = tempfile.TemporaryDirectory()
+        self.root = Path(self.tmp.name) / 'root'
+        self.root.mkdir()
+        self.journal = ChangeJournal(Path(self.tmp.name) / 'changes' / 'root.journal', self.root)
+
+    def tearDown(self):
+        super().tearDown()
+        self.journal.close()
+        self.tmp.cleanup()
+
+    def test_changed_dirs_should_return_the_dirs_recorded_since_the_time(self):
+        self.journal.lock()
+        self.journal.start(1_000)
+        self.journal.record('old', 2_000)
+        self.journal.record('a/b', 100_000_000_000)
+        self.journal.record('c', 100_000_000_001)
+
+        self.assertSetEqual({'a/b', 'c'}, ChangeJournal(self.journal.path, self.root).changed_dirs(90_000_000_000))
+
+    def test_changed_dirs_without_watcher_should_return_none(self):
+        self.journal.lock()
+        self.journal.start(1_000)
+        self.journal.record('a', 2_000)
+        self.journal.close()
+
+        self.assertIsNone(ChangeJournal(self.journal.path, self.root).changed_dirs(1_000))
+
+    def test_changed_dirs_of_a_watcher_started_later_should_return_none(self):
+        self.journal.lock()
+        self.journal.start(5_000)
+
+        self.assertIsNone(ChangeJournal(self.journal.path, self.root).changed_dirs(1_000))
+
+    def test_changed_dirs_after_losing_changes_should_return_none(self):
+        self.journal.lock()
+        self.journal.start(1_000)
+        self.journal.overflow(100_000_000_000)
+
+        self.assertIsNone(ChangeJournal(self.journal.path, self.root).changed_dirs(100_000_000_000))
+
+    def test_lock_of_a_journal_being_written_should_raise(self):
+        self.journal.lock()
+
+        with self.assertRaises(RuntimeError):
+            ChangeJournal(self.journal.path, self.root).lock()
+
+
+class ChangeWatcherTests(TestCaseWithoutLogs):
+    def setUp(self):
+        super().setUp()
+        if os.uname().sysname != 'Linux':
+            self.skipTest('Watching for changes is only supported in Linux')
+        self.tmp = tempfile.TemporaryDirectory()
+        self.root = Path(self.tmp.name) / 'root'
+        (self.root / 'a' / 'b').mkdir(parents=True)
+        (self.root / 'c').mkdir()
+        self.journal_path = Path(self.tmp.name) / 'root.journal'
+        self.stop = Event()
+        self.thread = Thread(target=ChangeWatcher(self.root, ChangeJournal(self.journal_path, self.root)).run,
+                             args=(self.stop,))
+        started_ns = time.time_ns()
+        self.thread.start()
+        while not self.journal_path.exists():
+            time.sleep(0.01)
+        self.started_ns = started_ns
+
+    def tearDown(self):
+        super().tearDown()
+        self.stop.set()
+        self.thread.join()
+        self.tmp.cleanup()
+
+    def _changed_dirs(self, expected: int):
+        journal = ChangeJournal(self.journal_path, self.root)
+        for _ in range(200):
+            changed = journal.changed_dirs(time.time_ns())
+            if changed is not None and len(changed) >= expected:
+                return changed
+            time.sleep(0.01)
+        return journal.changed_dirs(time.time_ns())
+
+    def test_watcher_should_record_the_dirs_that_change(self):
+        (self.root / 'a' / 'b' / 'file').write_text('hello')
+        (self.root / 'c' / 'new').mkdir()
+        (self.root / 'c' / 'new' / 'file').write_text('hello')
+
+        self.assertSetEqual({'a/b', 'c', 'c/new'}, self._changed_dirs(3))
@@ -0,0 +1,132 @@
+import io
+import os
+from pathlib import Path
+import random
+import tempfile
+import time
+
+from tests.classes import TestCaseWithoutLogs
+
+from mdbackup.chunk_store import ChunkStore, read_recipe, referenced_chunks, split_chunks, write_recipe
+
+
+def _random_data(size: int, seed: int = 0) -> bytes:
+    return random.Random(seed).getrandbits(size * 8).to_bytes(size, 'little')
+
+
+class SplitChunksTests(TestCaseWithoutLogs):
+    def test_chunks_should_contain_the_whole_stream(self):
+        data = _random_data(1024 * 1024)
+
+        chunks = list(split_chunks(io.BytesIO(data), 16384))
+
+        self.assertEqual(data, b''.join(chunks))
+        self.assertGreater(len(chunks), 1)
+
+    def test_chunks_should_be_between_the_limits(self):
+        chunks = list(split_chunks(io.BytesIO(_random_data(1024 * 1024)), 16384))
+
+        for chunk in chunks[:-1]:
+            self.assertGreaterEqual(len(chunk), 4096)
+            self.assertLessEqual(len(chunk), 65536)
+
+    def test_data_without_anchors_should_be_cut_at_the_maximum_size(self):
+        chunks = list(split_chunks(io.BytesIO(bytes(200000)), 16384))
+
+        self.assertEqual([65536, 65536, 65536, 3392], [len(chunk) for chunk in chunks])
+
+    def test_inserting_data_should_only_change_the_chunks_around_it(self):
+        data = _random_data(1024 * 1024)
+        modified = data[:500000] + b'inserted' + data[500000:]
+
+        chunks = set(split_chunks(io.BytesIO(data), 16384))
+        modified_chunks = list(split_chunks(io.BytesIO(modified), 16384))
+
+        new_chunks = [chunk for chunk in modified_chunks if chunk not in chunks]
+        self.assertLessEqual(len(new_chunks), 2)
+
+    def test_empty_stream_should_have_no_chunks(self):
+        self.assertEqual([], list(split_chunks(io.BytesIO(b''), 16384)))
+
+    def test_average_size_must_be_a_power_of_two(self):
+        with self.assertRaises(ValueError):
+            list(split_chunks(io.BytesIO(b'data'), 10000))
+
+
+class ChunkStoreTests(TestCaseWithoutLogs):
+    def setUp(self):
+        super().setUp()
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = Path(self.tmp.name)
+        self.store = ChunkStore(self.path / '.chunks')
+
+    def tearDown(self):
+        super().tearDown()
+        self.tmp.cleanup()
+
+    def test_equal_chunks_should_be_stored_once(self):
+        chunk_hash, written = self.store.put(b'chunk')
+        same_hash, written_again = self.store.put(b'chunk')
+
+        self.assertEqual(chunk_hash, same_hash)
+        self.assertTrue(written)
+        self.assertFalse(written_again)
+        self.assertEqual(b'chunk', self.store.get(chunk_hash))
+
+    def test_corrupted_chunk_should_raise(self):
+        chunk_hash, _ = self.store.put(b'chunk')
+        self.store.chunk_path(chunk_hash).write_bytes(b'corrupted')
+
+        with self.assertRaises(ValueError):
+            self.store.get(chunk_hash)
+
+    def test_written_stream_should_be_read_back(self):
+        data = _random_data(300000)
+
+        chunks, new_bytes = self.store.write_stream(io.BytesIO(data), 16384)
+        _, new_bytes_again = self.store.write_stream(io.BytesIO(data), 16384)
+
+        self.assertEqual(len(data), new_bytes)
+        self.assertEqual(0, new_bytes_again)
+        self.assertEqual(data, self.store.read_stream(chunks).readall())
+
+    def test_garbage_collection_should_keep_the_chunks_of_the_recipes(self):
+        kept, _ = self.store.write_stream(io.BytesIO(b'kept'), 4096)
+        removed, _ = self.store.write_stream(io.BytesIO(b'removed'), 4096)
+        backup = self.path / '2020-01-01T00:00'
+        backup.mkdir()
+        write_recipe(backup / 'file.chunks', [{'type': 'stream', 'size': 4, 'chunks': kept}])
+
+        count = self.store.collect_garbage(referenced_chunks([backup]))
+
+        self.assertEqual(1, count)
+        self.assertTrue(self.store.chunk_path(kept[0][0]).exists())
+        self.assertFalse(self.store.chunk_path(removed[0][0]).exists())
+
+    def test_garbage_collection_should_keep_the_recent_chunks(self):
+        recent, _ = self.store.write_stream(io.BytesIO(b'recent'), 4096)
+        old, _ = self.store.write_stream(io.BytesIO(b'old'), 4096)
+        two_days_ago = time.time() - 2 * 24 * 60 * 60
+        os.utime(self.store.chunk_path(old[0][0]), (two_days_ago, two_days_ago))
+
+        count = self.store.collect_garbage(set(), 24 * 60 * 60)
+
+        self.assertEqual(1, count)
+        self.assertTrue(self.store.chunk_path(recent[0][0]).exists())
+        self.assertFalse(self.store.chunk_path(old[0][0]).exists())
+
+    def test_stored_chunks_should_be_touched_when_reused(self):
+        chunk_hash, _ = self.store.put(b'chunk')
+        two_days_ago = time.time() - 2 * 24 * 60 * 60
+        os.utime(self.store.chunk_path(chunk_hash), (two_days_ago, two_days_ago))
+
+        self.store.put(b'chunk')
+
+        self.assertGreater(self.store.chunk_path(chunk_hash).stat().st_mtime, two_days_ago)
+
+    def test_recipe_should_be_read_back(self):
+        entries = [{'type': 'dir', 'path': 'a'}, {'type': 'file', 'path': 'a/b', 'chunks': [['abc', 3]]}]
+
+        write_recipe(self.path / 'recipe.chunks', entries)
+
+        self.assertEqual(entries, list(read_recipe(self.path / 'recipe.chunks')))
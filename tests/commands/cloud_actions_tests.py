@@ -0,0 +1,96 @@
+from pathlib import Path
+import tempfile
+
+from tests.classes import TestCaseWithoutLogs
+
+from mdbackup._commands.backup import _check_cloud_actions
+from mdbackup._commands.upload import _get_generated_files_from_manifest
+from mdbackup.config import StorageConfig
+from mdbackup.tasks.task_cloud_options import TaskCloudOptions
+from mdbackup.tasks.tasks import Tasks
+from mdbackup.utils import write_data_file
+
+
+class CheckCloudActionsTests(TestCaseWithoutLogs):
+    def setUp(self):
+        super().setUp()
+        self.tmp = tempfile.TemporaryDirectory()
+        self.root = Path(self.tmp.name)
+        self.providers = [
+            StorageConfig({'type': 'sftp', 'backupsPath': '/'}),
+            StorageConfig({'type': 'gdrive', 'backupsPath': '/'}),
+        ]
+
+    def tearDown(self):
+        super().tearDown()
+        self.tmp.cleanup()
+
+    def _tasks(self, *final_actions) -> Tasks:
+        write_data_file(self.root / 'tasks.yaml', {
+            'tasks': [
+                {'name': f'task-{i}', 'actions': [{'from-file': '/etc/hostname'}, final_action]}
+                for i, final_action in enumerate(final_actions)
+            ],
+        })
+        return Tasks(self.root / 'tasks.yaml')
+
+    def test_providers_that_can_upload_streams_should_be_accepted(self):
+        _check_cloud_actions([self._tasks(
+            {'to-cloud': {'path': 'hostname', 'provider': 'sftp'}},
+            {'to-file': {'path': 'hostname'}},
+        )], self.providers)
+
+    def test_providers_that_cannot_upload_streams_should_be_rejected(self):
+        with self.assertRaises(NotImplementedError):
+            _check_cloud_actions([self._tasks({'to-cloud': {'path': 'hostname', 'provider': 'gdrive'}})],
+                                 self.providers)
+
+    def test_branches_of_tee_should_be_checked(self):
+        tasks = self._tasks({'tee': {'provider': 'gdrive', 'branches': [
+            [{'to-file': {'path': 'hostname'}}],
+            [{'to-cloud': {'path': 'hostname'}}],
+        ]}})
+
+        with self.assertRaises(NotImplementedError):
+            _check_cloud_actions([tasks], self.providers)
+
+    def test_unknown_providers_should_be_rejected(self):
+        with self.assertRaises(KeyError):
+            _check_cloud_actions([self._tasks({'to-cloud': {'path': 'hostname', 'provider': 's3'}})],
+                                 self.providers)
+
+
+class UploadResultsTests(TestCaseWithoutLogs):
+    def test_receipts_of_to_cloud_should_not_be_uploaded(self):
+        backup = Path('/backups/2024-01-01T00:00')
+        manifest = {
+            'tasksDefinitions': {
+                'tasks.yaml': {
+                    'tasks': [
+                        {'name': 'local', 'result': 'dump.sql', 'cloud': TaskCloudOptions({})},
+                        {'name': 'remote', 'result': 'db/dump.sql.cloud.yaml', 'cloud': TaskCloudOptions({})},
+                    ],
+                },
+            },
+        }
+
+        items = list(_get_generated_files_from_manifest(manifest, backup))
+
+        self.assertEqual([(backup / 'dump.sql').resolve()], [item for item, _ in items])
+
+    def test_chunk_recipes_should_not_be_uploaded(self):
+        backup = Path('/backups/2024-01-01T00:00')
+        manifest = {
+            'tasksDefinitions': {
+                'tasks.yaml': {
+                    'tasks': [
+                        {'name': 'local', 'result': 'dump.sql', 'cloud': TaskCloudOptions({})},
+                        {'name': 'vm', 'result': 'vm.img.chunks', 'cloud': TaskCloudOptions({})},
+                    ],
+                },
+            },
+        }
+
+        items = list(_get_generated_files_from_manifest(manifest, backup))
+
+        self.assertEqual([(backup / 'dump.sql').resolve()], [item for item, _ in items])
@@ -0,0 +1,48 @@
+from unittest.mock import Mock
+
+from tests.classes import TestCaseWithoutLogs
+
+from mdbackup._commands.backup import _inject_resolved_env_into_actions, _resolve_secrets
+
+
+class ResolveSecretsTests(TestCaseWithoutLogs):
+    def setUp(self):
+        super().setUp()
+        self.secret = Mock()
+        self.secret.type = 'mock'
+        self.secret.env = {'db': {'password': 'db-password-key'}}
+        self.secret.backend.get_secret.side_effect = lambda key: f'secret of {key}'
+
+    def test_secrets_should_be_resolved_in_nested_dicts(self):
+        env = _resolve_secrets({'a': {'b': '#db.password', 'c': 'plain'}}, [self.secret])
+
+        self.assertEqual({'a': {'b': 'secret of db-password-key', 'c': 'plain'}}, env)
+
+    def test_secrets_should_be_resolved_in_nested_lists(self):
+        env = _resolve_secrets({
+            'branches': [
+                [{'to-file': {'password': '#db.password'}}],
+                [{'command': {'args': ['echo', '#db.password']}}],
+            ],
+            'tuple': ('#db.password',),
+        }, [self.secret])
+
+        self.assertEqual({
+            'branches': [
+                [{'to-file': {'password': 'secret of db-password-key'}}],
+                [{'command': {'args': ['echo', 'secret of db-password-key']}}],
+            ],
+            'tuple': ('secret of db-password-key',),
+        }, env)
+
+    def test_unknown_secrets_should_be_kept(self):
+        env = _resolve_secrets({'a': ['#db.user', 1, None]}, [self.secret])
+
+        self.assertEqual({'a': ['#db.user', 1, None]}, env)
+
+    def test_secrets_of_tee_branches_should_be_resolved_in_actions(self):
+        actions = _inject_resolved_env_into_actions([
+            {'tee': {'branches': [[{'to-file': {'password': '#db.password'}}]]}},
+        ], {}, [self.secret])
+
+        self.assertEqual('secret of db-password-key', actions[0]['tee']['branches'][0][0]['to-file']['password'])
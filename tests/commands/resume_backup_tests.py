@@ -0,0 +1,132 @@
+import os
+from pathlib import Path
+import tempfile
+
+from tests.classes import TestCaseWithoutLogs
+
+from mdbackup._commands.backup import _do_backup, _remove_partial_result, CATALOG_FILE_NAME, JOURNAL_FILE_NAME
+from mdbackup.actions.builtin.directory import action_read_dir, action_write_dir
+from mdbackup.actions.container import _clean_actions, register_action
+from mdbackup.actions.ds import StatResult
+from mdbackup.catalog import Catalog
+from mdbackup.tasks.journal import Journal
+from mdbackup.utils import write_data_file
+
+
+class ResumeBackupTests(TestCaseWithoutLogs):
+    def setUp(self):
+        super().setUp()
+        _clean_actions()
+        register_action('from-directory', action_read_dir, output='directory')
+        register_action('to-directory', action_write_dir, expected_input='directory')
+        self.tmp = tempfile.TemporaryDirectory()
+        self.root = Path(self.tmp.name)
+        self.source = self.root / 'source'
+        (self.source / 'sub').mkdir(parents=True)
+        (self.source / 'file').write_bytes(b'file')
+        (self.source / 'sub' / 'other').write_bytes(b'other')
+        (self.source / 'symlink').symlink_to('file')
+        os.link(self.source / 'file', self.source / 'hardlink')
+
+        self.config = self.root / 'config'
+        (self.config / 'tasks').mkdir(parents=True)
+        write_data_file(self.config / 'tasks' / 'backup.yaml', {
+            'tasks': [
+                {
+                    'name': name,
+                    'actions': [{'from-directory': {'path': str(self.source)}}, {'to-directory': {'path': name}}],
+                }
+                for name in ('finished', 'failed')
+            ],
+        })
+
+        self.backups = self.root / 'backups'
+        self.partial = self.backups / '.partial'
+        self.partial.mkdir(parents=True)
+        journal = Journal(self.partial / JOURNAL_FILE_NAME)
+        journal.start('2024-01-01T00:00')
+        journal.task_finished('backup.yaml', 'finished', Path('finished'))
+        (self.partial / 'finished').mkdir()
+        (self.partial / 'finished' / 'from-the-first-run').touch()
+
+    def tearDown(self):
+        super().tearDown()
+        _clean_actions()
+        self.tmp.cleanup()
+
+    def _leave_partial_result(self):
+        failed = self.partial / 'failed'
+        (failed / 'sub').mkdir(parents=True)
+        (failed / 'file').write_bytes(b'fi')
+        (failed / 'symlink').symlink_to('file')
+        os.link(failed / 'file', failed / 'hardlink')
+        (failed / 'leftover').touch()
+        catalog = Catalog(self.partial / CATALOG_FILE_NAME, self.partial)
+        catalog.add(failed / 'file', StatResult(st_size=2))
+        catalog.add(failed / 'leftover', StatResult())
+        catalog.close()
+
+    def test_resume_should_remove_what_the_failed_task_left(self):
+        self._leave_partial_result()
+
+        backup = _do_backup(self.backups, self.config, resume=True)
+
+        self.assertEqual(self.backups / '2024-01-01T00:00', backup)
+        failed = backup / 'failed'
+        self.assertEqual(b'file', (failed / 'file').read_bytes())
+        self.assertEqual(b'other', (failed / 'sub' / 'other').read_bytes())
+        self.assertEqual('file', os.readlink(failed / 'symlink'))
+        self.assertTrue((failed / 'file').samefile(failed / 'hardlink'))
+        self.assertFalse((failed / 'leftover').exists())
+        catalog = Catalog.open_previous(backup / CATALOG_FILE_NAME, backup)
+        self.assertIsNone(catalog.get(failed / 'leftover'))
+        self.assertEqual(4, catalog.get(failed / 'file').size)
+        catalog.close()
+        # The task that finished is not run again
+        self.assertEqual(['from-the-first-run'], os.listdir(backup / 'finished'))
+
+    def test_resume_should_work_if_the_failed_task_left_nothing(self):
+        backup = _do_backup(self.backups, self.config, resume=True)
+
+        self.assertEqual(b'file', (backup / 'failed' / 'file').read_bytes())
+        self.assertEqual(['from-the-first-run'], os.listdir(backup / 'finished'))
+
+
+class RemovePartialResultTests(TestCaseWithoutLogs):
+    def setUp(self):
+        super().setUp()
+        self.tmp = tempfile.TemporaryDirectory()
+        self.backup = Path(self.tmp.name) / '.partial'
+        for path in ('dump.chunks', 'dump', 'db.sql.cloud.yaml', 'db.sql', 'copy/file', 'copy/sub/file', 'copy-2/file',
+                     'other'):
+            (self.backup / path).parent.mkdir(parents=True, exist_ok=True)
+            (self.backup / path).touch()
+        self.catalog = Catalog(self.backup / CATALOG_FILE_NAME, self.backup)
+        for path in ('dump.chunks', 'copy', 'copy/file', 'copy/sub', 'copy/sub/file', 'copy-2/file', 'other'):
+            self.catalog.add(self.backup / path, StatResult())
+
+    def tearDown(self):
+        super().tearDown()
+        self.catalog.close()
+        self.tmp.cleanup()
+
+    def _remaining(self):
+        return sorted(path.relative_to(self.backup).as_posix() for path in self.backup.rglob('*')
+                      if path.is_file() and path.name != CATALOG_FILE_NAME)
+
+    def test_suffixed_results_should_be_removed(self):
+        _remove_partial_result({'to-chunks': {'path': 'dump', '_backup_path': self.backup}}, self.catalog)
+
+        self.assertNotIn('dump.chunks', self._remaining())
+        self.assertIn('dump', self._remaining())
+        self.assertIsNone(self.catalog.get(self.backup / 'dump.chunks'))
+
+    def test_results_of_every_branch_of_tee_should_be_removed(self):
+        _remove_partial_result({'tee': {'_backup_path': self.backup, 'branches': [
+            [{'to-cloud': {'path': 'db.sql'}}],
+            [{'compress-gz': {}}, {'to-directory': {'path': 'copy'}}],
+            [{'tee': {'branches': [[{'directory-to-chunks': {'to': 'dump'}}]]}}],
+        ]}}, self.catalog)
+
+        self.assertEqual(['copy-2/file', 'db.sql', 'dump', 'other'], self._remaining())
+        self.assertEqual(['copy-2/file', 'other'], [entry.path for entry in self.catalog.entries()])
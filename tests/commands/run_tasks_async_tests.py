@@ -0,0 +1,70 @@
+import asyncio
+from pathlib import Path
+from subprocess import PIPE, Popen
+import tempfile
+import threading
+import time
+from unittest.mock import patch
+
+from tests.classes import TestCaseWithoutLogs
+
+from mdbackup._commands.backup import _run_tasks
+from mdbackup.actions.container import _clean_actions, register_action
+from mdbackup.tasks.tasks import Tasks
+from mdbackup.utils import write_data_file
+
+
+class RunTasksAsyncTests(TestCaseWithoutLogs):
+    def setUp(self):
+        super().setUp()
+        _clean_actions()
+        self.threads = {'hook': [], 'slow-echo': [], 'async-write': []}
+        register_action('slow-echo', self._slow_echo, output='stream')
+        register_action('async-write', self._async_write, expected_input='stream')
+        self.tmp = tempfile.TemporaryDirectory()
+        self.root = Path(self.tmp.name)
+        (self.root / 'backup').mkdir()
+        write_data_file(self.root / 'tasks.yaml', {
+            'engine': 'asyncio',
+            'tasks': [
+                {'name': f'task-{i}', 'actions': [{'slow-echo': str(i)}, {'async-write': {'path': f'result-{i}'}}]}
+                for i in range(6)
+            ],
+        })
+
+    def tearDown(self):
+        super().tearDown()
+        _clean_actions()
+        self.tmp.cleanup()
+
+    def _slow_echo(self, _, params):
+        self.threads['slow-echo'].append(threading.current_thread().name)
+        time.sleep(0.3)
+        return Popen(['echo', '-n', params], stdout=PIPE, stderr=PIPE)
+
+    async def _async_write(self, inp, params):
+        self.threads['async-write'].append(threading.current_thread().name)
+        reader = asyncio.StreamReader()
+        await asyncio.get_running_loop().connect_read_pipe(lambda: asyncio.StreamReaderProtocol(reader), inp)
+        data = await reader.read()
+        await asyncio.sleep(0.3)
+        path = Path(params['_backup_path']) / params['path']
+        path.write_bytes(data)
+        return path
+
+    def _record_hook(self, *_):
+        self.threads['hook'].append(threading.current_thread().name)
+
+    def test_asyncio_tasks_should_run_as_coroutines_and_block_only_in_the_executor(self):
+        start = time.monotonic()
+        with patch('mdbackup._commands.backup.run_hook', side_effect=self._record_hook):
+            results = _run_tasks(Tasks(self.root / 'tasks.yaml'), self.root / 'backup', None, {}, [],
+                                 max_parallel_tasks=6)
+
+        self.assertEqual({f'task-{i}': Path(f'result-{i}') for i in range(6)}, results)
+        self.assertEqual(b'3', (self.root / 'backup' / 'result-3').read_bytes())
+        self.assertLess(time.monotonic() - start, 6 * 0.6 / 2)
+        self.assertEqual(12, len(self.threads['hook']))
+        self.assertTrue(all(name.startswith('mdbackup-task') for name in self.threads['hook']))
+        self.assertTrue(all(name.startswith('mdbackup-task') for name in self.threads['slow-echo']))
+        self.assertEqual(['mdbackup-asyncio'] * 6, self.threads['async-write'])
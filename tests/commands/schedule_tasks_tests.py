@@ -0,0 +1,187 @@
+from concurrent.futures import ThreadPoolExecutor, wait
+from pathlib import Path
+from threading import Event, Lock
+from typing import Dict
+from unittest.mock import Mock, patch
+
+from tests.classes import TestCaseWithoutLogs
+
+from mdbackup._commands.backup import _run_tasks_definitions, _schedule_tasks
+from mdbackup.tasks.task import Task
+
+
+def _task(name: str, depends_on=None, stop_on_fail=True) -> Task:
+    return Task({
+        'name': name,
+        'actions': [],
+        'dependsOn': depends_on if depends_on is not None else [],
+        'stopOnFail': stop_on_fail,
+    })
+
+
+class ScheduleTasksTests(TestCaseWithoutLogs):
+    def setUp(self):
+        super().setUp()
+        self.executor = ThreadPoolExecutor(max_workers=4)
+        self.order = []
+        self.lock = Lock()
+        self.failing = set()
+
+    def tearDown(self):
+        super().tearDown()
+        self.executor.shutdown()
+
+    def _run(self, task: Task) -> Path:
+        with self.lock:
+            self.order.append(task.name)
+        if task.name in self.failing:
+            raise RuntimeError(f'{task.name} failed')
+        return Path(task.name)
+
+    def _submit(self, task: Task):
+        return self.executor.submit(self._run, task)
+
+    def test_no_tasks_should_return_empty_results(self):
+        results = _schedule_tasks([], self._submit, Mock(), 1)
+
+        self.assertEqual({}, results)
+
+    def test_sequential_tasks_should_run_in_definition_order(self):
+        tasks = [_task('a'), _task('b'), _task('c')]
+
+        results = _schedule_tasks(tasks, self._submit, Mock(), 1)
+
+        self.assertEqual(['a', 'b', 'c'], self.order)
+        self.assertEqual({'a': Path('a'), 'b': Path('b'), 'c': Path('c')}, results)
+
+    def test_dependencies_should_run_before_the_task(self):
+        tasks = [_task('a', ['c']), _task('b', ['a']), _task('c')]
+
+        _schedule_tasks(tasks, self._submit, Mock(), 1)
+
+        self.assertEqual(['c', 'a', 'b'], self.order)
+
+    def test_independent_tasks_should_run_at_the_same_time(self):
+        started = [Event(), Event()]
+
+        def run(task: Task):
+            started[int(task.name)].set()
+            # Each task waits for the other one to start, will only finish if both run concurrently
+            if not started[1 - int(task.name)].wait(5):
+                raise TimeoutError(task.name)
+            return Path(task.name)
+
+        tasks = [_task('0'), _task('1')]
+
+        results = _schedule_tasks(tasks, lambda task: self.executor.submit(run, task), Mock(), 2)
+
+        self.assertEqual({'0': Path('0'), '1': Path('1')}, results)
+
+    def test_failed_task_without_stop_on_fail_should_have_none_as_result(self):
+        self.failing.add('a')
+        tasks = [_task('a', stop_on_fail=False), _task('b')]
+
+        results = _schedule_tasks(tasks, self._submit, Mock(), 1)
+
+        self.assertEqual({'a': None, 'b': Path('b')}, results)
+
+    def test_failed_task_with_stop_on_fail_should_raise_and_not_run_more_tasks(self):
+        self.failing.add('a')
+        tasks = [_task('a'), _task('b')]
+
+        with self.assertRaisesRegex(RuntimeError, 'a failed'):
+            _schedule_tasks(tasks, self._submit, Mock(), 1)
+
+        self.assertEqual(['a'], self.order)
+
+    def test_task_with_failed_dependency_should_be_skipped(self):
+        self.failing.add('a')
+        skip = Mock(return_value=Exception('skipped'))
+        tasks = [_task('a', stop_on_fail=False), _task('b', ['a'], stop_on_fail=False), _task('c', ['b'])]
+
+        with self.assertRaisesRegex(Exception, 'skipped'):
+            _schedule_tasks(tasks, self._submit, skip, 1)
+
+        self.assertEqual(['a'], self.order)
+        self.assertEqual(2, skip.call_count)
+        self.assertEqual(['a'], skip.call_args_list[0][0][1])
+
+    def test_finished_tasks_should_not_run_again(self):
+        tasks = [_task('a'), _task('b', ['a']), _task('c')]
+
+        results = _schedule_tasks(tasks, self._submit, Mock(), 1, {'a': Path('previous-a')})
+
+        self.assertEqual(['b', 'c'], self.order)
+        self.assertEqual({'a': Path('previous-a'), 'b': Path('b'), 'c': Path('c')}, results)
+
+
+class RunTasksDefinitionsTests(TestCaseWithoutLogs):
+    def setUp(self):
+        super().setUp()
+        self.started = []
+        self.lock = Lock()
+
+    def _tasks(self, name: str):
+        return Mock(file_name=name)
+
+    def _run(self, tasks) -> Dict[str, Path]:
+        with self.lock:
+            self.started.append(tasks.file_name)
+        return {tasks.file_name: Path(tasks.file_name)}
+
+    def test_results_should_be_in_the_order_of_the_definitions(self):
+        release_first = Event()
+        all_tasks = [self._tasks('a'), self._tasks('b')]
+
+        def run(tasks):
+            if tasks.file_name == 'a' and not release_first.wait(5):
+                raise TimeoutError()
+            release_first.set()
+            return self._run(tasks)
+
+        results = _run_tasks_definitions(all_tasks, run, 2)
+
+        self.assertEqual(['a', 'b'], list(results.keys()))
+        self.assertEqual({'b': Path('b')}, results['b'][1])
+        self.assertEqual(['b', 'a'], self.started)
+
+    def test_failure_should_be_raised_without_waiting_for_earlier_definitions(self):
+        release_first = Event()
+        all_tasks = [self._tasks('a'), self._tasks('b')]
+
+        def run(tasks):
+            if tasks.file_name == 'b':
+                raise RuntimeError('b failed')
+            # Only finishes once the failure has been noticed
+            if not release_first.wait(5):
+                raise TimeoutError()
+            return self._run(tasks)
+
+        def on_failure(*_):
+            release_first.set()
+
+        with patch('mdbackup._commands.backup.wait', side_effect=lambda *args, **kwargs: (
+                _wait_and_call(on_failure, *args, **kwargs))):
+            with self.assertRaisesRegex(RuntimeError, 'b failed'):
+                _run_tasks_definitions(all_tasks, run, 2)
+
+        self.assertEqual(['a'], self.started)
+
+    def test_failure_should_cancel_the_definitions_that_did_not_start(self):
+        all_tasks = [self._tasks('a'), self._tasks('b'), self._tasks('c')]
+
+        def run(tasks):
+            if tasks.file_name == 'a':
+                raise RuntimeError('a failed')
+            return self._run(tasks)
+
+        with self.assertRaisesRegex(RuntimeError, 'a failed'):
+            _run_tasks_definitions(all_tasks, run, 1)
+
+        self.assertEqual([], self.started)
+
+
+def _wait_and_call(callback, *args, **kwargs):
+    result = wait(*args, **kwargs)
+    callback()
+    return result
@@ -0,0 +1,121 @@
+from concurrent.futures import as_completed, ThreadPoolExecutor
+import mmap
+import os
+from pathlib import Path
+import tempfile
+from unittest.mock import Mock, patch
+
+from tests.classes import TestCaseWithoutLogs
+
+from mdbackup._commands import verify
+from mdbackup._commands.backup import CATALOG_FILE_NAME
+from mdbackup._commands.verify import main_verify, verify_backup
+from mdbackup.actions.builtin.file import action_copy_file
+from mdbackup.catalog import Catalog
+from mdbackup.hashing import hash_file
+from mdbackup.utils import write_data_file
+
+
+class VerifyTests(TestCaseWithoutLogs):
+    def setUp(self):
+        super().setUp()
+        self.tmp = tempfile.TemporaryDirectory()
+        self.root = Path(self.tmp.name).resolve()
+        self.backup = self.root / 'backups' / '2024-01-01T00:00'
+        self.backup.mkdir(parents=True)
+        self.source = self.root / 'source'
+        self.source.mkdir()
+        catalog = Catalog(self.backup / CATALOG_FILE_NAME, self.backup)
+        for i, name in enumerate(('data/small', 'data/big', 'other')):
+            (self.source / Path(name).name).write_bytes(os.urandom(1024 * (i + 1)))
+            action_copy_file(None, {
+                'from': self.source / Path(name).name,
+                'to': name,
+                'mkdirParents': True,
+                '_backup_path': self.backup,
+                '_catalog': catalog,
+                'hashAlgorithm': 'blake2b',
+            })
+        catalog.close()
+        write_data_file(self.backup / '.manifest.yaml', {
+            'tasksDefinitions': {
+                'tasks.yaml': {
+                    'tasks': [{'name': 'data', 'result': 'data'}, {'name': 'other', 'result': 'other'}],
+                },
+            },
+        })
+        self.config = Mock(backups_path=self.root / 'backups')
+
+    def tearDown(self):
+        super().tearDown()
+        self.tmp.cleanup()
+
+    def test_verify_should_check_the_files_of_each_task(self):
+        verifications = {verification.task: verification for verification in verify_backup(self.backup, workers=2)}
+
+        self.assertEqual(2, verifications['tasks.yaml/data'].files)
+        self.assertEqual(1024 * 3, verifications['tasks.yaml/data'].size)
+        self.assertEqual(1, verifications['tasks.yaml/other'].files)
+        self.assertTrue(all(len(verification.mismatches) == 0 for verification in verifications.values()))
+        self.assertTrue(main_verify(self.config, self.backup, workers=2))
+
+    def test_verify_should_report_the_files_that_do_not_match(self):
+        with open(self.backup / 'data' / 'big', 'r+b') as file:
+            file.write(b'broken')
+        (self.backup / 'other').unlink()
+
+        verifications = {verification.task: verification for verification in verify_backup(self.backup, workers=2)}
+
+        self.assertListEqual([(str(self.backup / 'data' / 'big'), 'hash does not match')],
+                             verifications['tasks.yaml/data'].mismatches)
+        self.assertListEqual([(str(self.backup / 'other'), 'file does not exist')],
+                             verifications['tasks.yaml/other'].mismatches)
+        self.assertFalse(main_verify(self.config, self.backup, workers=2))
+
+    def test_verify_should_submit_the_files_of_all_tasks_before_waiting_for_them(self):
+        submitted = []
+        waited = []
+
+        class Executor(ThreadPoolExecutor):
+            def submit(self, fn, *args, **kwargs):
+                submitted.append(args[0])
+                return super().submit(fn, *args, **kwargs)
+
+        def wait(futures):
+            waited.append(len(submitted))
+            return as_completed(futures)
+
+        with patch.object(verify, 'ProcessPoolExecutor', Executor), \
+                patch.object(verify, 'as_completed', side_effect=wait), \
+                patch.object(verify, '_BATCH_FILES', 1):
+            verifications = verify_backup(self.backup, workers=2)
+
+        self.assertEqual([3], waited)
+        self.assertEqual(['tasks.yaml/data', 'tasks.yaml/other'], [verification.task for verification in verifications])
+        self.assertEqual([2, 1], [verification.files for verification in verifications])
+
+    def test_verify_without_hashes_should_fail(self):
+        catalog = Catalog(self.backup / CATALOG_FILE_NAME, self.backup)
+        for name in ('data/small', 'data/big', 'other'):
+            catalog.add(self.backup / name, (self.backup / name).stat())
+        catalog.close()
+
+        self.assertEqual([], verify_backup(self.backup, workers=2))
+        self.assertFalse(main_verify(self.config, self.backup, workers=2))
+
+    def test_verify_file_should_read_the_big_files_using_mmap(self):
+        path = self.root / 'big'
+        path.write_bytes(os.urandom(mmap.PAGESIZE * 3 + 100))
+        file_hash = hash_file(path, 'sha256')
+
+        with patch.object(verify, '_MMAP_MIN_SIZE', mmap.PAGESIZE), \
+                patch.object(verify, '_MMAP_WINDOW_SIZE', mmap.PAGESIZE):
+            self.assertIsNone(verify._verify_file(str(path), path.stat().st_size, file_hash))
+            with open(path, 'r+b') as file:
+                file.seek(mmap.PAGESIZE * 3)
+                file.write(b'broken')
+            self.assertEqual('hash does not match', verify._verify_file(str(path), path.stat().st_size, file_hash))
+
+    def test_verify_outside_of_the_backups_path_should_raise(self):
+        with self.assertRaises(ValueError):
+            main_verify(self.config, self.source)
@@ -0,0 +1,31 @@
+import hashlib
+from pathlib import Path
+import tempfile
+
+from tests.classes import TestCaseWithoutLogs
+
+from mdbackup.hashing import format_hash, hash_algorithm_of, hash_file, new_hasher
+
+
+class HashingTests(TestCaseWithoutLogs):
+    def test_hashes_should_be_prefixed_with_the_algorithm(self):
+        hasher = new_hasher('sha256')
+        hasher.update(b'hello')
+
+        file_hash = format_hash('sha256', hasher)
+
+        self.assertEqual(f'sha256:{hashlib.sha256(b"hello").hexdigest()}', file_hash)
+        self.assertEqual('sha256', hash_algorithm_of(file_hash))
+        self.assertIsNone(hash_algorithm_of(None))
+
+    def test_hash_file_should_hash_the_contents_of_the_file(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = Path(tmp) / 'file'
+            path.write_bytes(b'hello' * 1024 * 1024)
+
+            self.assertEqual(f'blake2b:{hashlib.blake2b(path.read_bytes(), digest_size=32).hexdigest()}',
+                             hash_file(path, 'blake2b'))
+
+    def test_unknown_algorithms_should_raise(self):
+        with self.assertRaises(ValueError):
+            new_hasher('md5')
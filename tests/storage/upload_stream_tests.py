@@ -0,0 +1,137 @@
+from ftplib import FTP
+import io
+import os
+from pathlib import Path
+from unittest.mock import MagicMock, Mock, patch
+
+from tests.classes import TestCaseWithoutLogs
+
+from mdbackup.actions.builtin.cloud import _CountingStream
+from mdbackup.config import StorageConfig
+from mdbackup.storage import load_backblaze_storage, load_ftp_storage, load_s3_storage, load_sftp_storage
+
+
+class UploadStreamTestCase(TestCaseWithoutLogs):
+    def setUp(self):
+        super().setUp()
+        self.data = os.urandom(1024 * 100 + 17)
+        self.stream = _CountingStream(io.BytesIO(self.data))
+
+    def _load(self, loader):
+        try:
+            return loader()
+        except ImportError as e:
+            self.skipTest(str(e))
+
+    def assert_chunks(self, chunks, chunk_size: int):
+        self.assertEqual(self.data, b''.join(chunks))
+        self.assertTrue(all(len(chunk) == chunk_size for chunk in chunks[:-1]))
+        self.assertLessEqual(len(chunks[-1]), chunk_size)
+        self.assertEqual(len(self.data), self.stream.size)
+
+
+class FTPUploadStreamTests(UploadStreamTestCase):
+    def test_upload_stream_should_send_the_stream_in_blocks(self):
+        ftp_storage = load_ftp_storage(False)
+        conn = FTP()
+        conn.voidcmd = Mock()
+        conn.voidresp = Mock()
+        conn.cwd = Mock()
+        conn.close = Mock()
+        conn.transfercmd = MagicMock()
+        data_conn = conn.transfercmd.return_value.__enter__.return_value
+        chunks = []
+        data_conn.sendall.side_effect = chunks.append
+
+        with patch.object(ftp_storage, '_create_connection', return_value=conn):
+            storage = ftp_storage(StorageConfig({'type': 'ftp', 'backupsPath': '/backups', 'host': 'localhost'}))
+            storage.upload_stream(self.stream, 'file.tar', 'backup/folder')
+
+        conn.cwd.assert_called_with(str(Path('/backups/backup/folder')))
+        conn.transfercmd.assert_called_once_with('STOR file.tar', None)
+        self.assert_chunks(chunks, 8192)
+
+
+class SFTPUploadStreamTests(UploadStreamTestCase):
+    def test_upload_stream_should_write_the_stream_without_confirming_the_size(self):
+        sftp_storage = self._load(load_sftp_storage)
+        from paramiko import SFTPClient
+        conn = Mock()
+        conn.putfo.side_effect = lambda *args, **kwargs: SFTPClient.putfo(conn, *args, **kwargs)
+        conn._transfer_with_callback.side_effect = \
+            lambda **kwargs: SFTPClient._transfer_with_callback(conn, **kwargs)
+        conn.file = MagicMock()
+        remote_file = conn.file.return_value.__enter__.return_value
+        chunks = []
+        remote_file.write.side_effect = lambda data: chunks.append(data) if len(data) > 0 else None
+
+        with patch.object(sftp_storage, '_create_connection', return_value=conn):
+            storage = sftp_storage(StorageConfig({'type': 'sftp', 'backupsPath': '/backups', 'host': 'localhost'}))
+            storage.upload_stream(self.stream, 'file.tar', 'backup/folder')
+
+        conn.chdir.assert_called_with(str(Path('/backups/backup/folder')))
+        conn.file.assert_called_once_with('file.tar', 'wb')
+        conn.stat.assert_not_called()
+        self.assert_chunks(chunks, 32768)
+
+
+class S3UploadStreamTests(UploadStreamTestCase):
+    def test_upload_stream_should_use_multipart_uploads_of_the_chunk_size(self):
+        s3_storage = self._load(load_s3_storage)
+        chunks = []
+
+        def upload_fileobj(stream, bucket, key, **kwargs):
+            chunk_size = kwargs['Config'].multipart_chunksize
+            data = stream.read(chunk_size)
+            while len(data) > 0:
+                chunks.append(data)
+                data = stream.read(chunk_size)
+
+        with patch('mdbackup.storage.s3.boto3') as boto3:
+            client = boto3.client.return_value
+            client.upload_fileobj.side_effect = upload_fileobj
+            storage = s3_storage(StorageConfig({
+                'type': 's3',
+                'backupsPath': '/backups',
+                'bucket': 'bucket',
+                'accessKeyId': 'id',
+                'accessSecretKey': 'secret',
+                'multipartChunkSize': 1024 * 16,
+            }))
+            storage.upload_stream(self.stream, 'file.tar', 'backup/folder/')
+
+        args = client.upload_fileobj.call_args
+        self.assertEqual(('bucket', 'backups/backup/folder/file.tar'), args[0][1:])
+        self.assertEqual('application/octet-stream', args[1]['ExtraArgs']['ContentType'])
+        self.assert_chunks(chunks, 1024 * 16)
+
+
+class B2UploadStreamTests(UploadStreamTestCase):
+    def test_upload_stream_should_upload_each_chunk_as_a_write_intent(self):
+        b2_storage = self._load(load_backblaze_storage)
+        chunks = []
+
+        def create_file_stream(write_intents, **_):
+            for write_intent in write_intents:
+                self.assertEqual(sum(len(chunk) for chunk in chunks), write_intent.destination_offset)
+                self.assertEqual(len(write_intent.outbound_source.data_bytes), write_intent.length)
+                chunks.append(write_intent.outbound_source.data_bytes)
+
+        with patch('mdbackup.storage.backblaze.B2Api') as b2_api:
+            bucket = b2_api.return_value.get_bucket_by_name.return_value
+            bucket.create_file_stream.side_effect = create_file_stream
+            storage = b2_storage(StorageConfig({
+                'type': 'b2',
+                'backupsPath': '/backups',
+                'bucket': 'bucket',
+                'keyId': 'id',
+                'appKey': 'key',
+                'multipartChunkSize': 1024 * 16,
+            }))
+            storage.upload_stream(self.stream, 'file.tar', 'backup/folder/')
+
+        args = bucket.create_file_stream.call_args
+        self.assertEqual('backups/backup/folder/file.tar', args[1]['file_name'])
+        self.assertEqual('application/octet-stream', args[1]['content_type'])
+        self.assertEqual(1024 * 16, args[1]['recommended_upload_part_size'])
+        self.assert_chunks(chunks, 1024 * 16)
@@ -0,0 +1,79 @@
+from pathlib import Path
+import tempfile
+
+from tests.classes import TestCaseWithoutLogs
+
+from mdbackup.tasks.journal import Journal
+
+
+class JournalTests(TestCaseWithoutLogs):
+    def setUp(self):
+        super().setUp()
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = Path(self.tmp.name) / '.journal'
+
+    def tearDown(self):
+        super().tearDown()
+        self.tmp.cleanup()
+
+    def test_load_unexisting_journal_should_return_false(self):
+        journal = Journal(self.path)
+
+        self.assertFalse(journal.exists())
+        self.assertFalse(journal.load())
+
+    def test_started_journal_should_be_loaded_with_the_backup_name(self):
+        Journal(self.path).start('2020-01-01T00:00')
+
+        journal = Journal(self.path)
+
+        self.assertTrue(journal.load())
+        self.assertEqual('2020-01-01T00:00', journal.backup_name)
+        self.assertFalse(journal.has_finished_tasks())
+
+    def test_only_loaded_journals_should_be_resumed(self):
+        writer = Journal(self.path)
+        writer.start('backup')
+        journal = Journal(self.path)
+
+        self.assertFalse(writer.resumed)
+        self.assertTrue(journal.load())
+        self.assertTrue(journal.resumed)
+
+    def test_finished_tasks_should_be_loaded(self):
+        writer = Journal(self.path)
+        writer.start('backup')
+        writer.task_finished('a.yaml', 'task 1', Path('inside/file'), [{'action': 'to-file'}])
+        writer.task_finished('b.yaml', 'task 2', Path('other'))
+
+        journal = Journal(self.path)
+        journal.load()
+
+        self.assertTrue(journal.has_finished_tasks())
+        self.assertEqual({'task 1': (Path('inside/file'), [{'action': 'to-file'}])}, journal.finished_tasks('a.yaml'))
+        self.assertEqual({'task 2': (Path('other'), None)}, journal.finished_tasks('b.yaml'))
+        self.assertEqual({}, journal.finished_tasks('c.yaml'))
+
+    def test_start_should_remove_previous_contents(self):
+        writer = Journal(self.path)
+        writer.start('backup')
+        writer.task_finished('a.yaml', 'task 1', Path('file'))
+
+        Journal(self.path).start('new-backup')
+        journal = Journal(self.path)
+        journal.load()
+
+        self.assertEqual('new-backup', journal.backup_name)
+        self.assertFalse(journal.has_finished_tasks())
+
+    def test_truncated_line_should_be_ignored(self):
+        writer = Journal(self.path)
+        writer.start('backup')
+        writer.task_finished('a.yaml', 'task 1', Path('file'))
+        with open(self.path, 'a') as journal_file:
+            journal_file.write('{"tasksDefinition": "a.yaml", "task": "ta')
+
+        journal = Journal(self.path)
+
+        self.assertTrue(journal.load())
+        self.assertEqual(['task 1'], list(journal.finished_tasks('a.yaml').keys()))